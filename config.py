@@ -3,12 +3,28 @@
 # ===========================================
 
 import os
+import importlib.util
 from pathlib import Path
 from dotenv import load_dotenv
 
 # .env dosyasını yükle
 load_dotenv()
 
+def configure_rarfile(rarfile):
+    """rarfile ilk içe aktarıldığında çağrılır: Windows'ta WinRAR kurulumunu bulur"""
+    if os.name != 'nt':
+        return
+    possible_paths = [
+        r"C:\Program Files\WinRAR\UnRAR.exe",
+        r"C:\Program Files (x86)\WinRAR\UnRAR.exe",
+        r"C:\Program Files\WinRAR\Rar.exe",
+        r"C:\Program Files (x86)\WinRAR\Rar.exe"
+    ]
+    for path in possible_paths:
+        if os.path.exists(path):
+            rarfile.UNRAR_TOOL = path
+            break
+
 class Config:
     """Temel konfigürasyon sınıfı"""
     
@@ -24,6 +40,10 @@ class Config:
     # ===========================================
     DEFAULT_PASSWORD = os.environ.get('DEFAULT_PASSWORD', '1234')
     PASSWORD_HASH = None  # Runtime'da generate_password_hash ile ayarlanacak
+    # Cihazlar arası isteklerin paylaşılan anahtarı - GEREKLİ: tüm cihazlarda aynı, tahmin edilemez bir değer verin.
+    # Boşsa varsayılan paroladan türetilir; bu değeri herkes hesaplayabilir, yani eş uç noktaları fiilen açık kalır
+    # (başlangıçta uyarı yazılır).
+    PEER_TOKEN = os.environ.get('PEER_TOKEN', '')
     SESSION_PERMANENT = False
     SESSION_TYPE = 'filesystem'
     
@@ -46,6 +66,61 @@ class Config:
     
     # Temp dosya ayarları
     TEMP_FOLDER = os.environ.get('TEMP_FOLDER') or os.path.join(SHARED_FOLDER, '.temp')
+
+    # Uygulama verileri (önbellekler, indeksler) - paylaşım klasörünün dışında tutulur
+    DATA_FOLDER = os.environ.get('DATA_FOLDER') or os.path.join(
+        str(Path.home()), '.disk_management'
+    )
+
+    # ===========================================
+    # Küçük Resim (Thumbnail) Ayarları
+    # ===========================================
+    THUMBNAIL_ENABLED = os.environ.get('THUMBNAIL_ENABLED', 'true').lower() == 'true'
+    THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 256))  # Liste görünümü
+    THUMBNAIL_PREVIEW_SIZE = int(os.environ.get('THUMBNAIL_PREVIEW_SIZE', 1600))  # Resim görüntüleyici
+    THUMBNAIL_FORMAT = os.environ.get('THUMBNAIL_FORMAT', 'WEBP').upper()  # WEBP veya JPEG
+    THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', 80))
+    THUMBNAIL_CACHE_DIR = os.environ.get('THUMBNAIL_CACHE_DIR') or os.path.join(DATA_FOLDER, 'thumbnails')
+    THUMBNAIL_CACHE_SIZE = int(os.environ.get('THUMBNAIL_CACHE_SIZE', 512 * 1024 * 1024))  # 512MB
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+    THUMBNAIL_MAX_AGE = int(os.environ.get('THUMBNAIL_MAX_AGE', 365 * 24 * 3600))  # Cache-Control süresi
+
+    # ===========================================
+    # Arama ve Dosya İndeksi Ayarları
+    # ===========================================
+    SEARCH_ENABLED = os.environ.get('SEARCH_ENABLED', 'true').lower() == 'true'
+    PATH_INDEX_DB = os.environ.get('PATH_INDEX_DB') or os.path.join(DATA_FOLDER, 'path_index.db')
+    INDEX_CRAWL_WORKERS = int(os.environ.get('INDEX_CRAWL_WORKERS', 8))
+    SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', 1000))
+    CONTENT_INDEX_ENABLED = os.environ.get('CONTENT_INDEX_ENABLED', 'true').lower() == 'true'
+    CONTENT_INDEX_DB = os.environ.get('CONTENT_INDEX_DB') or os.path.join(DATA_FOLDER, 'content_index.db')
+    CONTENT_INDEX_WORKERS = int(os.environ.get('CONTENT_INDEX_WORKERS', 2))
+    CONTENT_INDEX_MAX_FILE_SIZE = int(os.environ.get('CONTENT_INDEX_MAX_FILE_SIZE', 20 * 1024 * 1024))  # 20MB
+    CONTENT_INDEX_IO_LIMIT = int(os.environ.get('CONTENT_INDEX_IO_LIMIT', 20 * 1024 * 1024))  # bayt/sn, 0 = sınırsız
+    
+    # ===========================================
+    # Yinelenen Dosya Ayarları
+    # ===========================================
+    DUPLICATE_STATE_FILE = os.environ.get('DUPLICATE_STATE_FILE') or os.path.join(DATA_FOLDER, 'duplicates.json')
+    DUPLICATE_WORKERS = int(os.environ.get('DUPLICATE_WORKERS', 4))
+    DUPLICATE_MIN_SIZE = int(os.environ.get('DUPLICATE_MIN_SIZE', 1024))  # Bundan küçük dosyalar yok sayılır
+    
+    # ===========================================
+    # Parça Deposu Ayarları
+    # ===========================================
+    # Yüklemeler içerik tanımlı parçalara bölünür, aynı parça bir kez saklanır
+    CHUNK_STORE_ENABLED = os.environ.get('CHUNK_STORE_ENABLED', 'false').lower() == 'true'
+    CHUNK_STORE_FOLDER = os.environ.get('CHUNK_STORE_FOLDER') or os.path.join(DATA_FOLDER, 'chunks')
+    CHUNK_AVG_SIZE = int(os.environ.get('CHUNK_AVG_SIZE', 32 * 1024))  # ortalama parça boyutu (2'nin kuvvetine yuvarlanır)
+    CHUNK_PACK_SIZE = int(os.environ.get('CHUNK_PACK_SIZE', 256 * 1024 * 1024))  # paket dosyası boyutu
+    CHUNK_COMPRESS = os.environ.get('CHUNK_COMPRESS', 'true').lower() == 'true'  # zstandard kuruluysa
+    CHUNK_TIMEOUT = int(os.environ.get('CHUNK_TIMEOUT', 30))  # eşten parça çekme zaman aşımı
+    
+    # ===========================================
+    # Depolama Analizi Ayarları
+    # ===========================================
+    ANALYTICS_REFRESH_INTERVAL = float(os.environ.get('ANALYTICS_REFRESH_INTERVAL', 5))  # saniye
+    ANALYTICS_TOP_N = int(os.environ.get('ANALYTICS_TOP_N', 20))
     
     # ===========================================
     # Ağ ve Sunucu Ayarları
@@ -60,34 +135,26 @@ class Config:
     # Timeout ayarları
     NETWORK_TIMEOUT = int(os.environ.get('NETWORK_TIMEOUT', 10))
     DISCOVERY_TIMEOUT = int(os.environ.get('DISCOVERY_TIMEOUT', 5))
+    # Bu süre boyunca yeni duyuru gelmezse keşif beklemeden biter (saniye)
+    DISCOVERY_QUIET_PERIOD = float(os.environ.get('DISCOVERY_QUIET_PERIOD', 0.25))
+    
+    # Ağ kimliği (yerel/genel IP) önbelleği; genel IP arka planda bulunur ve dosyada saklanır
+    NETWORK_IDENTITY_FILE = os.environ.get('NETWORK_IDENTITY_FILE') or os.path.join(DATA_FOLDER, 'network_identity.json')
+    LOCAL_IP_TTL = int(os.environ.get('LOCAL_IP_TTL', 300))  # arayüz değişikliği olayı yoksa yenileme (saniye)
+    PUBLIC_IP_TTL = int(os.environ.get('PUBLIC_IP_TTL', 3600))
+    PUBLIC_IP_TIMEOUT = float(os.environ.get('PUBLIC_IP_TIMEOUT', 5))
     
     # ===========================================
     # RAR İşlemci Ayarları
     # ===========================================
     # RAR işlemci servisi etkin mi? (Docker tabanlı çözücüyü kullanılacak mı?)
     RAR_PROCESSOR_ENABLED = False  # Disable the RAR processor
-    HAS_RARFILE = False
+    # rarfile burada içe aktarılmaz (açılışı yavaşlatır); yalnızca kurulu olup olmadığına bakılır.
+    # WinRAR yolu ilk kullanımda configure_rarfile ile ayarlanır
+    HAS_RARFILE = importlib.util.find_spec('rarfile') is not None
     HAS_UNRAR = False
 
-    try:
-        import rarfile
-        HAS_RARFILE = True
-        
-        # On Windows, try to find WinRAR installation
-        if os.name == 'nt':
-            possible_paths = [
-                r"C:\Program Files\WinRAR\UnRAR.exe",
-                r"C:\Program Files (x86)\WinRAR\UnRAR.exe",
-                r"C:\Program Files\WinRAR\Rar.exe",
-                r"C:\Program Files (x86)\WinRAR\Rar.exe"
-            ]
-            
-            for path in possible_paths:
-                if os.path.exists(path):
-                    rarfile.UNRAR_TOOL = path
-                    break
-    except ImportError:
-        HAS_RARFILE = False
+    if not HAS_RARFILE:
         print("WARNING: 'rarfile' package not found. RAR support will be disabled.")
         print("Install with: pip install rarfile")
     
@@ -125,6 +192,17 @@ class Config:
     RELAY_ENABLED = os.environ.get('RELAY_ENABLED', 'false').lower() == 'true'
     RELAY_CAPACITY = int(os.environ.get('RELAY_CAPACITY', 100))
     RELAY_REGION = os.environ.get('RELAY_REGION', 'auto')
+    RELAY_CHUNK_SIZE = int(os.environ.get('RELAY_CHUNK_SIZE', 64 * 1024))  # aktarım başına tampon
+    RELAY_TIMEOUT = int(os.environ.get('RELAY_TIMEOUT', 30))  # hedef cihaz bu kadar sessiz kalırsa aktarım kesilir
+    
+    # ===========================================
+    # Sağlık Kontrolü Ayarları
+    # ===========================================
+    # RAR işlemci ve relay sunucuları arka planda yoklanır; istekler yalnızca son sonucu okur
+    HEALTH_CHECK_INTERVAL = float(os.environ.get('HEALTH_CHECK_INTERVAL', 30))
+    HEALTH_CHECK_TIMEOUT = float(os.environ.get('HEALTH_CHECK_TIMEOUT', 2))
+    HEALTH_CHECK_MAX_BACKOFF = float(os.environ.get('HEALTH_CHECK_MAX_BACKOFF', 300))  # erişilemeyen hedef için en uzun bekleme
+    HEALTH_CHECK_WORKERS = int(os.environ.get('HEALTH_CHECK_WORKERS', 4))
     
     # ===========================================
     # Cihaz Keşfi Ayarları
@@ -132,12 +210,78 @@ class Config:
     DEVICE_DISCOVERY_ENABLED = os.environ.get('DEVICE_DISCOVERY_ENABLED', 'true').lower() == 'true'
     DEVICE_TIMEOUT = int(os.environ.get('DEVICE_TIMEOUT', 300))  # 5 dakika
     DEVICE_CLEANUP_INTERVAL = int(os.environ.get('DEVICE_CLEANUP_INTERVAL', 60))  # 1 dakika
+    DEVICE_ONLINE_WINDOW = int(os.environ.get('DEVICE_ONLINE_WINDOW', 60))  # bu süre haber alınmazsa çevrimdışı
+    # Son bilinen eşler; açılışta cihaz listesi bu dosyadan hazır gelir
+    PEERS_FILE = os.environ.get('PEERS_FILE') or os.path.join(DATA_FOLDER, 'peers.json')
+    
+    # Gossip üyeliği (SWIM): mDNS'in ulaşamadığı ağlardaki eşler de cihaz listesine girer
+    GOSSIP_ENABLED = os.environ.get('GOSSIP_ENABLED', 'true').lower() == 'true'
+    GOSSIP_NODE_ID = os.environ.get('GOSSIP_NODE_ID')  # boşsa "bilgisayar-adı:port"
+    # Katılım için bilinen eşler, virgülle ayrılmış host:port listesi
+    GOSSIP_SEEDS = [s.strip() for s in os.environ.get('GOSSIP_SEEDS', '').split(',') if s.strip()]
+    GOSSIP_INTERVAL = float(os.environ.get('GOSSIP_INTERVAL', 1.0))  # protokol periyodu (saniye)
+    GOSSIP_PING_TIMEOUT = float(os.environ.get('GOSSIP_PING_TIMEOUT', 0.5))
+    GOSSIP_INDIRECT_PROBES = int(os.environ.get('GOSSIP_INDIRECT_PROBES', 3))  # dolaylı yoklama yapan üye sayısı
+    GOSSIP_SUSPECT_MULT = int(os.environ.get('GOSSIP_SUSPECT_MULT', 4))  # şüpheli süresi = kat * log2(n) periyot
+    GOSSIP_RETRANSMIT_MULT = int(os.environ.get('GOSSIP_RETRANSMIT_MULT', 3))  # güncelleme tekrar sayısı = kat * log2(n)
+    
+    # Küme depolama: yüklemeler boş kotaya göre ağırlıklı tutarlı özetleme ile eşlere dağıtılır
+    CLUSTER_STORAGE_ENABLED = os.environ.get('CLUSTER_STORAGE_ENABLED', 'false').lower() == 'true'
+    CLUSTER_REPLICATION = int(os.environ.get('CLUSTER_REPLICATION', 2))  # her dosyanın kopya sayısı
+    CLUSTER_FOLDER = os.environ.get('CLUSTER_FOLDER', 'cluster')  # paylaşılan klasör içinde
+    CLUSTER_VNODE_SIZE = int(os.environ.get('CLUSTER_VNODE_SIZE', 64 * 1024 * 1024))  # halkada bir nokta başına boş alan
+    CLUSTER_MAX_VNODES = int(os.environ.get('CLUSTER_MAX_VNODES', 1024))
+    CLUSTER_REFRESH_INTERVAL = float(os.environ.get('CLUSTER_REFRESH_INTERVAL', 10))  # eşlerin kota/gecikme yoklaması (saniye)
+    CLUSTER_TIMEOUT = int(os.environ.get('CLUSTER_TIMEOUT', 30))  # düğümler arası aktarım zaman aşımı
     
     # ===========================================
     # Dosya İzleme Ayarları
     # ===========================================
     FILE_WATCHER_ENABLED = os.environ.get('FILE_WATCHER_ENABLED', 'true').lower() == 'true'
     SYNC_ENABLED = os.environ.get('SYNC_ENABLED', 'false').lower() == 'true'
+    EVENT_DEBOUNCE_WINDOW = float(os.environ.get('EVENT_DEBOUNCE_WINDOW', 1.0))  # saniye sessizlik
+    EVENT_MAX_DELAY = float(os.environ.get('EVENT_MAX_DELAY', 30.0))  # saniye
+    EVENT_BATCH_SIZE = int(os.environ.get('EVENT_BATCH_SIZE', 500))
+    # inotify izleme bütçesi; boşsa sistem limitinin yarısı kullanılır. Bütçeyi aşan
+    # klasörler tarama (snapshot-diff) ile izlenir
+    INOTIFY_MAX_WATCHES = int(os.environ['INOTIFY_MAX_WATCHES']) if os.environ.get('INOTIFY_MAX_WATCHES') else None
+    CHANGE_POLL_INTERVAL = float(os.environ.get('CHANGE_POLL_INTERVAL', 2.0))  # saniye
+    CHANGE_POLL_DIRS = int(os.environ.get('CHANGE_POLL_DIRS', 200))  # tur başına taranan klasör
+    WATCH_REPLAN_INTERVAL = float(os.environ.get('WATCH_REPLAN_INTERVAL', 900))  # saniye
+    JOURNAL_DB = os.environ.get('JOURNAL_DB') or os.path.join(DATA_FOLDER, 'change_journal.db')
+    JOURNAL_RETENTION_DAYS = float(os.environ.get('JOURNAL_RETENTION_DAYS', 30))
+    JOURNAL_COMPACT_INTERVAL = float(os.environ.get('JOURNAL_COMPACT_INTERVAL', 3600))  # saniye
+    
+    # Eşlere değişiklik bildirimi (toplu, bağlantı havuzlu)
+    PEER_NOTIFY_BATCH_SIZE = int(os.environ.get('PEER_NOTIFY_BATCH_SIZE', 1000))
+    PEER_NOTIFY_INTERVAL = float(os.environ.get('PEER_NOTIFY_INTERVAL', 1.0))  # saniye
+    PEER_NOTIFY_CONCURRENCY = int(os.environ.get('PEER_NOTIFY_CONCURRENCY', 8))
+    PEER_NOTIFY_TIMEOUT = float(os.environ.get('PEER_NOTIFY_TIMEOUT', 5.0))  # saniye
+    PEER_NOTIFY_MAX_QUEUE = int(os.environ.get('PEER_NOTIFY_MAX_QUEUE', 100000))  # eş başına bekleyen değişiklik
+
+    # ===========================================
+    # Delta Senkronizasyon Ayarları
+    # ===========================================
+    # Blok boyutu; 0 ise dosya boyutuna göre seçilir (yaklaşık karekökü, 2KB-128KB)
+    DELTA_BLOCK_SIZE = int(os.environ.get('DELTA_BLOCK_SIZE', 0))
+    DELTA_TIMEOUT = float(os.environ.get('DELTA_TIMEOUT', 30.0))  # saniye
+    # Merkle karşılaştırması dosya değişim zamanlarını da içersin mi (kapalıysa ad + boyut)
+    MERKLE_USE_MTIME = os.environ.get('MERKLE_USE_MTIME', 'true').lower() == 'true'
+    
+    # ===========================================
+    # Çoklu Kaynaklı İndirme Ayarları
+    # ===========================================
+    SWARM_CHUNK_SIZE = int(os.environ.get('SWARM_CHUNK_SIZE', 4 * 1024 * 1024))  # 4MB
+    SWARM_CONNECTIONS_PER_PEER = int(os.environ.get('SWARM_CONNECTIONS_PER_PEER', 2))
+    SWARM_TIMEOUT = float(os.environ.get('SWARM_TIMEOUT', 30.0))  # saniye
+    SWARM_MAX_FAILURES = int(os.environ.get('SWARM_MAX_FAILURES', 3))  # art arda hata sonrası eş bırakılır
+    
+    # ===========================================
+    # Birleşik Gezinme Ayarları (tüm cihazlarda listeleme/arama)
+    # ===========================================
+    FEDERATED_TIMEOUT = float(os.environ.get('FEDERATED_TIMEOUT', 3))  # bu sürede yanıt vermeyen eş "timeout" işaretlenir
+    FEDERATED_CACHE_TTL = float(os.environ.get('FEDERATED_CACHE_TTL', 10))  # eş yanıtları bu kadar saniye önbellekte
+    FEDERATED_MAX_WORKERS = int(os.environ.get('FEDERATED_MAX_WORKERS', 16))
     
     # ===========================================
     # Logging Ayarları
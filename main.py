@@ -1,33 +1,32 @@
 import os
 import sys
+import errno
 import time
+# Reference point of the --profile-startup report; set before the heavy imports below
+_startup_started = time.perf_counter()
 import json
 import socket
 import hashlib
 import zipfile
-import rarfile
-import requests
 import threading
 import subprocess
-import magic
 import argparse
 import shutil
-import psutil
 from datetime import datetime
 from functools import wraps
 from typing import List, Dict, Any, Optional, Union
 from pathlib import Path
+from urllib.parse import quote
 
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, session, abort, jsonify, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, session, abort, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.serving import run_simple
+from werkzeug.serving import make_server
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from werkzeug.middleware.proxy_fix import ProxyFix
-from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from zeroconf import ServiceInfo, Zeroconf, IPVersion
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -35,43 +34,72 @@ load_dotenv()
 
 # Import config after environment variables are loaded
 from config import Config
+from services.thumbnail_service import ThumbnailService
+from services.path_index import PathIndex
+from services.content_index import ContentIndex
+from services.duplicate_service import DuplicateService
+from services.analytics_service import AnalyticsService
+from services.event_bus import EventBus
+from services.change_detector import ChangeDetector
+from services.change_journal import ChangeJournal
+from services.peer_notifier import PeerNotifier
+from services.delta_sync import DeltaSync
+from services.merkle_tree import MerkleTree
+from services.swarm_download import SwarmDownloader
+from services.device_registry import DeviceRegistry
+from services.discovery_service import DiscoveryService
+from services.network_service import NetworkService
+from services.network_identity import NetworkIdentity
+from services.federated_browser import FederatedBrowser
+from services.relay_service import RelayService
+from services.health_checker import HealthChecker
+from services.gossip_membership import GossipMembership
+from services.cluster_storage import ClusterStorage
+from services.chunk_store import ChunkStore
+from utils.lazy_import import lazy_import
+from utils import wire, peer_auth
+from utils.startup_profile import StartupProfile
 
-try:
-    import netifaces
-    NETIFACES_AVAILABLE = True
-except ImportError:
-    NETIFACES_AVAILABLE = False
-    print("Warning: netifaces not available. Some network features may be limited.")
+# Not needed to serve the first request; imported when first used
+requests = lazy_import('requests')
+magic = lazy_import('magic')
 
-# Global variable for public IP
-PUBLIC_IP = None
+startup_profile = StartupProfile(_startup_started)
+_imports_done = time.perf_counter()
+startup_profile.record('imports', _startup_started, _imports_done)
+
+# Local and public addresses, resolved once in the background and cached
+network_identity = NetworkIdentity(Config.NETWORK_IDENTITY_FILE, local_ttl=Config.LOCAL_IP_TTL,
+                                   public_ttl=Config.PUBLIC_IP_TTL, timeout=Config.PUBLIC_IP_TIMEOUT)
+
+def on_health_change(name, healthy):
+    """Health checker callback: keep the relay server list in step with the probes"""
+    if any(server['url'] == name for server in RELAY_SERVERS):
+        update_relay_servers(name, 'active' if healthy else 'unavailable')
+
+# Periodic, pooled health probes of the RAR processor and relay servers; readers get the cached state
+health_checker = HealthChecker(
+    timeout=Config.HEALTH_CHECK_TIMEOUT,
+    max_backoff=Config.HEALTH_CHECK_MAX_BACKOFF,
+    max_workers=Config.HEALTH_CHECK_WORKERS,
+    on_change=on_health_change
+)
 
 # RAR Processor configuration
 RAR_PROCESSOR_ENABLED = os.environ.get('RAR_PROCESSOR_ENABLED', 'false').lower() == 'true'
 RAR_PROCESSOR_URL = os.environ.get('RAR_PROCESSOR_URL', 'http://localhost:5001')
 RAR_PROCESSOR_CONTAINER_NAME = "rar-processor"
 
-def check_rar_processor():
-    """Check if the RAR processor service is running and accessible."""
-    global RAR_PROCESSOR_ENABLED
-    
+def check_rar_processor(wait=0):
+    """Check if the RAR processor answered its latest health probe; no network call unless ``wait`` is given."""
     if not RAR_PROCESSOR_ENABLED:
-        print("RAR processor is disabled by configuration")
         return False
-        
-    try:
-        # Check if the RAR processor is accessible
-        response = requests.get(f"{RAR_PROCESSOR_URL}/health", timeout=2)
-        if response.status_code == 200:
-            print("RAR processor is running and accessible")
-            return True
-            
-    except requests.exceptions.RequestException as e:
-        print(f"RAR processor is not accessible: {str(e)}")
-        
-    RAR_PROCESSOR_ENABLED = False
-    print("RAR processor is not available. Some features may be limited.")
-    return False
+    return health_checker.is_healthy(RAR_PROCESSOR_CONTAINER_NAME, wait=wait)
+
+if RAR_PROCESSOR_ENABLED:
+    # An unreachable processor is probed with growing delays and picked up again once it is back
+    health_checker.register(RAR_PROCESSOR_CONTAINER_NAME, f"{RAR_PROCESSOR_URL}/health",
+                            interval=Config.HEALTH_CHECK_INTERVAL)
 
 def get_archive_contents_docker(archive_path, subpath=''):
     """Get archive contents using the Docker-based RAR processor."""
@@ -107,7 +135,6 @@ def get_archive_contents_docker(archive_path, subpath=''):
         traceback.print_exc()
         return None
 
-from zeroconf import ServiceInfo, Zeroconf, IPVersion
 from typing import List, Dict, Any, Optional, Union
 import io
 import tempfile
@@ -121,12 +148,64 @@ DEFAULT_PASSWORD = '1234'  # Default password
 # Ensure shared folder exists
 os.makedirs(SHARED_FOLDER, exist_ok=True)
 
+# Thumbnails for image listings, rendered in a process pool
+thumbnail_service = ThumbnailService(
+    Config.THUMBNAIL_CACHE_DIR,
+    size=Config.THUMBNAIL_SIZE,
+    fmt=Config.THUMBNAIL_FORMAT,
+    quality=Config.THUMBNAIL_QUALITY,
+    max_cache_bytes=Config.THUMBNAIL_CACHE_SIZE,
+    workers=Config.THUMBNAIL_WORKERS,
+    enabled=Config.THUMBNAIL_ENABLED,
+    max_archive_members=Config.MAX_ARCHIVE_ENTRIES
+)
+
+# Persistent metadata index behind /api/search, kept current by the file watcher
+path_index = PathIndex(SHARED_FOLDER, Config.PATH_INDEX_DB, workers=Config.INDEX_CRAWL_WORKERS)
+
+# Full-text index over file contents behind /api/search/content
+content_index = ContentIndex(
+    SHARED_FOLDER,
+    Config.CONTENT_INDEX_DB,
+    workers=Config.CONTENT_INDEX_WORKERS,
+    max_file_bytes=Config.CONTENT_INDEX_MAX_FILE_SIZE,
+    io_limit=Config.CONTENT_INDEX_IO_LIMIT,
+    enabled=Config.CONTENT_INDEX_ENABLED
+)
+
+# Staged duplicate finder; lists files from the path index when it is populated
+duplicate_service = DuplicateService(
+    SHARED_FOLDER,
+    Config.DUPLICATE_STATE_FILE,
+    workers=Config.DUPLICATE_WORKERS,
+    min_size=Config.DUPLICATE_MIN_SIZE,
+    path_index=path_index
+)
+
+# Usage reports over a columnar snapshot of the path index
+analytics_service = AnalyticsService(
+    path_index,
+    storage_limit=STORAGE_LIMIT,
+    refresh_interval=Config.ANALYTICS_REFRESH_INTERVAL
+)
+
+# Per-directory Merkle digests, so peers can find differing subtrees without listing everything
+merkle_tree = MerkleTree(path_index, use_mtime=Config.MERKLE_USE_MTIME, timeout=Config.DELTA_TIMEOUT)
+
 from datetime import datetime
 
 app = Flask(__name__, template_folder='templates')
 CORS(app)
 app.secret_key = os.urandom(24)  # For flash messages
-app.config['PASSWORD_HASH'] = generate_password_hash('1234')  # Default password hash
+app.config['PASSWORD_HASH'] = None  # Default password hash, see get_password_hash()
+_password_hash_lock = threading.Lock()
+
+def get_password_hash():
+    """Hash of the login password, derived on first use (it takes a noticeable fraction of a second)"""
+    with _password_hash_lock:
+        if app.config['PASSWORD_HASH'] is None:
+            app.config['PASSWORD_HASH'] = generate_password_hash(DEFAULT_PASSWORD)
+        return app.config['PASSWORD_HASH']
 
 # Global error handler
 @app.errorhandler(Exception)
@@ -150,53 +229,208 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Node-to-node requests carry the network's shared token
+peer_auth.configure(Config.PEER_TOKEN or peer_auth.derive(DEFAULT_PASSWORD))
+
+def peer_required(f):
+    """Allow peers presenting the shared token, and logged-in users"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'authenticated' not in session and not peer_auth.verify(request.headers.get(peer_auth.HEADER)):
+            return jsonify({'status': 'error', 'message': 'Peer authentication required'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 # Ensure shared folder exists
 os.makedirs(SHARED_FOLDER, exist_ok=True)
 
 class FileChangeHandler(FileSystemEventHandler):
-    """Handle file system change events"""
+    """Forward file system change events to the event bus"""
     def on_modified(self, event):
         if not event.is_directory:
-            self.sync_file(event.src_path)
+            event_bus.publish('modified', event.src_path)
     
     def on_created(self, event):
-        if not event.is_directory:
-            self.sync_file(event.src_path)
+        event_bus.publish('created', event.src_path, event.is_directory)
     
     def on_deleted(self, event):
-        if not event.is_directory:
-            self.notify_peers('delete', event.src_path)
-    
-    def sync_file(self, file_path):
-        """Sync file changes to peer devices"""
-        if os.path.isfile(file_path):
-            self.notify_peers('update', file_path)
-    
-    def notify_peers(self, action, file_path):
-        """Notify peer devices about file changes"""
-        rel_path = os.path.relpath(file_path, SHARED_FOLDER)
-        for device_id, device in DEVICES.items():
-            if device_id != socket.gethostname():
-                try:
-                    # In a real app, send notification to peer's API
-                    pass
-                except Exception as e:
-                    print(f"Error notifying {device_id}: {str(e)}")
+        event_bus.publish('deleted', event.src_path, event.is_directory)
+    
+    def on_moved(self, event):
+        event_bus.publish('moved', event.src_path, event.is_directory, dest_path=event.dest_path)
+
+def update_indexes(events):
+    """Event bus subscriber: keep the path/content indexes and thumbnails current"""
+    for event in events:
+        if event.action == 'deleted':
+            path_index.remove_path(event.path)
+            content_index.remove(event.path)
+        elif event.action == 'moved':
+            path_index.move_path(event.src_path, event.path)
+            content_index.remove(event.src_path)
+            if event.is_directory:
+                content_index.schedule_tree(event.path)
+            else:
+                content_index.schedule(event.path)
+        elif event.is_directory:
+            path_index.update_path(event.path)
+        elif os.path.isfile(event.path):
+            path_index.update_path(event.path)
+            if thumbnail_service.is_supported(event.path) or thumbnail_service.is_supported_archive(event.path):
+                thumbnail_service.pregenerate(event.path)
+            content_index.schedule(event.path)
+
+def peer_urls():
+    """(device id, base URL) of every known peer device"""
+    return [(device_id, f"http://{device.ip}:{device.port}")
+            for device_id, device in device_registry.snapshot().devices.items()
+            if device_id != socket.gethostname()]
+
+def notify_peers(events):
+    """Event bus subscriber: queue file changes for peer devices"""
+    changes = []
+    for event in events:
+        change = {
+            'action': event.action,
+            'path': os.path.relpath(event.path, SHARED_FOLDER).replace('\\', '/'),
+            'is_dir': event.is_directory
+        }
+        if event.src_path:
+            change['src_path'] = os.path.relpath(event.src_path, SHARED_FOLDER).replace('\\', '/')
+        changes.append(change)
+    peer_notifier.enqueue(changes)
+
+_disk_usage_cache = None
+_disk_usage_lock = threading.Lock()
+
+def invalidate_disk_usage(events):
+    """Event bus subscriber: the cached usage total is stale after any change"""
+    global _disk_usage_cache
+    _disk_usage_cache = None
+
+def stored_size(path):
+    """Size of a file in the shared folder, 0 if there is none"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
 
-# Start file system watcher
+def record_disk_write(path, previous_size):
+    """Add a write to the cached usage right away; the watcher's invalidation arrives only after the debounce"""
+    global _disk_usage_cache
+    with _disk_usage_lock:
+        if _disk_usage_cache is not None:
+            _disk_usage_cache += stored_size(path) - previous_size
+
+# Sequence-numbered record of every change, for "what changed since N" queries
+change_journal = ChangeJournal(
+    SHARED_FOLDER,
+    Config.JOURNAL_DB,
+    retention_days=Config.JOURNAL_RETENTION_DAYS,
+    compact_interval=Config.JOURNAL_COMPACT_INTERVAL
+)
+
+# Batched, pooled change notifications to peer devices
+peer_notifier = PeerNotifier(
+    socket.gethostname(),
+    peer_urls,
+    batch_size=Config.PEER_NOTIFY_BATCH_SIZE,
+    interval=Config.PEER_NOTIFY_INTERVAL,
+    concurrency=Config.PEER_NOTIFY_CONCURRENCY,
+    timeout=Config.PEER_NOTIFY_TIMEOUT,
+    max_queue=Config.PEER_NOTIFY_MAX_QUEUE,
+    piggyback=lambda: gossip.piggyback() if gossip else []
+)
+peer_notifier.start()
+
+# rsync-style file transfers: only the changed blocks of a file travel between peers
+delta_sync = DeltaSync(SHARED_FOLDER, block_size=Config.DELTA_BLOCK_SIZE, timeout=Config.DELTA_TIMEOUT)
+
+# Parallel downloads of one file from every peer that holds it
+swarm_downloader = SwarmDownloader(
+    SHARED_FOLDER,
+    chunk_size=Config.SWARM_CHUNK_SIZE,
+    connections_per_peer=Config.SWARM_CONNECTIONS_PER_PEER,
+    timeout=Config.SWARM_TIMEOUT,
+    max_failures=Config.SWARM_MAX_FAILURES
+)
+
+# Listings and searches across all peers at once, merged as they arrive
+federated_browser = FederatedBrowser(
+    SHARED_FOLDER,
+    peer_urls,
+    timeout=Config.FEDERATED_TIMEOUT,
+    cache_ttl=Config.FEDERATED_CACHE_TTL,
+    max_workers=Config.FEDERATED_MAX_WORKERS
+)
+
+# Relay mode: peer requests forwarded between devices that cannot reach each other
+relay_service = RelayService(
+    capacity=Config.RELAY_CAPACITY,
+    chunk_size=Config.RELAY_CHUNK_SIZE,
+    timeout=Config.RELAY_TIMEOUT
+)
+
+# Cluster storage: uploads placed on peers by consistent hashing; joins the ring in start_server
+cluster_storage = ClusterStorage(
+    SHARED_FOLDER,
+    Config.CLUSTER_FOLDER,
+    peer_urls,
+    get_free=lambda: max(0, STORAGE_LIMIT - get_disk_usage()),
+    replication=Config.CLUSTER_REPLICATION,
+    vnode_size=Config.CLUSTER_VNODE_SIZE,
+    max_vnodes=Config.CLUSTER_MAX_VNODES,
+    refresh_interval=Config.CLUSTER_REFRESH_INTERVAL,
+    timeout=Config.CLUSTER_TIMEOUT
+)
+
+# Deduplicating chunk store for uploads; None unless enabled
+chunk_store = ChunkStore(
+    Config.CHUNK_STORE_FOLDER,
+    avg_chunk_size=Config.CHUNK_AVG_SIZE,
+    pack_size=Config.CHUNK_PACK_SIZE,
+    compress=Config.CHUNK_COMPRESS,
+    timeout=Config.CHUNK_TIMEOUT
+) if Config.CHUNK_STORE_ENABLED else None
+
+# Coalesce watcher events so one upload becomes one logical change per consumer
+event_bus = EventBus(
+    window=Config.EVENT_DEBOUNCE_WINDOW,
+    max_delay=Config.EVENT_MAX_DELAY,
+    batch_size=Config.EVENT_BATCH_SIZE
+)
+event_bus.subscribe('usage', invalidate_disk_usage)
+event_bus.subscribe('journal', change_journal.append)
+event_bus.subscribe('indexes', update_indexes)
+event_bus.subscribe('peers', notify_peers)
+event_bus.start()
+
+# File system watcher: inotify within the watch budget, polling beyond it.
+# Started by start_server once the server is listening
 event_handler = FileChangeHandler()
-observer = Observer()
-observer.schedule(event_handler, SHARED_FOLDER, recursive=True)
-observer.start()
+change_detector = ChangeDetector(
+    SHARED_FOLDER,
+    event_handler,
+    max_watches=Config.INOTIFY_MAX_WATCHES,
+    poll_interval=Config.CHANGE_POLL_INTERVAL,
+    dirs_per_poll=Config.CHANGE_POLL_DIRS,
+    replan_interval=Config.WATCH_REPLAN_INTERVAL
+)
 
 def get_disk_usage():
-    """Get current disk usage of shared folder"""
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(SHARED_FOLDER):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            total_size += os.path.getsize(fp)
-    return total_size
+    """Get current disk usage of shared folder and chunk store"""
+    global _disk_usage_cache
+    if _disk_usage_cache is None:
+        total_size = 0
+        for dirpath, dirnames, filenames in os.walk(SHARED_FOLDER):
+            for f in filenames:
+                fp = os.path.join(dirpath, f)
+                try:
+                    total_size += os.path.getsize(fp)
+                except OSError:
+                    continue
+        _disk_usage_cache = total_size
+    return _disk_usage_cache + (chunk_store.disk_usage() if chunk_store else 0)
 
 def check_quota(file_size):
     """Check if adding file would exceed storage limit"""
@@ -204,6 +438,533 @@ def check_quota(file_size):
     return (current_usage + file_size) <= STORAGE_LIMIT, current_usage
 
 # API Endpoints
+@app.route('/api/watcher/status', methods=['GET'])
+@login_required
+def watcher_status():
+    """Change detection state: watch budget split, poll cycle and detection lag."""
+    return jsonify({
+        'status': 'success',
+        'detector': change_detector.get_stats(),
+        'events': {**event_bus.stats, 'pending': event_bus.pending()}
+    })
+
+@app.route('/api/changes', methods=['GET'])
+@login_required
+def list_changes():
+    """Journaled changes after sequence number ``since``; follow ``next`` while ``more`` is true."""
+    since = request.args.get('since', 0, type=int)
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), 10000)
+    result = change_journal.changes_since(since, limit=limit, path=request.args.get('path', ''))
+    return jsonify({'status': 'success', **result})
+
+@app.route('/api/peer/changes', methods=['POST'])
+@peer_required
+def receive_peer_changes():
+    """Ingest a batch of change notifications sent by a peer device."""
+    data = wire.request_data() or {}
+    source = data.get('source')
+    changes = data.get('changes')
+    if not source or not isinstance(changes, list):
+        return jsonify({'status': 'error', 'message': 'Invalid change batch'}), 400
+    
+    device_registry.touch(source)
+    if gossip and isinstance(data.get('gossip'), list):
+        gossip.merge(data['gossip'])
+    accepted = peer_notifier.receive(source, changes, resync=bool(data.get('resync')))
+    return wire.response({'status': 'success', 'accepted': accepted})
+
+@app.route('/api/peer/status', methods=['GET'])
+@login_required
+def peer_notification_status():
+    """Per-peer outbox size, delivery failures and backoff."""
+    return jsonify({'status': 'success', **peer_notifier.get_stats()})
+
+@app.route('/api/peer/changes/<path:source>', methods=['GET'])
+@login_required
+def received_peer_changes(source):
+    """Newest change notifications received from one peer device (see received_from in /api/peer/status)."""
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 10000)
+    return jsonify({'status': 'success', 'source': source,
+                    'changes': peer_notifier.recent_remote_changes(source, limit)})
+
+@app.route('/api/peer/merkle', methods=['GET', 'POST'])
+@peer_required
+def peer_merkle():
+    """Merkle digests of directories: GET ?path= for one, POST {"paths": [...], "children": bool} for several."""
+    if request.method == 'GET':
+        paths = [request.args.get('path', '')]
+        children = request.args.get('children', '1') != '0'
+    else:
+        data = wire.request_data() or {}
+        paths = data.get('paths')
+        children = bool(data.get('children', True))
+        if not isinstance(paths, list) or not 0 < len(paths) <= 1000 or not all(isinstance(p, str) for p in paths):
+            return jsonify({'status': 'error', 'message': 'paths must be a list of 1-1000 directories'}), 400
+    
+    nodes = merkle_tree.nodes(paths, children=children)
+    if request.method == 'GET' and nodes[paths[0]] is None:
+        return jsonify({'status': 'error', 'message': 'Directory not found'}), 404
+    return wire.response({'status': 'success', 'use_mtime': merkle_tree.use_mtime, 'nodes': nodes})
+
+@app.route('/api/peer/chunks/<path:filename>', methods=['GET'])
+@peer_required
+def peer_chunks(filename):
+    """Size and per-chunk hashes of a file, for peers downloading it from several sources."""
+    try:
+        manifest = swarm_downloader.manifest(filename, request.args.get('chunk_size', type=int))
+    except FileNotFoundError:
+        return jsonify({'status': 'error', 'message': 'File not found'}), 404
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return wire.response({'status': 'success', 'manifest': manifest})
+
+@app.route('/api/peer/file/<path:filename>', methods=['GET'])
+@peer_required
+def peer_file(filename):
+    """Serve a shared file to a peer; supports Range requests for chunked downloads."""
+    try:
+        path = swarm_downloader.resolve(filename)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if not os.path.isfile(path):
+        return jsonify({'status': 'error', 'message': 'File not found'}), 404
+    return send_file(path, mimetype='application/octet-stream', conditional=True)
+
+@app.route('/api/swarm/download', methods=['POST'])
+@login_required
+def start_swarm_download():
+    """Download a file into the shared folder from several peers at once."""
+    data = request.get_json(silent=True) or {}
+    path = data.get('path')
+    if not path:
+        return jsonify({'status': 'error', 'message': 'path is required'}), 400
+    peers = data.get('peers') or [url for _, url in peer_urls()]
+    try:
+        job_id = swarm_downloader.start_job(path, peers)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'job_id': job_id}), 202
+
+@app.route('/api/swarm/jobs', methods=['GET'])
+@login_required
+def swarm_jobs():
+    """State of the swarm downloads started through the API."""
+    return jsonify({'status': 'success', 'jobs': swarm_downloader.get_jobs()})
+
+@app.route('/api/peer/signature/<path:filename>', methods=['GET'])
+@peer_required
+def peer_signature(filename):
+    """Block signatures of our copy of a file, for a peer that pushes its version here."""
+    try:
+        signature = delta_sync.signature(filename)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return Response(signature, mimetype='application/octet-stream')
+
+@app.route('/api/peer/delta/<path:filename>', methods=['POST'])
+@peer_required
+def peer_delta(filename):
+    """Delta of a file against the block signatures in the request body, for a peer pulling it."""
+    try:
+        delta = delta_sync.delta(filename, request.get_data())
+    except FileNotFoundError:
+        return jsonify({'status': 'error', 'message': 'File not found'}), 404
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return Response(delta, mimetype='application/octet-stream')
+
+@app.route('/api/peer/patch/<path:filename>', methods=['POST'])
+@peer_required
+def peer_patch(filename):
+    """Apply a delta pushed by a peer to our copy of a file."""
+    available = max(0, STORAGE_LIMIT - get_disk_usage())
+    try:
+        path = delta_sync.resolve(filename)
+        previous_size = stored_size(path)
+        result = delta_sync.apply(filename, request.stream, max_growth=available)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except OSError as e:
+        if e.errno != errno.ENOSPC:
+            raise
+        return jsonify({'status': 'error', 'message': 'Not enough disk space', 'available': available}), 507
+    record_disk_write(path, previous_size)
+    return jsonify({'status': 'success', 'result': result})
+
+@app.route('/api/peer/list', defaults={'subpath': ''}, methods=['GET'])
+@app.route('/api/peer/list/<path:subpath>', methods=['GET'])
+@peer_required
+def peer_list(subpath):
+    """Entries of a shared directory, for a peer browsing all devices at once."""
+    try:
+        entries = federated_browser.list_local(subpath)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except FileNotFoundError:
+        return jsonify({'status': 'error', 'message': 'Directory not found'}), 404
+    return wire.response({'status': 'success', 'path': subpath.strip('/'), 'entries': entries})
+
+@app.route('/api/peer/search', methods=['GET'])
+@peer_required
+def peer_search():
+    """Path index search for a peer searching all devices at once (same parameters as /api/search)."""
+    if not Config.SEARCH_ENABLED:
+        return jsonify({'status': 'error', 'message': 'Search is disabled'}), 404
+    try:
+        results = search_index(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f'Invalid search parameter: {e}'}), 400
+    return wire.response({'status': 'success', 'results': results})
+
+@app.route('/api/peer/gossip/ping', methods=['POST'])
+@peer_required
+def gossip_ping():
+    """SWIM ping (or join) from another node; the ack carries our membership updates."""
+    if gossip is None:
+        return jsonify({'status': 'error', 'message': 'Gossip membership is disabled'}), 404
+    data = wire.request_data()
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': 'Invalid gossip message'}), 400
+    return wire.response(gossip.handle_ping(data, request.remote_addr))
+
+@app.route('/api/peer/gossip/ping-req', methods=['POST'])
+@peer_required
+def gossip_ping_req():
+    """Indirect probe: ping the member in the message for a node whose own ping went unanswered."""
+    if gossip is None:
+        return jsonify({'status': 'error', 'message': 'Gossip membership is disabled'}), 404
+    data = wire.request_data()
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': 'Invalid gossip message'}), 400
+    return wire.response(gossip.handle_ping_req(data, request.remote_addr))
+
+@app.route('/api/gossip/status', methods=['GET'])
+@login_required
+def gossip_status():
+    """Members as this node sees them, and its message counters."""
+    if gossip is None:
+        return jsonify({'status': 'error', 'message': 'Gossip membership is disabled'}), 404
+    return jsonify({'status': 'success', **gossip.get_stats()})
+
+@app.route('/api/peer/cluster/info', methods=['GET'])
+@peer_required
+def peer_cluster_info():
+    """Node id and free quota, from which peers weight this node on the cluster hash ring."""
+    if not Config.CLUSTER_STORAGE_ENABLED or cluster_storage.node_id is None:
+        return jsonify({'status': 'error', 'message': 'Cluster storage is disabled'}), 404
+    return wire.response({'status': 'success', **cluster_storage.info()})
+
+@app.route('/api/peer/cluster/store/<path:key>', methods=['POST'])
+@peer_required
+def peer_cluster_store(key):
+    """Store a replica of a cluster file pushed by the node that received the upload."""
+    if not Config.CLUSTER_STORAGE_ENABLED:
+        return jsonify({'status': 'error', 'message': 'Cluster storage is disabled'}), 404
+    try:
+        cluster_storage.resolve(key)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if request.content_length is None:
+        return jsonify({'status': 'error', 'message': 'Content-Length is required'}), 411
+    has_space, current_usage = check_quota(request.content_length)
+    if not has_space:
+        return jsonify({'status': 'error', 'message': 'Not enough disk space',
+                        'available': max(0, STORAGE_LIMIT - current_usage)}), 507
+    path = cluster_storage.resolve(key)
+    previous_size = stored_size(path)
+    size = cluster_storage.store_local(key, request.stream)
+    record_disk_write(path, previous_size)
+    return jsonify({'status': 'success', 'size': size})
+
+@app.route('/api/cluster/file/<path:key>', methods=['GET'])
+@login_required
+def cluster_file(key):
+    """Read a cluster file from this node or the closest live replica."""
+    if not Config.CLUSTER_STORAGE_ENABLED:
+        return jsonify({'status': 'error', 'message': 'Cluster storage is disabled'}), 404
+    try:
+        path = cluster_storage.local_copy(key)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if path:
+        cluster_storage.stats['local_reads'] += 1
+        return send_file(path, as_attachment=True, conditional=True)
+    
+    headers = {name: request.headers[name] for name in ('Range', 'If-Range') if name in request.headers}
+    upstream = cluster_storage.open_remote(key, headers)
+    if upstream is None:
+        return jsonify({'status': 'error', 'message': 'File not found on any live node'}), 404
+    response = Response(upstream.iter_content(Config.RELAY_CHUNK_SIZE), status=upstream.status_code,
+                        mimetype='application/octet-stream')
+    for name in ('Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified'):
+        if name in upstream.headers:
+            response.headers[name] = upstream.headers[name]
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(os.path.basename(key))}"
+    response.call_on_close(upstream.close)
+    return response
+
+@app.route('/api/peer/chunkstore/recipe/<path:key>', methods=['GET'])
+@peer_required
+def peer_chunk_recipe(key):
+    """Chunk hashes and sizes of a stored file, so a peer can fetch only the chunks it lacks."""
+    if chunk_store is None:
+        return jsonify({'status': 'error', 'message': 'Chunk store is disabled'}), 404
+    try:
+        info = chunk_store.stat(key)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if info is None:
+        return jsonify({'status': 'error', 'message': 'File not found'}), 404
+    return wire.response({'status': 'success', 'size': info['size'], 'mtime': info['mtime'],
+                          'chunks': [[digest.hex(), size] for digest, size in info['recipe']]})
+
+@app.route('/api/peer/chunkstore/chunks', methods=['POST'])
+@peer_required
+def peer_chunk_data():
+    """Stored bytes of the chunks a peer asks for, as a stream of records."""
+    if chunk_store is None:
+        return jsonify({'status': 'error', 'message': 'Chunk store is disabled'}), 404
+    data = wire.request_data() or {}
+    hashes = data.get('chunks')
+    try:
+        if not isinstance(hashes, list) or not 0 < len(hashes) <= 4096:
+            raise ValueError
+        digests = [bytes.fromhex(h) for h in hashes]
+        if any(len(digest) != 32 for digest in digests):
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'chunks must be a list of 1-4096 SHA-256 hashes'}), 400
+    records = chunk_store.iter_records(digests, compressed=bool(data.get('compressed', True)))
+    return Response(records, mimetype='application/octet-stream')
+
+@app.route('/api/chunkstore/files', methods=['GET'])
+@login_required
+def chunk_store_files():
+    """Files kept in the chunk store, optionally under ``prefix``."""
+    if chunk_store is None:
+        return jsonify({'status': 'error', 'message': 'Chunk store is disabled'}), 404
+    return jsonify({'status': 'success', 'files': chunk_store.list(request.args.get('prefix', ''))})
+
+@app.route('/api/chunkstore/file/<path:key>', methods=['GET', 'DELETE'])
+@login_required
+def chunk_store_file(key):
+    """Stream a file rebuilt from its chunks (Range requests supported), or delete it."""
+    if chunk_store is None:
+        return jsonify({'status': 'error', 'message': 'Chunk store is disabled'}), 404
+    try:
+        if request.method == 'DELETE':
+            if not chunk_store.remove(key):
+                return jsonify({'status': 'error', 'message': 'File not found'}), 404
+            return jsonify({'status': 'success'})
+        info = chunk_store.stat(key)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if info is None:
+        return jsonify({'status': 'error', 'message': 'File not found'}), 404
+    
+    reader = chunk_store.open(key)
+    response = Response(wrap_file(request.environ, reader, Config.RELAY_CHUNK_SIZE),
+                        mimetype='application/octet-stream', direct_passthrough=True)
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(os.path.basename(info['path']))}"
+    response.content_length = info['size']
+    response.last_modified = info['mtime']
+    response.set_etag(info['etag'])
+    return response.make_conditional(request, accept_ranges=True, complete_length=info['size'])
+
+@app.route('/api/chunkstore/ingest', methods=['POST'])
+@login_required
+def chunk_store_ingest():
+    """Move (``remove``: true) or copy a file of the shared folder into the chunk store."""
+    if chunk_store is None:
+        return jsonify({'status': 'error', 'message': 'Chunk store is disabled'}), 404
+    data = request.get_json(silent=True) or {}
+    try:
+        path = swarm_downloader.resolve(data.get('path') or '')
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if not os.path.isfile(path):
+        return jsonify({'status': 'error', 'message': 'File not found'}), 404
+    key = os.path.relpath(path, SHARED_FOLDER).replace('\\', '/')
+    with open(path, 'rb') as f:
+        result = chunk_store.put(key, f, mtime=os.path.getmtime(path))
+    if data.get('remove'):
+        previous_size = stored_size(path)
+        os.remove(path)
+        record_disk_write(path, previous_size)
+    return jsonify({'status': 'success', **result})
+
+@app.route('/api/chunkstore/pull', methods=['POST'])
+@login_required
+def chunk_store_pull():
+    """Copy a file from a peer's chunk store, transferring only the chunks this store lacks."""
+    if chunk_store is None:
+        return jsonify({'status': 'error', 'message': 'Chunk store is disabled'}), 404
+    data = request.get_json(silent=True) or {}
+    peer, path = data.get('peer'), data.get('path')
+    if not peer or not path:
+        return jsonify({'status': 'error', 'message': 'peer and path are required'}), 400
+    url = dict(peer_urls()).get(peer) or (peer if '://' in peer else f"http://{peer}")
+    try:
+        result = chunk_store.pull(url.rstrip('/'), path, data.get('dest'))
+    except FileNotFoundError:
+        return jsonify({'status': 'error', 'message': 'File not found on the peer'}), 404
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 502
+    except requests.RequestException as e:
+        return jsonify({'status': 'error', 'message': f'Peer unreachable: {e}'}), 502
+    return jsonify({'status': 'success', **result})
+
+@app.route('/api/chunkstore/status', methods=['GET'])
+@login_required
+def chunk_store_status():
+    """Deduplication and compression savings, pack count and transfer counters."""
+    if chunk_store is None:
+        return jsonify({'status': 'success', 'enabled': False})
+    return jsonify({'status': 'success', 'enabled': True, **chunk_store.get_stats()})
+
+@app.route('/api/chunkstore/compact', methods=['POST'])
+@login_required
+def chunk_store_compact():
+    """Rewrite packs that are mostly unreferenced chunks."""
+    if chunk_store is None:
+        return jsonify({'status': 'error', 'message': 'Chunk store is disabled'}), 404
+    return jsonify({'status': 'success', **chunk_store.compact()})
+
+@app.route('/api/cluster/status', methods=['GET'])
+@login_required
+def cluster_status():
+    """Ring members with their free quota, virtual nodes, key share and latency."""
+    return jsonify({'status': 'success', 'enabled': Config.CLUSTER_STORAGE_ENABLED, **cluster_storage.get_stats()})
+
+@app.route('/api/cluster/rebalance', methods=['POST'])
+@login_required
+def cluster_rebalance():
+    """Move this node's cluster files to the nodes that own them after a membership change."""
+    if not Config.CLUSTER_STORAGE_ENABLED or cluster_storage.node_id is None:
+        return jsonify({'status': 'error', 'message': 'Cluster storage is disabled'}), 404
+    if not cluster_storage.start_rebalance():
+        return jsonify({'status': 'error', 'message': 'A rebalance is already running'}), 409
+    return jsonify({'status': 'success'}), 202
+
+def federated_response(local, remote):
+    """
+    Answer of this device and all peers, one per device.
+    
+    Streamed as NDJSON, one line per device in the order they answer and a final
+    summary line; with ?stream=0 a single JSON document with all entries merged
+    and tagged with their device.
+    """
+    started = time.monotonic()
+    
+    def answers():
+        local_started = time.monotonic()
+        try:
+            answer = {'status': 'ok', 'entries': local()}
+        except FileNotFoundError:
+            answer = {'status': 'not_found'}
+        except ValueError as e:
+            answer = {'status': 'error', 'error': str(e)}
+        yield {'device': socket.gethostname(), 'local': True, 'cached': False,
+               'took_ms': round((time.monotonic() - local_started) * 1000, 1), **answer}
+        yield from remote
+    
+    if request.args.get('stream', '1') == '0':
+        devices, entries = [], []
+        for answer in answers():
+            for entry in answer.pop('entries', []):
+                entries.append({**entry, 'device': answer['device']})
+            devices.append(answer)
+        entries.sort(key=lambda e: (not e.get('is_dir'), (e.get('path') or e.get('name', '')).lower(), e['device']))
+        return jsonify({'status': 'success', 'devices': devices, 'entries': entries,
+                        'elapsed_ms': round((time.monotonic() - started) * 1000, 1)})
+    
+    def generate():
+        count = 0
+        for answer in answers():
+            count += 1
+            yield json.dumps(answer) + '\n'
+        yield json.dumps({'done': True, 'devices': count,
+                          'elapsed_ms': round((time.monotonic() - started) * 1000, 1)}) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/federated/list', methods=['GET'])
+@login_required
+def federated_list():
+    """List ?path= on this device and every online peer in parallel."""
+    path = request.args.get('path', '').strip('/')
+    timeout = request.args.get('timeout', type=float)
+    return federated_response(lambda: federated_browser.list_local(path), federated_browser.list(path, timeout))
+
+@app.route('/api/federated/search', methods=['GET'])
+@login_required
+def federated_search():
+    """Search this device and every online peer in parallel (same parameters as /api/search)."""
+    if not Config.SEARCH_ENABLED:
+        return jsonify({'status': 'error', 'message': 'Search is disabled'}), 404
+    params = {key: value for key, value in request.args.items() if key not in ('stream', 'timeout')}
+    timeout = request.args.get('timeout', type=float)
+    return federated_response(lambda: search_index(request.args), federated_browser.search(params, timeout))
+
+@app.route('/api/federated/status', methods=['GET'])
+@login_required
+def federated_status():
+    """Fan-out counters, cache size and the last answer of each peer."""
+    return jsonify({'status': 'success', **federated_browser.get_stats()})
+
+@app.route('/api/relay/<device_id>/api/peer/<path:peer_path>', methods=['GET', 'HEAD', 'POST'])
+@peer_required
+def relay_peer_request(device_id, peer_path):
+    """
+    Forward a peer API request to a device this relay can reach.
+    
+    The relay base URL http://relay/api/relay/<device_id> stands in for the
+    device's own URL, so every peer feature (swarm downloads, delta pull and
+    push, listings) works through it unchanged. Only peers of this network
+    may use it, and the relay authenticates itself to the device. Bodies are
+    streamed in both directions; 503 when RELAY_CAPACITY transfers are
+    already running.
+    """
+    if not Config.RELAY_ENABLED:
+        return jsonify({'status': 'error', 'message': 'Relay mode is disabled'}), 404
+    device = device_registry.get(device_id)
+    if device is None:
+        return jsonify({'status': 'error', 'message': f'Unknown device: {device_id}'}), 404
+    
+    body = None
+    if request.method == 'POST':
+        body = iter(lambda: request.stream.read(Config.RELAY_CHUNK_SIZE), b'')
+    try:
+        transfer = relay_service.open(
+            request.method,
+            f"http://{device.ip}:{device.port}",
+            f"/api/peer/{quote(peer_path)}",
+            params=list(request.args.items(multi=True)),
+            headers=dict(request.headers),
+            body=body
+        )
+    except requests.exceptions.RequestException as e:
+        return jsonify({'status': 'error', 'message': f'Device unreachable: {e}'}), 502
+    if transfer is None:
+        return jsonify({'status': 'error', 'message': 'Relay is at capacity'}), 503, {'Retry-After': '1'}
+    
+    response = Response(transfer.iter_body(), status=transfer.status_code, headers=transfer.headers,
+                        direct_passthrough=True)
+    # Releases the slot even if the body is never iterated (HEAD, client gone before the first byte)
+    response.call_on_close(transfer.close)
+    return response
+
+@app.route('/api/health', methods=['GET'])
+@login_required
+def health_status():
+    """Latest probe result, latency, failure count and next probe time of every checked endpoint."""
+    return jsonify({'status': 'success', **health_checker.get_stats()})
+
+@app.route('/api/relay/status', methods=['GET'])
+@login_required
+def relay_status():
+    """Relayed transfers: active and peak count, bytes and throughput in each direction."""
+    return jsonify({'status': 'success', 'enabled': Config.RELAY_ENABLED, **relay_service.get_stats()})
+
 @app.route('/api/disk_usage', methods=['GET'])
 def get_disk_usage_info():
     """Get current disk usage information"""
@@ -230,6 +991,9 @@ def upload_file():
     file_size = file.tell()
     file.seek(0)  # Reset file pointer
     
+    if Config.CLUSTER_STORAGE_ENABLED:
+        return upload_to_cluster(file, file_size)
+    
     has_space, current_usage = check_quota(file_size)
     if not has_space:
         return jsonify({
@@ -239,10 +1003,15 @@ def upload_file():
             'available': max(0, STORAGE_LIMIT - current_usage)
         }), 507  # 507 Insufficient Storage
     
+    if chunk_store is not None:
+        return upload_to_chunk_store(file)
+    
     # Save the file
     filename = os.path.join(SHARED_FOLDER, secure_filename(file.filename))
     try:
+        previous_size = stored_size(filename)
         file.save(filename)
+        record_disk_write(filename, previous_size)
         return jsonify({
             'message': 'File uploaded successfully',
             'filename': file.filename,
@@ -252,6 +1021,49 @@ def upload_file():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def upload_to_cluster(file, file_size):
+    """Store an upload on its replica nodes instead of this node's shared folder"""
+    fd, tmp_path = tempfile.mkstemp(prefix='.cluster-upload-')
+    os.close(fd)
+    try:
+        file.save(tmp_path)
+        local_path = cluster_storage.resolve(secure_filename(file.filename))
+        previous_size = stored_size(local_path)
+        result = cluster_storage.store(secure_filename(file.filename), tmp_path)
+        record_disk_write(local_path, previous_size)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        os.unlink(tmp_path)
+    if not result['stored']:
+        return jsonify({'error': 'No replica could store the file', 'replicas': result['replicas']}), 507
+    return jsonify({
+        'message': 'File uploaded successfully',
+        'filename': file.filename,
+        'size': file_size,
+        'path': result['key'],
+        'replicas': result['replicas']
+    })
+
+def upload_to_chunk_store(file):
+    """Store an upload as deduplicated chunks instead of a plain file in the shared folder"""
+    try:
+        result = chunk_store.put(secure_filename(file.filename), file.stream)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({
+        'message': 'File uploaded successfully',
+        'filename': file.filename,
+        'size': result['size'],
+        'path': result['path'],
+        'chunks': result['chunks'],
+        'unique_chunks': result['unique_chunks']
+    })
+
 @app.route('/download/<path:filename>', methods=['GET'])
 @login_required
 def download_file(filename):
@@ -357,7 +1169,6 @@ def format_datetime(timestamp, format='%d.%m.%Y %H:%M:%S'):
         return str(timestamp)  # Return original value if conversion fails
 
 # Global variables
-DEVICES = {}
 SHARED_FOLDERS = {}
 HOST_IP = '0.0.0.0'
 RELAY_SERVERS = [
@@ -387,6 +1198,47 @@ class Device:
             'last_seen': self.last_seen
         }
 
+# Known devices: copy-on-write snapshots, stale entries expired through a timing wheel
+device_registry = DeviceRegistry(
+    ttl=Config.DEVICE_TIMEOUT,
+    tick=Config.DEVICE_CLEANUP_INTERVAL,
+    online_window=Config.DEVICE_ONLINE_WINDOW
+)
+device_registry.start()
+
+# One long-lived mDNS browser feeds the registry; requests only read it
+discovery_service = DiscoveryService(
+    registry=device_registry,
+    peers_file=Config.PEERS_FILE,
+    service_type=SERVICE_TYPE,
+    device_factory=Device
+)
+# One-shot, early-returning discovery for short-lived processes (the CLI)
+network_service = NetworkService(SERVICE_NAME, DEFAULT_PORT)
+
+# SWIM gossip membership across networks mDNS does not reach; created by start_server
+gossip = None
+
+def gossip_seeds():
+    """Addresses to join the gossip cluster through: configured seeds and every known device"""
+    devices = device_registry.snapshot().devices.values()
+    return Config.GOSSIP_SEEDS + [f"{device.ip}:{device.port}" for device in devices]
+
+def gossip_member_update(member):
+    """Gossip callback: members feed the same device table as mDNS and /register"""
+    if member.state == 'dead':
+        device_registry.remove(member.id)
+        return
+    if member.state != 'alive' or device_registry.touch(member.id):
+        return
+    ip, _, port = member.addr.rpartition(':')
+    for device in device_registry.snapshot().devices.values():
+        if device.ip == ip and str(device.port) == port:
+            # Already listed under the name mDNS or /register gave it
+            device_registry.touch(device.device_id)
+            return
+    device_registry.upsert(Device(member.id, ip, int(port), []))
+
 # Authentication decorator
 def login_required(f):
     @wraps(f)
@@ -405,7 +1257,7 @@ def login():
     form = LoginForm()
     
     if form.validate_on_submit():
-        if check_password_hash(app.config['PASSWORD_HASH'], form.password.data):
+        if check_password_hash(get_password_hash(), form.password.data):
             session['authenticated'] = True
             session.permanent = True  # Make the session permanent
             next_page = request.args.get('next')
@@ -448,6 +1300,35 @@ def format_size(size_bytes):
         size_bytes /= 1024.0
     return f"{size_bytes:.2f} PB"
 
+def parse_size(value):
+    """Parse a size such as '1500', '10MB' or '2.5G' into bytes (None if empty)."""
+    if value is None or str(value).strip() == '':
+        return None
+    
+    text = str(value).strip().upper().rstrip('B')
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    try:
+        if text and text[-1] in multipliers:
+            size = int(float(text[:-1]) * multipliers[text[-1]])
+        else:
+            size = int(float(text))
+    except OverflowError:
+        raise ValueError(f'size out of range: {value}')
+    if abs(size) >= 2 ** 63:
+        # Beyond what SQLite stores as an integer
+        raise ValueError(f'size out of range: {value}')
+    return size
+
+def parse_timestamp(value):
+    """Parse a Unix timestamp or an ISO date ('2024-01-31') into a timestamp (None if empty)."""
+    if value is None or str(value).strip() == '':
+        return None
+    
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(str(value).strip()).timestamp()
+
 def build_directory_structure(entries):
     """Build a hierarchical directory structure from a flat list of file paths."""
     root = {'name': '', 'children': [], 'is_dir': True, 'path': ''}
@@ -755,6 +1636,11 @@ def get_file_info(file_path: str, base_path: str = None) -> dict:
         else:
             file_info['size'] = stat_info.st_size
             file_info['size_formatted'] = format_size(stat_info.st_size)
+            
+            # Versioned thumbnail URL so the browser can cache it indefinitely
+            if thumbnail_service.is_supported(file_path_abs):
+                file_info['thumbnail_url'] = url_for('thumbnail', filename=rel_path,
+                                                     v=thumbnail_service.version_tag(stat_info))
         
         # Get file type using python-magic
         try:
@@ -801,10 +1687,8 @@ def get_file_info(file_path: str, base_path: str = None) -> dict:
 @app.route('/<path:subpath>')
 @login_required
 def index(subpath=''):
-    # Trigger device discovery in the background
-    discovery_thread = threading.Thread(target=discover_devices)
-    discovery_thread.daemon = True
-    discovery_thread.start()
+    # Make sure the shared discovery browser is running (no-op once started)
+    discover_devices()
     
     # Normalize the subpath and handle Windows paths
     subpath = subpath.strip('/').replace('\\', '/')
@@ -828,6 +1712,9 @@ def index(subpath=''):
         rel_path = os.path.relpath(current_path_abs, SHARED_FOLDER).replace('\\', '/')
         return download_file(rel_path)
     
+    # Browsed directories are polled first when they are outside the inotify budget
+    change_detector.touch(current_path_abs)
+    
     # Get list of files and directories in the current path
     files = []
     breadcrumbs = [{'name': 'Ana Dizin', 'path': ''}]
@@ -868,7 +1755,7 @@ def index(subpath=''):
                          files=files, 
                          local_ip=local_ip, 
                          port=port,
-                         public_ip=PUBLIC_IP or 'Not available',
+                         public_ip=network_identity.public_ip() or 'Not available',
                          current_path=subpath,
                          breadcrumbs=breadcrumbs)
 
@@ -885,9 +1772,64 @@ def view_image_route(filename):
     if not any(filename.lower().endswith(ext) for ext in image_extensions):
         abort(400, "Not an image file")
     
+    # Show a screen-sized preview first; the original is loaded on zoom
+    preview_url = None
+    if thumbnail_service.is_supported(filepath):
+        preview_url = url_for('thumbnail', filename=filename, size='preview',
+                              v=thumbnail_service.version_tag(os.stat(filepath)))
+    
     return render_template('image_viewer.html',
                          title=os.path.basename(filename),
-                         file_path=filename)
+                         file_path=filename,
+                         preview_url=preview_url)
+
+@app.route('/thumbnail/<path:filename>')
+@login_required
+def thumbnail(filename):
+    """Serve a cached thumbnail (or the larger viewer preview) of an image."""
+    filename = filename.strip('/').replace('\\', '/')
+    filepath = os.path.normpath(os.path.join(SHARED_FOLDER, filename)).replace('\\', '/')
+    
+    # Security check to prevent directory traversal
+    shared_folder_abs = os.path.abspath(SHARED_FOLDER).replace('\\', '/')
+    filepath_abs = os.path.abspath(filepath).replace('\\', '/')
+    
+    if not filepath_abs.startswith(shared_folder_abs) or not os.path.isfile(filepath_abs):
+        abort(404)
+    
+    size = Config.THUMBNAIL_PREVIEW_SIZE if request.args.get('size') == 'preview' else Config.THUMBNAIL_SIZE
+    thumb_path = thumbnail_service.get_thumbnail(filepath_abs, size)
+    if not thumb_path:
+        abort(404)
+    
+    response = send_file(thumb_path, mimetype=thumbnail_service.mimetype)
+    # URLs carry a size/mtime version (?v=...), so they never need revalidation
+    response.headers['Cache-Control'] = f'private, max-age={Config.THUMBNAIL_MAX_AGE}, immutable'
+    return response
+
+@app.route('/thumbnail-archive/<path:filename>')
+@login_required
+def archive_thumbnail(filename):
+    """Serve a thumbnail (or viewer preview) of an image stored inside a ZIP/RAR archive."""
+    member = request.args.get('member', '')
+    filename = filename.strip('/').replace('\\', '/')
+    filepath = os.path.normpath(os.path.join(SHARED_FOLDER, filename)).replace('\\', '/')
+    
+    # Security check to prevent directory traversal
+    shared_folder_abs = os.path.abspath(SHARED_FOLDER).replace('\\', '/')
+    filepath_abs = os.path.abspath(filepath).replace('\\', '/')
+    
+    if not member or not filepath_abs.startswith(shared_folder_abs) or not os.path.isfile(filepath_abs):
+        abort(404)
+    
+    size = Config.THUMBNAIL_PREVIEW_SIZE if request.args.get('size') == 'preview' else Config.THUMBNAIL_SIZE
+    thumb_path = thumbnail_service.get_archive_member_thumbnail(filepath_abs, member, size)
+    if not thumb_path:
+        abort(404)
+    
+    response = send_file(thumb_path, mimetype=thumbnail_service.mimetype)
+    response.headers['Cache-Control'] = f'private, max-age={Config.THUMBNAIL_MAX_AGE}, immutable'
+    return response
 
 @app.route('/view-pdf/<path:filename>')
 @login_required
@@ -936,6 +1878,16 @@ def view_archive(filename, subpath=''):
             flash('Arşiv dosyası okunamadı veya bozuk olabilir.', 'error')
             return redirect(url_for('index'))
         
+        # Thumbnail/preview URLs for image members, versioned by the archive's size and mtime
+        if thumbnail_service.is_supported_archive(filepath):
+            archive_version = thumbnail_service.version_tag(os.stat(filepath))
+            for item in archive_data.get('contents', []):
+                if not item.get('is_dir') and thumbnail_service.is_supported(item.get('path', '')):
+                    item['thumbnail_url'] = url_for('archive_thumbnail', filename=filename,
+                                                    member=item['path'], v=archive_version)
+                    item['preview_url'] = url_for('archive_thumbnail', filename=filename,
+                                                  member=item['path'], size='preview', v=archive_version)
+        
         # Prepare the template context
         context = {
             'title': os.path.basename(filename),
@@ -1012,7 +1964,9 @@ def share():
         
         try:
             filepath = os.path.join(SHARED_FOLDER, secure_filename(file.filename))
+            previous_size = stored_size(filepath)
             file.save(filepath)
+            record_disk_write(filepath, previous_size)
             flash('File shared successfully!', 'success')
         except Exception as e:
             flash(f'Error sharing file: {str(e)}', 'error')
@@ -1022,7 +1976,7 @@ def share():
     return render_template('share.html')
     
     # Convert Device objects to dictionaries for the template
-    devices_list = [device.to_dict() for device in DEVICES.values()]
+    devices_list = [device.to_dict() for device in device_registry.snapshot().devices.values()]
     return render_template('index.html', devices=devices_list)
 
 @app.route('/register_device_ui', methods=['GET', 'POST'])
@@ -1062,7 +2016,7 @@ def register_device_ui():
 # API Endpoints
 @app.route('/register', methods=['POST'])
 def register_device():
-    data = request.json
+    data = wire.request_data() or {}
     device_id = data.get('device_id')
     ip = request.remote_addr
     port = data.get('port', DEFAULT_PORT)
@@ -1071,40 +2025,19 @@ def register_device():
     if not device_id:
         return jsonify({'error': 'Device ID is required'}), 400
     
-    DEVICES[device_id] = Device(device_id, ip, port, shared_folders)
-    return jsonify({'status': 'success', 'message': f'Device {device_id} registered'})
+    device_registry.upsert(Device(device_id, ip, port, shared_folders))
+    return wire.response({'status': 'success', 'message': f'Device {device_id} registered'})
 
 @app.route('/api/devices', methods=['GET'])
 def list_devices():
     """List all discovered devices"""
     try:
-        # Trigger a new discovery in the background
-        discovery_thread = threading.Thread(target=discover_devices)
-        discovery_thread.daemon = True
-        discovery_thread.start()
-        
-        # Clean up old devices (not seen in last 5 minutes)
-        current_time = time.time()
-        devices_to_remove = []
-        
-        for device_name, device in list(DEVICES.items()):
-            if current_time - device.last_seen > 300:  # 5 minutes
-                devices_to_remove.append(device_name)
-        
-        for device_name in devices_to_remove:
-            del DEVICES[device_name]
+        discover_devices()
         
-        # Convert to list of dictionaries for JSON serialization
-        devices_list = [{
-            'device_id': device.device_id,
-            'ip': device.ip,
-            'port': device.port,
-            'shared_folders': device.shared_folders,
-            'last_seen': device.last_seen,
-            'status': 'online' if (current_time - device.last_seen) < 60 else 'offline'
-        } for device in DEVICES.values()]
+        # Stale devices are expired by the registry; the listing is cached per registry version
+        devices_list = device_registry.listing()
         
-        return jsonify({
+        return wire.response({
             'status': 'success',
             'devices': devices_list,
             'count': len(devices_list)
@@ -1115,6 +2048,155 @@ def list_devices():
             'message': str(e)
         }), 500
 
+def search_index(args):
+    """Run a path index search from request arguments; raises ValueError on bad parameters."""
+    extensions = [e.strip() for e in args.get('ext', '').split(',') if e.strip()]
+    limit = min(max(args.get('limit', 100, type=int), 1), Config.SEARCH_MAX_RESULTS)
+    return path_index.search(
+        query=args.get('q', '').strip(),
+        glob=args.get('glob', '').strip(),
+        extensions=extensions,
+        min_size=parse_size(args.get('min_size')),
+        max_size=parse_size(args.get('max_size')),
+        modified_after=parse_timestamp(args.get('after')),
+        modified_before=parse_timestamp(args.get('before')),
+        path=args.get('path', '').strip('/'),
+        file_type=args.get('type', '').strip(),
+        include_dirs=args.get('dirs', 'true').lower() != 'false',
+        sort=args.get('sort', ''),
+        descending=args.get('order', 'asc').lower() == 'desc',
+        limit=limit,
+        offset=max(args.get('offset', 0, type=int), 0)
+    )
+
+@app.route('/api/search', methods=['GET'])
+@login_required
+def search_files():
+    """Search the path index by name substring, glob, extension, size and date range."""
+    if not Config.SEARCH_ENABLED:
+        return jsonify({'status': 'error', 'message': 'Search is disabled'}), 404
+    
+    try:
+        started = time.perf_counter()
+        results = search_index(request.args)
+        took_ms = (time.perf_counter() - started) * 1000
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f'Invalid search parameter: {e}'}), 400
+    
+    return jsonify({
+        'status': 'success',
+        'results': results,
+        'count': len(results),
+        'took_ms': round(took_ms, 2),
+        # Counting the entries scans the whole index; that is left to /api/search/status
+        'index': {'crawling': path_index.crawling, 'trigram_search': path_index.has_fts}
+    })
+
+@app.route('/api/search/status', methods=['GET'])
+@login_required
+def search_status():
+    """Path index size and crawl state."""
+    return jsonify({'status': 'success', **path_index.get_stats()})
+
+@app.route('/api/search/content', methods=['GET'])
+@login_required
+def search_content():
+    """Full-text search over file contents, returning highlighted snippets."""
+    if not Config.CONTENT_INDEX_ENABLED:
+        return jsonify({'status': 'error', 'message': 'Content search is disabled'}), 404
+    
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'status': 'error', 'message': 'Missing search query'}), 400
+    
+    limit = min(max(request.args.get('limit', 50, type=int), 1), Config.SEARCH_MAX_RESULTS)
+    started = time.perf_counter()
+    results = content_index.search(
+        query,
+        path=request.args.get('path', '').strip('/'),
+        limit=limit,
+        offset=max(request.args.get('offset', 0, type=int), 0)
+    )
+    took_ms = (time.perf_counter() - started) * 1000
+    
+    return jsonify({
+        'status': 'success',
+        'results': results,
+        'count': len(results),
+        'took_ms': round(took_ms, 2)
+    })
+
+@app.route('/api/search/content/status', methods=['GET'])
+@login_required
+def search_content_status():
+    """Content index size, indexing queue and worker counters."""
+    return jsonify({'status': 'success', **content_index.get_stats()})
+
+@app.route('/api/duplicates', methods=['GET'])
+@login_required
+def list_duplicates():
+    """Status of the duplicate scan and the duplicate groups, largest reclaimable size first."""
+    limit = min(request.args.get('limit', 100, type=int), Config.SEARCH_MAX_RESULTS)
+    return jsonify({
+        'status': 'success',
+        'scan': duplicate_service.get_status(),
+        'groups': duplicate_service.get_groups(limit=limit, offset=request.args.get('offset', 0, type=int))
+    })
+
+@app.route('/api/duplicates/scan', methods=['POST'])
+@login_required
+def scan_duplicates():
+    """Start a duplicate scan in the background."""
+    if not duplicate_service.start():
+        return jsonify({'status': 'error', 'message': 'A duplicate scan is already running'}), 409
+    return jsonify({'status': 'success', 'scan': duplicate_service.get_status()}), 202
+
+@app.route('/api/duplicates/<group_id>/resolve', methods=['POST'])
+@login_required
+def resolve_duplicates(group_id):
+    """Replace the other copies in a group with hard links to one file, or delete them."""
+    data = request.get_json(silent=True) or request.form
+    keep = data.get('keep', '')
+    action = data.get('action', 'hardlink')
+    try:
+        result = duplicate_service.resolve(group_id, keep, action)
+    except KeyError:
+        return jsonify({'status': 'error', 'message': 'Duplicate group not found'}), 404
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except (RuntimeError, OSError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 409
+    return jsonify({'status': 'success', **result})
+
+@app.route('/analytics')
+@login_required
+def analytics_page():
+    """Storage analytics page with the largest items, breakdowns and a treemap."""
+    port = request.host.split(':')[-1] if ':' in request.host else DEFAULT_PORT
+    return render_template('analytics.html',
+                           local_ip=get_local_ip(),
+                           port=port,
+                           public_ip=network_identity.public_ip() or 'Not available')
+
+@app.route('/api/analytics', methods=['GET'])
+@login_required
+def analytics_report():
+    """Largest files/directories and bytes by extension, type and age."""
+    top = min(request.args.get('top', Config.ANALYTICS_TOP_N, type=int), Config.SEARCH_MAX_RESULTS)
+    return jsonify({'status': 'success', 'report': analytics_service.get_report(top=max(1, top))})
+
+@app.route('/api/analytics/treemap', methods=['GET'])
+@login_required
+def analytics_treemap():
+    """Directory size hierarchy for the treemap."""
+    depth = min(max(request.args.get('depth', 2, type=int), 1), 5)
+    limit = min(max(request.args.get('limit', 30, type=int), 1), 200)
+    try:
+        tree = analytics_service.get_treemap(request.args.get('path', ''), depth=depth, limit=limit)
+    except KeyError:
+        return jsonify({'status': 'error', 'message': 'Directory not found'}), 404
+    return jsonify({'status': 'success', 'tree': tree})
+
 @app.route('/share', methods=['POST'])
 def share_folder():
     data = request.json
@@ -1124,7 +2206,7 @@ def share_folder():
     if not device_id or not folder_path:
         return jsonify({'error': 'Device ID and folder path are required'}), 400
     
-    if device_id not in DEVICES:
+    if device_id not in device_registry:
         return jsonify({'error': 'Device not found'}), 404
     
     # Convert to absolute path
@@ -1145,44 +2227,13 @@ def share_folder():
     })
 
 def get_local_ip():
-    """Get the local IP address of the machine."""
-    try:
-        if NETIFACES_AVAILABLE:
-            # Try to get IP using netifaces if available
-            for interface in netifaces.interfaces():
-                addrs = netifaces.ifaddresses(interface)
-                if netifaces.AF_INET in addrs:
-                    for addr in addrs[netifaces.AF_INET]:
-                        ip = addr['addr']
-                        if ip != '127.0.0.1':
-                            return ip
-    except Exception as e:
-        print(f"Error getting local IP with netifaces: {e}")
-    
-    # Fallback method 1: Try to connect to an external server
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-        return local_ip
-    except Exception as e:
-        print(f"Error getting local IP with socket: {e}")
-    
-    # Fallback method 2: Using hostname
-    try:
-        hostname = socket.gethostname()
-        local_ip = socket.gethostbyname(hostname)
-        if not local_ip.startswith('127.'):
-            return local_ip
-    except Exception as e:
-        print(f"Error getting local IP with hostname: {e}")
-    
-    return '127.0.0.1'
+    """Get the local IP address of the machine (cached)."""
+    return network_identity.local_ip()
 
 def start_zeroconf_service(port):
     """Start the ZeroConf service for network discovery"""
     global zeroconf, service_info
+    from zeroconf import ServiceInfo, Zeroconf
     
     try:
         # Get local IP address
@@ -1224,102 +2275,113 @@ def stop_zeroconf_service():
         zeroconf.close()
         print("ZeroConf service stopped")
 
-def discover_devices():
-    """Discover other devices on the local network"""
-    from zeroconf import ServiceBrowser, Zeroconf
+def discover_devices(wait=0):
+    """Discover other devices on the local network.
     
-    class MyListener:
-        def remove_service(self, zeroconf, type, name):
-            print(f"Service {name} removed")
-            
-        def add_service(self, zeroconf, type, name):
-            info = zeroconf.get_service_info(type, name)
-            if info:
-                address = socket.inet_ntoa(info.addresses[0])
-                port = info.port
-                device_name = name.split('.')[0]
-                
-                print(f"Discovered device: {device_name} at {address}:{port}")
-                
-                # Add to discovered devices
-                DEVICES[device_name] = Device(device_name, address, port, [])
-                
-        def update_service(self, zeroconf, type, name):
-            # This method is required by the interface but we don't need to do anything special
-            # when a service is updated. We'll just log it for debugging purposes.
-            print(f"Service {name} updated")
-    
-    zeroconf = Zeroconf()
-    listener = MyListener()
-    browser = ServiceBrowser(zeroconf, SERVICE_TYPE, listener)
-    
-    try:
-        # Run discovery for 5 seconds
-        time.sleep(5)
-    finally:
-        zeroconf.close()
+    Without ``wait`` this starts the process-wide discovery browser on first use;
+    found devices land in ``device_registry``. With ``wait`` (short-lived processes
+    such as the CLI) it runs a one-shot search instead, which returns as soon as the
+    network goes quiet and at the latest after ``wait`` seconds.
+    """
+    if not wait:
+        discovery_service.start_discovery_thread()
+        return
+    for service in network_service.iter_services(SERVICE_TYPE, timeout=wait,
+                                                 quiet_period=Config.DISCOVERY_QUIET_PERIOD):
+        device_registry.upsert(Device(service['name'], service['addresses'][0], service['port'], []))
 
-def start_server(port):
-    """Start the Flask server"""
-    global PUBLIC_IP, server_thread
-    
-    try:
-        print("1. Getting public IP...")
-        PUBLIC_IP = get_public_ip()
-        print(f"Public IP: {PUBLIC_IP}")
-    except Exception as e:
-        print(f"Could not determine public IP: {e}")
-        PUBLIC_IP = None
-    
-    # Start file system watcher in a separate thread with timeout
-    def start_file_watcher():
-        try:
-            print("2. Starting file system watcher...")
-            observer.start()
-            print("   File system watcher started successfully")
-        except Exception as e:
-            print(f"   Error starting file system watcher: {e}")
-    
-    watcher_thread = threading.Thread(target=start_file_watcher, name="FileWatcherThread")
-    watcher_thread.daemon = True
-    watcher_thread.start()
-    
-    # Wait for file system watcher to start (with timeout)
-    watcher_thread.join(timeout=5)
-    if watcher_thread.is_alive():
-        print("   Warning: File system watcher is taking too long to start, continuing...")
-    
-    try:
-        print("3. Starting ZeroConf service...")
-        start_zeroconf_service(port)
-        print("   ZeroConf service started successfully")
-    except Exception as e:
-        print(f"   Error starting ZeroConf service: {e}")
+def start_server(port, profile_startup=False):
+    """Start the Flask server
     
-    try:
-        print("4. Starting device discovery...")
-        discovery_thread = threading.Thread(target=discover_devices, name="DiscoveryThread")
-        discovery_thread.daemon = True
-        discovery_thread.start()
-        print("   Device discovery started in background")
-    except Exception as e:
-        print(f"   Error starting device discovery: {e}")
-    
-    # Run Flask in a separate thread
-    def run_flask():
-        try:
-            print("5. Starting Flask server...")
-            app.run(host=HOST_IP, port=port, debug=True, use_reloader=False, threaded=True)
-        except Exception as e:
-            print(f"   Error in Flask server: {e}")
+    The socket is bound and served first; the file watcher, index reconciliation,
+    ZeroConf registration and device discovery then start in parallel in the
+    background, so a restarted node answers requests right away.
+    """
+    global server_thread
+    startup_profile.record('module setup', _imports_done, time.perf_counter())
+    if not Config.PEER_TOKEN:
+        print("Warning: PEER_TOKEN is not set. Peer endpoints only check a token derived from the default "
+              "password, which anyone can compute; set the same PEER_TOKEN on every device.")
     
     try:
-        server_thread = threading.Thread(target=run_flask, name="FlaskThread")
-        server_thread.daemon = True
-        server_thread.start()
-        print("   Flask server started in background")
+        print("1. Starting Flask server...")
+        with startup_profile.phase('listen'):
+            from werkzeug.debug import DebuggedApplication
+            # Same server app.run(debug=True, use_reloader=False, threaded=True) builds,
+            # but bound here so we know it is listening before anything else starts
+            app.debug = True
+            server = make_server(HOST_IP, port, DebuggedApplication(app, evalex=True), threaded=True)
     except Exception as e:
         print(f"   Error starting Flask server: {e}")
+        return
+    if profile_startup:
+        app.before_request(startup_profile.mark_first_request)
+    server_thread = threading.Thread(target=server.serve_forever, name="FlaskThread")
+    server_thread.daemon = True
+    server_thread.start()
+    
+    def run_phase(name, target):
+        def run():
+            try:
+                with startup_profile.phase(name):
+                    target()
+            except Exception as e:
+                print(f"   Error in start-up step '{name}': {e}")
+        thread = threading.Thread(target=run, name=f"Startup-{name}", daemon=True)
+        thread.start()
+        return thread
+    
+    def reconcile_indexes():
+        # Wait for the watcher (with timeout) so changes made during the crawl are not missed
+        watcher_thread.join(timeout=5)
+        if watcher_thread.is_alive():
+            print("   Warning: File system watcher is taking too long to start, continuing...")
+        # Reconcile the persistent index with changes made while we were down
+        if Config.SEARCH_ENABLED:
+            path_index.start_background_crawl()
+        if Config.CONTENT_INDEX_ENABLED:
+            content_index.start()
+            content_index.start_background_scan()
+        # Journal whatever changed while the server was down
+        change_journal.start_background_reconcile()
+        # Pick up a duplicate scan that was cut short by a restart; cached hashes are reused
+        duplicate_service.resume_if_interrupted()
+    
+    # Gossip and the cluster ring know this node by the same id
+    node_id = Config.GOSSIP_NODE_ID or f"{socket.gethostname()}:{port}"
+    
+    def start_gossip():
+        global gossip
+        gossip = GossipMembership(
+            node_id,
+            port,
+            get_seeds=gossip_seeds,
+            interval=Config.GOSSIP_INTERVAL,
+            ping_timeout=Config.GOSSIP_PING_TIMEOUT,
+            indirect_probes=Config.GOSSIP_INDIRECT_PROBES,
+            suspect_mult=Config.GOSSIP_SUSPECT_MULT,
+            retransmit_mult=Config.GOSSIP_RETRANSMIT_MULT,
+            on_change=gossip_member_update,
+            on_contact=gossip_member_update
+        )
+        gossip.start()
+    
+    print("2. Starting file watcher, ZeroConf and device discovery in background...")
+    # Interfaces are read now; the public IP is looked up in the background
+    phases = [run_phase('network identity', network_identity.start)]
+    watcher_thread = run_phase('file watcher', change_detector.start)
+    phases += [
+        watcher_thread,
+        run_phase('index reconcile', reconcile_indexes),
+        run_phase('zeroconf', lambda: start_zeroconf_service(port)),
+        run_phase('device discovery', discover_devices),
+        # Derive the login hash now rather than during the first login
+        run_phase('password hash', get_password_hash)
+    ]
+    if Config.GOSSIP_ENABLED:
+        phases.append(run_phase('gossip', start_gossip))
+    if Config.CLUSTER_STORAGE_ENABLED:
+        phases.append(run_phase('cluster storage', lambda: cluster_storage.start(node_id)))
     
     # Print ready message
     try:
@@ -1328,8 +2390,9 @@ def start_server(port):
         print("   HER ŞEY HAZIR!")
         print("="*50)
         print(f"\nYerel Ağda Erişim: http://{local_ip}:{port}")
-        if PUBLIC_IP:
-            print(f"Genel İnternet Erişimi: http://{PUBLIC_IP}:{port}")
+        public_ip = network_identity.public_ip()
+        if public_ip:
+            print(f"Genel İnternet Erişimi: http://{public_ip}:{port}")
         print("\nUygulama arka planda çalışmaya devam ediyor...")
         print("Çıkmak için Ctrl+C tuşlarına basın.")
         print("="*50 + "\n")
@@ -1338,64 +2401,63 @@ def start_server(port):
     
     # Keep the main thread alive
     try:
+        if profile_startup:
+            for thread in phases:
+                thread.join(timeout=30)
+            print("\nBaşlangıç süreleri (--profile-startup):")
+            print(startup_profile.report() + "\n")
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         print("\nSunucu kapatılıyor...")
         try:
+            server.shutdown()
             stop_zeroconf_service()
-            observer.stop()
-            observer.join()
+            change_detector.stop()
+            event_bus.stop()
+            peer_notifier.stop()
+            discovery_service.stop_discovery()
+            device_registry.stop()
+            network_identity.stop()
+            federated_browser.shutdown()
+            health_checker.stop()
+            if gossip:
+                gossip.stop()
+            cluster_storage.stop()
+            if chunk_store:
+                chunk_store.close()
+            thumbnail_service.shutdown()
+            path_index.close()
+            content_index.close()
+            change_journal.close()
         except Exception as e:
             print(f"Error during shutdown: {e}")
         print("Sunucu başarıyla kapatıldı.")
 
-def get_public_ip():
-    """Get the public IP address of the machine"""
-    services = [
-        'https://api.ipify.org?format=json',
-        'https://ipapi.co/json/',
-        'https://ipinfo.io/json'
-    ]
-    
-    for service in services:
-        try:
-            print(f"Trying to get public IP from {service}")
-            response = requests.get(service, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                ip = data.get('ip') or data.get('ip')
-                if ip:
-                    print(f"Successfully got public IP: {ip}")
-                    return ip
-        except Exception as e:
-            print(f"Failed to get IP from {service}: {str(e)}")
-            continue
-    
-    print("Warning: Could not determine public IP. Using 127.0.0.1")
-    return None
+def get_public_ip(wait=Config.PUBLIC_IP_TIMEOUT + 1):
+    """Get the public IP address of the machine; waits for a lookup only if none is known yet"""
+    ip = network_identity.public_ip(wait=wait)
+    if not ip:
+        print("Warning: Could not determine public IP")
+    return ip
 
-def check_relay_server(server_url):
-    """Check if a relay server is available"""
-    try:
-        response = requests.get(f"{server_url}/status", timeout=5)
-        return response.status_code == 200
-    except:
-        return False
+def check_relay_server(server_url, wait=Config.HEALTH_CHECK_TIMEOUT + 1):
+    """Check if a relay server is available (cached health probe; only the first call for a server waits)"""
+    if server_url not in health_checker:
+        health_checker.register(server_url, f"{server_url}/status", interval=Config.HEALTH_CHECK_INTERVAL)
+    return health_checker.is_healthy(server_url, wait=wait)
 
 def register_with_server(server_ip, server_port, device_id, shared_folders=None, is_relay=False):
     """Register this device with the central server or relay server"""
     try:
         # Get public IP if available
-        global PUBLIC_IP
-        if not PUBLIC_IP:
-            PUBLIC_IP = get_public_ip()
+        public_ip = get_public_ip()
             
         # Prepare registration data
         data = {
             'device_id': device_id,
             'local_ip': get_local_ip(),
-            'public_ip': PUBLIC_IP,
+            'public_ip': public_ip,
             'port': 5000,
             'is_relay': is_relay,
             'shared_folders': shared_folders or [SHARED_FOLDER],
@@ -1404,21 +2466,22 @@ def register_with_server(server_ip, server_port, device_id, shared_folders=None,
         
         # If this is a relay registration, add relay-specific info
         if is_relay:
-            data['relay_capacity'] = 100  # Max concurrent connections
+            data['relay_capacity'] = Config.RELAY_CAPACITY  # Max concurrent relayed transfers
             data['region'] = 'europe'     # Could be dynamic based on IP
         
         # Send registration request
         base_url = f"http://{server_ip}:{server_port}" if not is_relay else server_ip
         url = f"{base_url}/api/register"
         
-        response = requests.post(url, json=data, timeout=10)
+        body, headers = wire.encode_request(data, url)
+        response = requests.post(url, data=body, headers=headers, timeout=10)
         
         if response.status_code == 200:
             print(f"Successfully registered with {'relay' if is_relay else 'server'} {server_ip}:{server_port}")
             
             # If this is a relay server, update our relay server list
             if is_relay:
-                update_relay_servers(server_ip, server_port, 'active')
+                update_relay_servers(server_ip, 'active')
                 
             return True
         else:
@@ -1428,7 +2491,7 @@ def register_with_server(server_ip, server_port, device_id, shared_folders=None,
     except Exception as e:
         print(f"Error registering with server: {e}")
         if is_relay:
-            update_relay_servers(server_ip, server_port, 'unavailable')
+            update_relay_servers(server_ip, 'unavailable')
         return False
 
 def update_relay_servers(server_url, status):
@@ -1443,12 +2506,11 @@ def update_relay_servers(server_url, status):
 
 def list_shared_folders(server_ip, server_port):
     """List all shared folders from the server"""
-    import requests
-    url = f"http://{server_ip}:{server_port}/devices"
+    url = f"http://{server_ip}:{server_port}/api/devices"
     try:
-        response = requests.get(url)
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        response = requests.get(url, headers=wire.client_headers(), timeout=10)
+        return wire.decode_response(response)
+    except (requests.exceptions.RequestException, ValueError) as e:
         return {'error': str(e)}
 
 def main():
@@ -1458,6 +2520,8 @@ def main():
     # Server command
     server_parser = subparsers.add_parser('server', help='Start as server')
     server_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to run the server on')
+    server_parser.add_argument('--profile-startup', action='store_true',
+                               help='Print how long each start-up step took')
     
     # Client commands
     client_parser = subparsers.add_parser('client', help='Client commands')
@@ -1475,10 +2539,40 @@ def main():
     list_parser.add_argument('server_ip', help='Server IP address')
     list_parser.add_argument('--server-port', type=int, default=DEFAULT_PORT, help='Server port')
     
+    # Compare command: walks both Merkle trees, descending only where digests differ
+    compare_parser = client_subparsers.add_parser('compare', help='Compare the shared tree with a peer')
+    compare_parser.add_argument('server_ip', help='Peer IP address')
+    compare_parser.add_argument('--server-port', type=int, default=DEFAULT_PORT, help='Peer port')
+    compare_parser.add_argument('--path', default='', help='Directory to compare (default: whole tree)')
+    
+    # Discover command: prints peers as they answer and stops once the network is quiet
+    discover_parser = client_subparsers.add_parser('discover', help='Find devices on the local network')
+    discover_parser.add_argument('--timeout', type=float, default=Config.DISCOVERY_TIMEOUT, help='Maximum seconds to search')
+    discover_parser.add_argument('--count', type=int, help='Stop after this many devices')
+    
+    # Swarm download: different chunks of the file from every peer that holds it
+    swarm_parser = client_subparsers.add_parser('swarm-get', help='Download a file from several peers at once')
+    swarm_parser.add_argument('path', help='File path relative to the shared folder')
+    swarm_parser.add_argument('--peer', action='append', help='Peer as ip:port (can be used multiple times; default: discover)')
+    swarm_parser.add_argument('--dest', help='Local destination (default: same path in the shared folder)')
+    
+    # Delta sync commands: only the changed blocks of the file are transferred
+    pull_parser = client_subparsers.add_parser('pull', help='Update a local file from a peer')
+    pull_parser.add_argument('server_ip', help='Peer IP address')
+    pull_parser.add_argument('path', help='File path relative to the shared folder')
+    pull_parser.add_argument('--server-port', type=int, default=DEFAULT_PORT, help='Peer port')
+    pull_parser.add_argument('--dest', help='Local file to update (default: same path in the shared folder)')
+    
+    push_parser = client_subparsers.add_parser('push', help='Update a peer\'s copy of a local file')
+    push_parser.add_argument('server_ip', help='Peer IP address')
+    push_parser.add_argument('path', help='File path relative to the shared folder')
+    push_parser.add_argument('--server-port', type=int, default=DEFAULT_PORT, help='Peer port')
+    push_parser.add_argument('--source', help='Local file to send (default: same path in the shared folder)')
+    
     args = parser.parse_args()
     
     if args.command == 'server':
-        start_server(args.port)
+        start_server(args.port, profile_startup=args.profile_startup)
     elif args.command == 'client':
         if args.client_command == 'register':
             result = register_with_server(
@@ -1491,6 +2585,43 @@ def main():
         elif args.client_command == 'list':
             folders = list_shared_folders(args.server_ip, args.server_port)
             print(json.dumps(folders, indent=2))
+        elif args.client_command == 'compare':
+            try:
+                result = merkle_tree.compare(f"http://{args.server_ip}:{args.server_port}", args.path)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                result = {'error': str(e)}
+            print(json.dumps(result, indent=2))
+        elif args.client_command == 'discover':
+            started = time.time()
+            found = network_service.discover_services(
+                SERVICE_TYPE,
+                timeout=args.timeout,
+                max_results=args.count,
+                quiet_period=Config.DISCOVERY_QUIET_PERIOD,
+                on_found=lambda service: print(json.dumps(service), flush=True)
+            )
+            print(f"{len(found)} device(s) found in {time.time() - started:.3f}s", file=sys.stderr)
+        elif args.client_command == 'swarm-get':
+            if args.peer:
+                peers = [p if '://' in p else f"http://{p}" for p in args.peer]
+            else:
+                discover_devices(wait=Config.DISCOVERY_TIMEOUT)
+                peers = [url for _, url in peer_urls()]
+            try:
+                result = swarm_downloader.download(args.path, peers, args.dest)
+            except (requests.exceptions.RequestException, ValueError, OSError) as e:
+                result = {'error': str(e)}
+            print(json.dumps(result, indent=2))
+        elif args.client_command in ('pull', 'push'):
+            peer_url = f"http://{args.server_ip}:{args.server_port}"
+            try:
+                if args.client_command == 'pull':
+                    result = delta_sync.pull(peer_url, args.path, args.dest)
+                else:
+                    result = delta_sync.push(peer_url, args.path, args.source)
+            except (requests.exceptions.RequestException, ValueError, OSError) as e:
+                result = {'error': str(e)}
+            print(json.dumps(result, indent=2))
         else:
             client_parser.print_help()
     else:
@@ -1,14 +1,74 @@
+import importlib
+
+# Exported name -> submodule. Submodules are imported on first access, so
+# importing one service (e.g. services.path_index) does not load them all
+_SERVICES = {
+    'FileService': 'file_service',
+    'NetworkService': 'network_service',
+    'ArchiveService': 'archive_service',
+    'RarService': 'rar_service',
+    'DiscoveryService': 'discovery_service',
+    'ThumbnailService': 'thumbnail_service',
+    'PathIndex': 'path_index',
+    'ContentIndex': 'content_index',
+    'DuplicateService': 'duplicate_service',
+    'AnalyticsService': 'analytics_service',
+    'EventBus': 'event_bus',
+    'ChangeDetector': 'change_detector',
+    'ChangeJournal': 'change_journal',
+    'PeerNotifier': 'peer_notifier',
+    'DeltaSync': 'delta_sync',
+    'MerkleTree': 'merkle_tree',
+    'SwarmDownloader': 'swarm_download',
+    'DeviceRegistry': 'device_registry',
+    'NetworkIdentity': 'network_identity',
+    'FederatedBrowser': 'federated_browser',
+    'RelayService': 'relay_service',
+    'HealthChecker': 'health_checker',
+    'GossipMembership': 'gossip_membership',
+    'HashRing': 'hash_ring',
+    'ClusterStorage': 'cluster_storage',
+    'ChunkStore': 'chunk_store'
+}
+
+
+def __getattr__(name):
+    if name not in _SERVICES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_SERVICES[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_SERVICES))
 
-from .file_service import FileService
-from .network_service import NetworkService
-from .archive_service import ArchiveService
-from .rar_service import RarService
-from .discovery_service import DiscoveryService
 
 __all__ = [
     'FileService',
     'NetworkService', 
     'ArchiveService',
     'RarService',
-    'DiscoveryService'
+    'DiscoveryService',
+    'ThumbnailService',
+    'PathIndex',
+    'ContentIndex',
+    'DuplicateService',
+    'AnalyticsService',
+    'EventBus',
+    'ChangeDetector',
+    'ChangeJournal',
+    'PeerNotifier',
+    'DeltaSync',
+    'MerkleTree',
+    'SwarmDownloader',
+    'DeviceRegistry',
+    'NetworkIdentity',
+    'FederatedBrowser',
+    'RelayService',
+    'HealthChecker',
+    'GossipMembership',
+    'HashRing',
+    'ClusterStorage',
+    'ChunkStore'
 ]
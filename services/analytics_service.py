@@ -0,0 +1,383 @@
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from utils.lazy_import import lazy_import
+
+# Loaded with the first snapshot, not at start-up
+np = lazy_import('numpy')
+
+# Age buckets (upper bound in days, label) for the "bytes by age" report
+AGE_BUCKETS = [
+    (1, 'Son 24 saat'),
+    (7, 'Son 7 gün'),
+    (30, 'Son 30 gün'),
+    (90, 'Son 3 ay'),
+    (365, 'Son 1 yıl'),
+    (None, '1 yıldan eski'),
+]
+
+# Pending changes above this count trigger a full reload instead of a patch
+MAX_INCREMENTAL_CHANGES = 5000
+# Rebuild once this share of snapshot rows belongs to deleted entries
+MAX_DEAD_RATIO = 0.25
+
+
+class _Snapshot:
+    """Columnar copy of the path index: one numpy array per attribute, one row per entry."""
+
+    def __init__(self):
+        self.paths: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.ext_names: List[str] = []
+        self.ext_codes: Dict[str, int] = {}
+        self.type_names: List[str] = []
+        self.type_codes: Dict[str, int] = {}
+        self.size = np.zeros(0, dtype=np.int64)
+        self.mtime = np.zeros(0, dtype=np.float64)
+        self.is_dir = np.zeros(0, dtype=bool)
+        self.alive = np.zeros(0, dtype=bool)
+        self.ext = np.zeros(0, dtype=np.int32)
+        self.type = np.zeros(0, dtype=np.int32)
+        self.parent = np.zeros(0, dtype=np.int64)  # row of the parent directory, -1 for top level
+        self.depth = np.zeros(0, dtype=np.int32)
+        # Entries appended before their parent directory, attached to an ancestor instead
+        self.orphans = 0
+
+    def _code(self, names: List[str], codes: Dict[str, int], value: str) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(names)
+            names.append(value)
+        return code
+
+    def append(self, entries: List[tuple]) -> int:
+        """
+        Append index entries (path, parent, ext, type, size, mtime, is_dir).
+
+        Entries must come parents first. The index can list a file before
+        its new directory; such an entry is attached to its nearest ancestor
+        in the snapshot (or the top level). Returns the number of them.
+        """
+        start = len(self.paths)
+        columns = {name: [] for name in ('size', 'mtime', 'is_dir', 'ext', 'type', 'parent', 'depth')}
+        new_rows: Dict[str, int] = {}
+        orphans = 0
+        for offset, (path, parent, ext, file_type, size, mtime, is_dir) in enumerate(entries):
+            ancestor, parent_row = parent, None
+            while ancestor:
+                parent_row = new_rows.get(ancestor, self.rows.get(ancestor))
+                if parent_row is not None:
+                    break
+                ancestor = ancestor.rpartition('/')[0]
+            if parent_row is None:
+                parent_row = -1
+            if ancestor != parent:
+                orphans += 1
+            new_rows[path] = start + offset
+            columns['size'].append(size)
+            columns['mtime'].append(mtime)
+            columns['is_dir'].append(bool(is_dir))
+            columns['ext'].append(self._code(self.ext_names, self.ext_codes, ext))
+            columns['type'].append(self._code(self.type_names, self.type_codes, file_type))
+            columns['parent'].append(parent_row)
+            columns['depth'].append(path.count('/'))
+
+        self.paths.extend(e[0] for e in entries)
+        self.rows.update(new_rows)
+        self.size = np.concatenate([self.size, np.array(columns['size'], dtype=np.int64)])
+        self.mtime = np.concatenate([self.mtime, np.array(columns['mtime'], dtype=np.float64)])
+        self.is_dir = np.concatenate([self.is_dir, np.array(columns['is_dir'], dtype=bool)])
+        self.alive = np.concatenate([self.alive, np.ones(len(entries), dtype=bool)])
+        self.ext = np.concatenate([self.ext, np.array(columns['ext'], dtype=np.int32)])
+        self.type = np.concatenate([self.type, np.array(columns['type'], dtype=np.int32)])
+        self.parent = np.concatenate([self.parent, np.array(columns['parent'], dtype=np.int64)])
+        self.depth = np.concatenate([self.depth, np.array(columns['depth'], dtype=np.int32)])
+        self.orphans += orphans
+        return orphans
+
+    @property
+    def dead_ratio(self) -> float:
+        return 1 - (self.alive.sum() / len(self.alive)) if len(self.alive) else 0.0
+
+
+class AnalyticsService:
+    """
+    Storage analytics over a columnar snapshot of the path index.
+
+    The snapshot is loaded once and then patched from the index's change
+    notifications; every report is a handful of vectorized numpy
+    aggregations over it, cached until the next change.
+    """
+
+    def __init__(self, path_index, storage_limit: int = 0, refresh_interval: float = 5.0):
+        """
+        Initialize the AnalyticsService.
+
+        Args:
+            path_index: PathIndex the snapshot is built from
+            storage_limit: Configured storage limit in bytes, reported alongside usage
+            refresh_interval: Minimum seconds between applying pending changes
+        """
+        self.path_index = path_index
+        self.storage_limit = storage_limit
+        self.refresh_interval = refresh_interval
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        self._pending: Set[str] = set()
+        self._needs_reload = True
+        self._last_refresh = 0.0
+        self._version = 0
+        self._cache: Dict[Any, Any] = {}
+
+        path_index.add_listener(self._on_index_change)
+
+    # ------------------------------------------------------------------
+    # Snapshot maintenance
+    # ------------------------------------------------------------------
+    def _on_index_change(self, kind: str, rel_path: str) -> None:
+        with self._lock:
+            row = self._snapshot.rows.get(rel_path) if self._snapshot is not None else None
+            if kind == 'update':
+                self._pending.add(rel_path)
+            elif kind == 'remove' and (row is None or not self._snapshot.is_dir[row]):
+                self._pending.add(rel_path)
+            else:
+                # Directory removals and crawls touch whole subtrees
+                self._needs_reload = True
+
+    def _reload(self) -> _Snapshot:
+        started = time.time()
+        snapshot = _Snapshot()
+        orphans = snapshot.append(list(self.path_index.iter_entries()))
+        self.logger.info(f"Analytics snapshot of {len(snapshot.paths)} entries built in {time.time() - started:.2f}s")
+        if orphans:
+            self.logger.warning(f"{orphans} index entries have no indexed parent directory; "
+                                f"counted under their nearest indexed ancestor")
+        return snapshot
+
+    def _apply_changes(self, snapshot: _Snapshot, paths: Set[str]) -> bool:
+        """Patch the snapshot with the current index rows for ``paths``; False if a reload is needed."""
+        found = {row[0]: row for row in self.path_index.iter_entries(sorted(paths))}
+        new_entries = []
+        for path in sorted(paths):
+            row = snapshot.rows.get(path)
+            entry = found.get(path)
+            if entry is None:
+                if row is not None:
+                    if snapshot.is_dir[row]:
+                        return False
+                    snapshot.alive[row] = False
+            elif row is None or not snapshot.alive[row]:
+                if row is not None:
+                    del snapshot.rows[path]
+                new_entries.append(tuple(entry))
+            elif bool(entry[6]) != bool(snapshot.is_dir[row]):
+                return False
+            else:
+                snapshot.size[row] = entry[4]
+                snapshot.mtime[row] = entry[5]
+        if not new_entries:
+            return True
+        if snapshot.orphans and any(entry[6] for entry in new_entries):
+            # A missing directory may have arrived; a reload links its earlier children to it
+            return False
+        orphans = snapshot.append(new_entries)
+        if orphans:
+            self.logger.info(f"{orphans} changed entries have no indexed parent directory yet")
+        return True
+
+    def refresh(self, force: bool = False) -> _Snapshot:
+        """Bring the snapshot up to date, reloading only when patching is not possible."""
+        with self._refresh_lock:
+            return self._refresh(force)
+
+    def _refresh(self, force: bool) -> _Snapshot:
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._snapshot is not None and now - self._last_refresh < self.refresh_interval:
+                return self._snapshot
+            pending, self._pending = self._pending, set()
+            needs_reload = self._needs_reload or len(pending) > MAX_INCREMENTAL_CHANGES
+            self._needs_reload = False
+            snapshot = self._snapshot
+
+        if snapshot is None or needs_reload or snapshot.dead_ratio > MAX_DEAD_RATIO:
+            snapshot = self._reload()
+        elif pending and not self._apply_changes(snapshot, pending):
+            snapshot = self._reload()
+        elif not pending:
+            with self._lock:
+                self._last_refresh = now
+            return snapshot
+
+        with self._lock:
+            self._snapshot = snapshot
+            self._version += 1
+            self._cache.clear()
+            self._last_refresh = now
+        return snapshot
+
+    # ------------------------------------------------------------------
+    # Aggregation
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _dir_totals(snapshot: _Snapshot) -> 'np.ndarray':
+        """Total bytes below every directory row (file rows hold their own size)."""
+        n = len(snapshot.paths)
+        files = snapshot.alive & ~snapshot.is_dir
+        totals = np.where(files, snapshot.size, 0).astype(np.int64)
+        dirs = np.flatnonzero(snapshot.alive & snapshot.is_dir)
+        if n == 0:
+            return totals
+
+        # Add files to their parents, then roll directories up one level at a time
+        file_rows = np.flatnonzero(files & (snapshot.parent >= 0))
+        totals += np.bincount(snapshot.parent[file_rows], weights=snapshot.size[file_rows],
+                              minlength=n).astype(np.int64)
+        dirs = dirs[snapshot.parent[dirs] >= 0]
+        for depth in np.unique(snapshot.depth[dirs])[::-1]:
+            level = dirs[snapshot.depth[dirs] == depth]
+            np.add.at(totals, snapshot.parent[level], totals[level])
+        return totals
+
+    def _cached(self, key, compute):
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+        value = compute()
+        with self._lock:
+            self._cache[key] = value
+        return value
+
+    def get_report(self, top: int = 20) -> Dict[str, Any]:
+        """
+        Usage summary: largest files and directories, bytes by extension,
+        by type and by age.
+
+        Args:
+            top: Number of entries in the "largest" and "by extension" lists
+
+        Returns:
+            Report dictionary
+        """
+        snapshot = self.refresh()
+        return self._cached(('report', top), lambda: self._build_report(snapshot, top))
+
+    def _build_report(self, snapshot: _Snapshot, top: int) -> Dict[str, Any]:
+        files = snapshot.alive & ~snapshot.is_dir
+        file_rows = np.flatnonzero(files)
+        dir_rows = np.flatnonzero(snapshot.alive & snapshot.is_dir)
+        totals = self._dir_totals(snapshot)
+        used = int(snapshot.size[file_rows].sum())
+
+        def largest(rows: np.ndarray, values: np.ndarray) -> List[Dict[str, Any]]:
+            if len(rows) == 0:
+                return []
+            k = min(top, len(rows))
+            best = rows[np.argpartition(values[rows], -k)[-k:]]
+            best = best[np.argsort(values[best])[::-1]]
+            return [{'path': snapshot.paths[r], 'size': int(values[r]),
+                     'modified': float(snapshot.mtime[r])} for r in best]
+
+        def breakdown(codes: np.ndarray, names: List[str], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+            sizes = np.bincount(codes[file_rows], weights=snapshot.size[file_rows], minlength=len(names))
+            counts = np.bincount(codes[file_rows], minlength=len(names))
+            order = [i for i in np.argsort(sizes)[::-1] if counts[i] > 0]
+            items = [{'name': names[i] or '(yok)', 'size': int(sizes[i]), 'count': int(counts[i])}
+                     for i in order[:limit]]
+            if limit is not None and len(order) > limit:
+                rest = order[limit:]
+                items.append({'name': 'diğer', 'size': int(sizes[rest].sum()), 'count': int(counts[rest].sum())})
+            return items
+
+        age_days = (time.time() - snapshot.mtime[file_rows]) / 86400
+        edges = [days for days, _ in AGE_BUCKETS if days is not None]
+        buckets = np.digitize(age_days, edges, right=True)
+        age_sizes = np.bincount(buckets, weights=snapshot.size[file_rows], minlength=len(AGE_BUCKETS))
+        age_counts = np.bincount(buckets, minlength=len(AGE_BUCKETS))
+
+        return {
+            'generated': time.time(),
+            'snapshot_version': self._version,
+            'total_bytes': used,
+            'files': int(len(file_rows)),
+            'directories': int(len(dir_rows)),
+            'storage_limit': self.storage_limit,
+            'usage_percent': (used / self.storage_limit) * 100 if self.storage_limit > 0 else 0,
+            'largest_files': largest(file_rows, snapshot.size),
+            'largest_directories': largest(dir_rows, totals),
+            'by_extension': breakdown(snapshot.ext, snapshot.ext_names, top),
+            'by_type': breakdown(snapshot.type, snapshot.type_names),
+            'by_age': [{'name': label, 'size': int(age_sizes[i]), 'count': int(age_counts[i])}
+                       for i, (_, label) in enumerate(AGE_BUCKETS)]
+        }
+
+    def get_treemap(self, path: str = '', depth: int = 2, limit: int = 30) -> Dict[str, Any]:
+        """
+        Hierarchy of directory sizes for a treemap.
+
+        Args:
+            path: Relative directory at the root of the map ('' for the share)
+            depth: Number of levels below the root to include
+            limit: Children per node; the rest is merged into one "other" node
+
+        Returns:
+            Nested ``{name, path, size, children}`` dictionaries
+
+        Raises:
+            KeyError: If the path is not an indexed directory
+        """
+        snapshot = self.refresh()
+        path = path.strip('/')
+        return self._cached(('treemap', path, depth, limit),
+                            lambda: self._build_treemap(snapshot, path, depth, limit))
+
+    def _build_treemap(self, snapshot: _Snapshot, path: str, depth: int, limit: int) -> Dict[str, Any]:
+        if path:
+            root = snapshot.rows.get(path)
+            if root is None or not snapshot.alive[root] or not snapshot.is_dir[root]:
+                raise KeyError(path)
+        else:
+            root = -1
+
+        totals = self._dir_totals(snapshot)
+        alive = np.flatnonzero(snapshot.alive)
+        # Children of every row as contiguous slices of one sorted array
+        order = alive[np.argsort(snapshot.parent[alive], kind='stable')]
+        parents = snapshot.parent[order]
+
+        def build(row: int, level: int) -> Dict[str, Any]:
+            start, end = np.searchsorted(parents, [row, row + 1])
+            children = order[start:end]
+            node_path = snapshot.paths[row] if row >= 0 else ''
+            node = {
+                'name': node_path.rsplit('/', 1)[-1] if node_path else '/',
+                'path': node_path,
+                'size': int(totals[row]) if row >= 0 else int(totals[children].sum()),
+                'is_dir': True if row < 0 else bool(snapshot.is_dir[row])
+            }
+            if level >= depth or len(children) == 0:
+                return node
+
+            children = children[np.argsort(totals[children])[::-1]]
+            shown, rest = children[:limit], children[limit:]
+            node['children'] = [
+                build(int(c), level + 1) if snapshot.is_dir[c] else {
+                    'name': snapshot.paths[c].rsplit('/', 1)[-1],
+                    'path': snapshot.paths[c],
+                    'size': int(totals[c]),
+                    'is_dir': False
+                }
+                for c in shown if totals[c] > 0
+            ]
+            if len(rest):
+                node['children'].append({'name': 'diğer', 'path': None, 'size': int(totals[rest].sum()),
+                                         'is_dir': False, 'count': int(len(rest))})
+            return node
+
+        return build(root, 0)
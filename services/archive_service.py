@@ -1,13 +1,15 @@
 import os
 import zipfile
-import rarfile
 import logging
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Any, Tuple
 
-from config import Config
+from config import Config, configure_rarfile
 from utils.helpers import build_directory_structure
+from utils.lazy_import import lazy_import
+
+rarfile = lazy_import('rarfile', on_load=configure_rarfile)
 
 
 class ArchiveService:
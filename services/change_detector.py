@@ -0,0 +1,385 @@
+import os
+import time
+import heapq
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from watchdog.events import (
+    FileSystemEventHandler, FileCreatedEvent, FileModifiedEvent, FileDeletedEvent,
+    DirCreatedEvent, DirDeletedEvent
+)
+
+INOTIFY_WATCHES_FILE = '/proc/sys/fs/inotify/max_user_watches'
+# Share of the system-wide inotify limit we allow ourselves; other programs need watches too
+WATCH_BUDGET_RATIO = 0.5
+# Upper bound on recursive watch roots (each one is an emitter thread)
+MAX_WATCH_ROOTS = 64
+# A directory counts as hot for this long after it was browsed or changed
+HOT_PERIOD = 300
+# Detection lag samples kept for the percentile metric
+LAG_SAMPLES = 1000
+
+
+def system_watch_limit() -> Optional[int]:
+    """inotify watch limit of this system, or None where inotify is not used."""
+    try:
+        with open(INOTIFY_WATCHES_FILE) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+class ChangeDetector:
+    """
+    Hybrid change detection for shares larger than the inotify watch budget.
+
+    Subtrees that fit the budget get a recursive watchdog watch, preferring
+    recently active and recently browsed ones. Everything else is covered by
+    an incremental scandir snapshot-diff poller that rescans a bounded number
+    of directories per tick, hot directories first, and emits the same
+    watchdog events to the handler.
+    """
+
+    def __init__(self, base_path: str, handler: FileSystemEventHandler, max_watches: Optional[int] = None,
+                 poll_interval: float = 2.0, dirs_per_poll: int = 200, replan_interval: float = 900):
+        """
+        Initialize the ChangeDetector.
+
+        Args:
+            base_path: Directory to watch
+            handler: watchdog event handler receiving all events
+            max_watches: Watch budget; defaults to a share of the system inotify limit
+            poll_interval: Seconds between poller ticks
+            dirs_per_poll: Directories rescanned per tick
+            replan_interval: Seconds between recounting the tree and redistributing watches
+        """
+        self.base_path = os.path.abspath(base_path)
+        self.handler = handler
+        if max_watches is None:
+            limit = system_watch_limit()
+            max_watches = int(limit * WATCH_BUDGET_RATIO) if limit else None
+        self.max_watches = max_watches
+        self.poll_interval = poll_interval
+        self.dirs_per_poll = max(1, dirs_per_poll)
+        self.replan_interval = replan_interval
+        self.logger = logging.getLogger(__name__)
+
+        self.observer = None  # created by start(); the observer backend is imported then
+        self._lock = threading.RLock()
+        self._watches: Dict[str, Any] = {}  # watched subtree root -> ObservedWatch
+        self._watch_cost = 0
+        self._snapshots: Dict[str, Dict[str, Tuple[bool, int, int]]] = {}  # polled dir -> entries
+        self._cold: deque = deque()  # round-robin order of polled dirs
+        self._hot: Dict[str, float] = {}  # dir -> last activity
+        self._last_scan: Dict[str, float] = {}
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self._lags: deque = deque(maxlen=LAG_SAMPLES)
+        self._cycle_started = time.monotonic()
+        self._cycle_remaining = 0
+        self.last_cycle_seconds: Optional[float] = None
+        self.last_plan: Optional[float] = None
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def start(self) -> None:
+        """Plan watches and start the observer and the poller. Safe to call more than once."""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            if self.observer is None:
+                from watchdog.observers import Observer
+                self.observer = Observer()
+        self.observer.start()
+        if self.max_watches is None:
+            # No watch budget to respect: a single recursive watch covers everything
+            self._schedule(self.base_path)
+            return
+        self._thread = threading.Thread(target=self._run, name="ChangeDetectorPoller", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+    def _run(self) -> None:
+        try:
+            self.plan()
+        except Exception as e:
+            self.logger.error(f"Watch planning failed: {e}", exc_info=True)
+        while self._running:
+            time.sleep(self.poll_interval)
+            try:
+                if time.time() - (self.last_plan or 0) >= self.replan_interval:
+                    self.plan()
+                self.poll()
+            except Exception as e:
+                self.logger.error(f"Change poller failed: {e}", exc_info=True)
+
+    # ------------------------------------------------------------------
+    # Watch planning
+    # ------------------------------------------------------------------
+    def _count_dirs(self) -> Tuple[Dict[str, int], Dict[str, List[str]]]:
+        """Walk the tree once; returns subtree directory counts and direct subdirectories."""
+        children: Dict[str, List[str]] = {}
+        order = []
+        stack = [self.base_path]
+        while stack:
+            directory = stack.pop()
+            order.append(directory)
+            subdirs = []
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                pass
+            children[directory] = subdirs
+            stack.extend(subdirs)
+
+        counts: Dict[str, int] = {}
+        for directory in reversed(order):
+            counts[directory] = 1 + sum(counts[c] for c in children[directory])
+        return counts, children
+
+    def _priority(self, directory: str) -> float:
+        """Most recent activity in or below a directory (0 if none)."""
+        prefix = directory + os.sep
+        return max((t for d, t in self._hot.items() if d == directory or d.startswith(prefix)), default=0.0)
+
+    def plan(self) -> None:
+        """(Re)distribute the watch budget and put everything else under the poller."""
+        counts, children = self._count_dirs()
+        budget = self.max_watches
+        watch_roots: List[str] = []
+        polled: List[str] = []
+
+        if counts[self.base_path] <= budget:
+            watch_roots.append(self.base_path)
+        else:
+            # Expand oversized subtrees; hot and small subtrees are watched first
+            polled.append(self.base_path)
+            now = time.time()
+            heap = []
+            for child in children[self.base_path]:
+                heapq.heappush(heap, (-self._is_hot(child, now), counts[child], child))
+            while heap:
+                _, cost, directory = heapq.heappop(heap)
+                if cost <= budget and len(watch_roots) < MAX_WATCH_ROOTS:
+                    watch_roots.append(directory)
+                    budget -= cost
+                    continue
+                polled.append(directory)
+                for child in children[directory]:
+                    heapq.heappush(heap, (-self._is_hot(child, now), counts[child], child))
+
+        with self._lock:
+            for root in [r for r in self._watches if r not in watch_roots]:
+                self.observer.unschedule(self._watches.pop(root))
+            for root in watch_roots:
+                if root not in self._watches and not self._schedule(root):
+                    polled.extend(d for d in counts if d == root or d.startswith(root + os.sep))
+            self._watch_cost = sum(counts[r] for r in self._watches)
+
+            polled_set = set(polled)
+            for directory in [d for d in self._snapshots if d not in polled_set]:
+                self._forget(directory)
+            for directory in polled:
+                if directory not in self._snapshots:
+                    # Directories that just stopped being watched need a baseline, not events
+                    self._snapshots[directory] = self._list(directory) or {}
+                    self._last_scan[directory] = time.time()
+                    self._cold.append(directory)
+            self.last_plan = time.time()
+            self._cycle_started = time.monotonic()
+            self._cycle_remaining = len(self._cold)
+
+        self.logger.info(
+            f"Change detection: {len(self._watches)} watched subtrees ({self._watch_cost} dirs), "
+            f"{len(self._snapshots)} polled dirs, budget {self.max_watches}"
+        )
+
+    def _is_hot(self, directory: str, now: float) -> int:
+        return int(now - self._priority(directory) < HOT_PERIOD)
+
+    def _schedule(self, root: str) -> bool:
+        try:
+            self._watches[root] = self.observer.schedule(self.handler, root, recursive=True)
+            return True
+        except OSError as e:
+            self.logger.warning(f"Could not watch {root}, polling it instead: {e}")
+            return False
+
+    def _forget(self, directory: str) -> None:
+        self._snapshots.pop(directory, None)
+        self._last_scan.pop(directory, None)
+        try:
+            self._cold.remove(directory)
+        except ValueError:
+            pass
+
+    # ------------------------------------------------------------------
+    # Polling
+    # ------------------------------------------------------------------
+    def touch(self, path: str) -> None:
+        """Mark a directory as recently browsed or active so it is polled first."""
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            path = os.path.dirname(path)
+        with self._lock:
+            self._hot[path] = time.time()
+
+    def _is_watched(self, path: str) -> bool:
+        return any(path == root or path.startswith(root + os.sep) for root in self._watches)
+
+    @staticmethod
+    def _list(directory: str) -> Optional[Dict[str, Tuple[bool, int, int]]]:
+        entries = {}
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entries[entry.name] = (is_dir, 0 if is_dir else st.st_size, st.st_mtime_ns)
+        except OSError:
+            return None
+        return entries
+
+    def poll(self) -> int:
+        """
+        Rescan the next batch of polled directories and emit events for differences.
+
+        Hot directories are rescanned on every tick; the rest share the
+        remaining per-tick budget round-robin.
+
+        Returns:
+            Number of events emitted
+        """
+        now = time.time()
+        with self._lock:
+            for directory in [d for d, t in self._hot.items() if now - t >= HOT_PERIOD]:
+                del self._hot[directory]
+            hot = [d for d in self._hot if d in self._snapshots][:self.dirs_per_poll]
+            batch = list(hot)
+            while len(batch) < self.dirs_per_poll and self._cold:
+                directory = self._cold.popleft()
+                self._cold.append(directory)
+                if directory not in batch:
+                    batch.append(directory)
+                self._cycle_remaining -= 1
+                if self._cycle_remaining <= 0:
+                    self.last_cycle_seconds = time.monotonic() - self._cycle_started
+                    self._cycle_started = time.monotonic()
+                    self._cycle_remaining = len(self._cold)
+                if len(batch) >= len(self._snapshots):
+                    break
+
+        emitted = 0
+        for directory in batch:
+            emitted += self._scan(directory)
+        return emitted
+
+    def _scan(self, directory: str) -> int:
+        current = self._list(directory)
+        now = time.time()
+        with self._lock:
+            previous = self._snapshots.get(directory)
+            if previous is None:
+                return 0
+            if current is None:
+                # The directory itself is gone; its parent's scan reports the deletion
+                self._forget(directory)
+                return 0
+            self._snapshots[directory] = current
+            self._last_scan[directory] = now
+
+        events = []
+        for name, (is_dir, size, mtime_ns) in current.items():
+            path = os.path.join(directory, name)
+            old = previous.get(name)
+            if old is None:
+                events.append(DirCreatedEvent(path) if is_dir else FileCreatedEvent(path))
+                self._record_lag(now - mtime_ns / 1e9)
+                if is_dir and not self._is_watched(path):
+                    self._adopt(path, events)
+            elif old[0] != is_dir:
+                events.append(DirDeletedEvent(path) if old[0] else FileDeletedEvent(path))
+                events.append(DirCreatedEvent(path) if is_dir else FileCreatedEvent(path))
+            elif not is_dir and (old[1] != size or old[2] != mtime_ns):
+                events.append(FileModifiedEvent(path))
+                self._record_lag(now - mtime_ns / 1e9)
+        for name, (is_dir, _, _) in previous.items():
+            if name not in current:
+                path = os.path.join(directory, name)
+                events.append(DirDeletedEvent(path) if is_dir else FileDeletedEvent(path))
+                if is_dir:
+                    with self._lock:
+                        for polled in [d for d in self._snapshots if d == path or d.startswith(path + os.sep)]:
+                            self._forget(polled)
+
+        if events:
+            with self._lock:
+                self._hot[directory] = now
+            for event in events:
+                self.handler.dispatch(event)
+        return len(events)
+
+    def _adopt(self, directory: str, events: list) -> None:
+        """Start polling a new directory tree, reporting what it already contains."""
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            entries = self._list(current)
+            if entries is None:
+                continue
+            with self._lock:
+                self._snapshots[current] = entries
+                self._last_scan[current] = time.time()
+                self._cold.append(current)
+                self._hot[current] = time.time()
+            for name, (is_dir, _, _) in entries.items():
+                path = os.path.join(current, name)
+                events.append(DirCreatedEvent(path) if is_dir else FileCreatedEvent(path))
+                if is_dir:
+                    stack.append(path)
+
+    def _record_lag(self, lag: float) -> None:
+        self._lags.append(max(0.0, lag))
+
+    # ------------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------------
+    def get_stats(self) -> Dict[str, Any]:
+        """Watch/poll split and detection lag of the poller (seconds)."""
+        with self._lock:
+            lags = sorted(self._lags)
+            oldest = min(self._last_scan.values(), default=None)
+            return {
+                'watch_budget': self.max_watches,
+                'watched_subtrees': len(self._watches),
+                'watched_dirs': self._watch_cost,
+                'polled_dirs': len(self._snapshots),
+                'hot_dirs': len(self._hot),
+                'poll_cycle_seconds': self.last_cycle_seconds,
+                'oldest_scan_age': time.time() - oldest if oldest else None,
+                'lag': {
+                    'samples': len(lags),
+                    'avg': sum(lags) / len(lags) if lags else None,
+                    'p95': lags[int(len(lags) * 0.95) - 1] if lags else None,
+                    'max': lags[-1] if lags else None
+                },
+                'last_plan': self.last_plan
+            }
@@ -0,0 +1,361 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    action TEXT NOT NULL,
+    path TEXT NOT NULL,
+    src TEXT,
+    size INTEGER,
+    mtime REAL,
+    is_dir INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_journal_path ON journal(path);
+CREATE TABLE IF NOT EXISTS state (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    is_dir INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_state_parent ON state(parent);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _parent(rel_path: str) -> str:
+    return rel_path.rsplit('/', 1)[0] if '/' in rel_path else ''
+
+
+class ChangeJournal:
+    """
+    Persistent journal of filesystem changes with monotonically increasing sequence numbers.
+
+    Alongside the journal the last known state of every path is kept, so
+    after a restart the tree can be diffed against it directory by
+    directory and changes made while the process was down are journaled
+    too. Compaction keeps only the newest entry per path and eventually
+    drops old deletions; readers behind the dropped range are told to
+    resync.
+    """
+
+    def __init__(self, base_path: str, db_path: str, retention_days: float = 30,
+                 compact_interval: float = 3600):
+        """
+        Initialize the ChangeJournal.
+
+        Args:
+            base_path: Root directory whose changes are journaled
+            db_path: Location of the SQLite database
+            retention_days: Deletions older than this are dropped during compaction
+            compact_interval: Seconds between automatic compactions
+        """
+        self.base_path = os.path.abspath(base_path)
+        self.db_path = db_path
+        self.retention = retention_days * 86400
+        self.compact_interval = compact_interval
+        self.logger = logging.getLogger(__name__)
+
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._last_compaction = time.monotonic()
+        self.reconciling = False
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._writer = self._connect()
+        with self._write_lock, self._writer:
+            self._writer.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def relative_path(self, abs_path: str) -> Optional[str]:
+        rel_path = os.path.relpath(os.path.abspath(abs_path), self.base_path).replace('\\', '/')
+        if rel_path == '.' or rel_path == '..' or rel_path.startswith('../'):
+            return None
+        return rel_path
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+    def append(self, events: Iterable) -> int:
+        """
+        Journal a batch of coalesced change events (event bus subscriber).
+
+        Args:
+            events: Objects with ``action``, ``path``, ``is_directory`` and ``src_path``
+
+        Returns:
+            Sequence number of the last entry written
+        """
+        with self._write_lock, self._writer:
+            for event in events:
+                rel_path = self.relative_path(event.path)
+                if rel_path is None:
+                    continue
+                src = self.relative_path(event.src_path) if event.src_path else None
+                self._record(event.action, rel_path, event.path, bool(event.is_directory), src)
+        last_seq = self.latest_seq()
+
+        if time.monotonic() - self._last_compaction >= self.compact_interval:
+            threading.Thread(target=self.compact, name="JournalCompaction", daemon=True).start()
+        return last_seq
+
+    def _record(self, action: str, rel_path: str, abs_path: str, is_dir: bool, src: Optional[str] = None,
+                st: Optional[os.stat_result] = None) -> None:
+        """Write one journal entry and update the state table. Caller holds the write lock."""
+        conn = self._writer
+        if action == 'deleted':
+            self._drop_state(rel_path)
+            conn.execute('INSERT INTO journal (ts, action, path, is_dir) VALUES (?, ?, ?, ?)',
+                         (time.time(), action, rel_path, int(is_dir)))
+            return
+
+        if st is None:
+            try:
+                st = os.stat(abs_path)
+            except OSError:
+                # Gone again before we got to it; record what consumers can act on
+                if action == 'moved' and src:
+                    self._drop_state(src)
+                    conn.execute('INSERT INTO journal (ts, action, path, is_dir) VALUES (?, ?, ?, ?)',
+                                 (time.time(), 'deleted', src, int(is_dir)))
+                return
+
+        if action == 'moved' and src:
+            self._move_state(src, rel_path)
+        size = 0 if is_dir else st.st_size
+        conn.execute(
+            """INSERT INTO state (path, parent, size, mtime_ns, is_dir) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns,
+                   is_dir = excluded.is_dir""",
+            (rel_path, _parent(rel_path), size, st.st_mtime_ns, int(is_dir))
+        )
+        conn.execute(
+            'INSERT INTO journal (ts, action, path, src, size, mtime, is_dir) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (time.time(), action, rel_path, src if action == 'moved' else None, size, st.st_mtime, int(is_dir))
+        )
+
+    def _drop_state(self, rel_path: str) -> None:
+        self._writer.execute('DELETE FROM state WHERE path = ? OR (path >= ? AND path < ?)',
+                             (rel_path, f"{rel_path}/", f"{rel_path}0"))
+
+    def _move_state(self, src: str, dest: str) -> None:
+        self._writer.execute('DELETE FROM state WHERE path = ?', (src,))
+        # Re-root the subtree: "src/a/b" becomes "dest/a/b"
+        self._writer.execute(
+            """UPDATE OR REPLACE state SET path = ? || substr(path, ?), parent = ? || substr(parent, ?)
+               WHERE path >= ? AND path < ?""",
+            (dest, len(src) + 1, dest, len(src) + 1, f"{src}/", f"{src}0")
+        )
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+    def latest_seq(self) -> int:
+        # sqlite_sequence survives compaction, unlike MAX(seq)
+        row = self._reader().execute("SELECT seq FROM sqlite_sequence WHERE name = 'journal'").fetchone()
+        return row[0] if row else 0
+
+    def _floor(self) -> int:
+        row = self._reader().execute("SELECT value FROM meta WHERE key = 'floor'").fetchone()
+        return int(row['value']) if row else 0
+
+    def changes_since(self, since: int, limit: int = 1000, path: str = '') -> Dict[str, Any]:
+        """
+        Changes with a sequence number greater than ``since``, oldest first.
+
+        Args:
+            since: Last sequence number the caller has processed (0 for everything)
+            limit: Maximum number of entries
+            path: Only return changes at or below this relative directory
+
+        Returns:
+            Dictionary with ``changes``, ``next`` (the cursor for the next call),
+            ``more`` and ``reset``. ``reset`` means entries the caller has not
+            seen were compacted away and it should rescan instead.
+        """
+        sql = 'SELECT seq, ts, action, path, src, size, mtime, is_dir FROM journal WHERE seq > ?'
+        params: List[Any] = [since]
+        if path:
+            path = path.strip('/')
+            sql += ' AND (path = ? OR (path >= ? AND path < ?) OR (src >= ? AND src < ?) OR src = ?)'
+            params.extend([path, f"{path}/", f"{path}0", f"{path}/", f"{path}0", path])
+        sql += ' ORDER BY seq LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self._reader().execute(sql, params).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        changes = [{
+            'seq': row['seq'],
+            'time': row['ts'],
+            'action': row['action'],
+            'path': row['path'],
+            'src_path': row['src'],
+            'size': row['size'],
+            'modified': row['mtime'],
+            'is_dir': bool(row['is_dir'])
+        } for row in rows]
+        return {
+            'changes': changes,
+            'next': changes[-1]['seq'] if changes else max(since, 0),
+            'latest': self.latest_seq(),
+            'more': more,
+            'reset': since < self._floor()
+        }
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+    def compact(self) -> int:
+        """
+        Keep only the newest entry per path and drop deletions past the retention period.
+
+        A move that is superseded by a later change to its destination is
+        turned into a deletion of its source, so readers still learn that
+        the source is gone.
+
+        Returns:
+            Number of entries removed
+        """
+        self._last_compaction = time.monotonic()
+        cutoff = time.time() - self.retention
+        with self._write_lock, self._writer:
+            # A superseded move still carries the removal of its source: keep that part as a deletion
+            # at the move's position. Repeat for chains (a -> b -> c), where the new deletion of b
+            # supersedes the first move in turn
+            while self._writer.execute(
+                """UPDATE journal SET action = 'deleted', path = src, src = NULL, size = NULL, mtime = NULL
+                   WHERE action = 'moved' AND src IS NOT NULL
+                   AND EXISTS (SELECT 1 FROM journal AS newer WHERE newer.path = journal.path AND newer.seq > journal.seq)"""
+            ).rowcount:
+                pass
+            removed = self._writer.execute(
+                'DELETE FROM journal WHERE seq NOT IN (SELECT MAX(seq) FROM journal GROUP BY path)'
+            ).rowcount
+            dropped = self._writer.execute(
+                "SELECT MAX(seq) FROM journal WHERE action = 'deleted' AND ts < ?", (cutoff,)
+            ).fetchone()[0]
+            if dropped:
+                removed += self._writer.execute(
+                    "DELETE FROM journal WHERE action = 'deleted' AND ts < ?", (cutoff,)
+                ).rowcount
+                self._writer.execute(
+                    """INSERT INTO meta (key, value) VALUES ('floor', ?)
+                       ON CONFLICT(key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), excluded.value)""",
+                    (str(dropped),)
+                )
+        if removed:
+            self.logger.info(f"Compacted change journal, removed {removed} entries")
+        return removed
+
+    def reconcile(self) -> int:
+        """
+        Journal changes made while the process was not running.
+
+        Every directory is listed with scandir and compared with the recorded
+        state of its children. Each directory is compared under the write
+        lock, so watcher events arriving meanwhile cannot be mistaken for
+        differences.
+
+        Returns:
+            Number of entries written
+        """
+        self.reconciling = True
+        started = time.time()
+        written = 0
+        try:
+            stack = ['']
+            while stack:
+                rel_dir = stack.pop()
+                abs_dir = os.path.join(self.base_path, rel_dir) if rel_dir else self.base_path
+                with self._write_lock, self._writer:
+                    count, subdirs = self._reconcile_dir(rel_dir, abs_dir)
+                written += count
+                stack.extend(subdirs)
+        finally:
+            self.reconciling = False
+        self.logger.info(f"Change journal reconciled in {time.time() - started:.1f}s, {written} changes")
+        return written
+
+    def _reconcile_dir(self, rel_dir: str, abs_dir: str) -> Tuple[int, List[str]]:
+        current: Dict[str, Tuple[os.stat_result, bool]] = {}
+        try:
+            with os.scandir(abs_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.is_symlink():
+                            continue
+                        current[entry.name] = (entry.stat(), entry.is_dir())
+                    except OSError:
+                        continue
+        except OSError:
+            return 0, []
+
+        known = {
+            row['path'].rsplit('/', 1)[-1]: row
+            for row in self._writer.execute('SELECT path, size, mtime_ns, is_dir FROM state WHERE parent = ?',
+                                            (rel_dir,))
+        }
+
+        written, subdirs = 0, []
+        for name, (st, is_dir) in current.items():
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            abs_path = os.path.join(abs_dir, name)
+            old = known.pop(name, None)
+            if old is not None and bool(old['is_dir']) != is_dir:
+                self._record('deleted', rel_path, abs_path, bool(old['is_dir']))
+                written += 1
+                old = None
+            if old is None:
+                self._record('created', rel_path, abs_path, is_dir, st=st)
+                written += 1
+            elif not is_dir and (old['size'] != st.st_size or old['mtime_ns'] != st.st_mtime_ns):
+                self._record('modified', rel_path, abs_path, is_dir, st=st)
+                written += 1
+            if is_dir:
+                subdirs.append(rel_path)
+
+        for name, old in known.items():
+            rel_path = f"{rel_dir}/{name}" if rel_dir else name
+            self._record('deleted', rel_path, os.path.join(abs_dir, name), bool(old['is_dir']))
+            written += 1
+        return written, subdirs
+
+    def start_background_reconcile(self) -> None:
+        threading.Thread(target=self.reconcile, name="JournalReconcile", daemon=True).start()
+
+    def get_stats(self) -> Dict[str, Any]:
+        conn = self._reader()
+        return {
+            'latest_seq': self.latest_seq(),
+            'floor': self._floor(),
+            'entries': conn.execute('SELECT COUNT(*) FROM journal').fetchone()[0],
+            'tracked_paths': conn.execute('SELECT COUNT(*) FROM state').fetchone()[0],
+            'reconciling': self.reconciling
+        }
+
+    def close(self) -> None:
+        with self._write_lock:
+            self._writer.close()
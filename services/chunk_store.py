@@ -0,0 +1,613 @@
+import io
+import os
+import time
+import bisect
+import struct
+import sqlite3
+import hashlib
+import logging
+import threading
+import importlib.util
+from collections import Counter
+from functools import cached_property
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+from utils.lazy_import import lazy_import
+from utils.fastcdc import Chunker
+from utils import wire, peer_auth
+
+requests = lazy_import('requests')
+zstandard = lazy_import('zstandard')
+HAS_ZSTD = importlib.util.find_spec('zstandard') is not None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    hash BLOB PRIMARY KEY,
+    pack INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    compressed INTEGER NOT NULL,
+    refs INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_chunks_pack ON chunks(pack);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    recipe BLOB NOT NULL
+);
+"""
+
+# Chunk record in a pack and on the wire: hash, compressed flag, stored size, then the stored bytes
+RECORD_HEADER = struct.Struct('>32sBI')
+# Recipe entry: chunk hash and its size
+RECIPE_ENTRY = struct.Struct('>32sI')
+HASH_SIZE = 32
+# Chunks hashed, looked up and appended together while storing a file
+BATCH_BYTES = 8 * 1024 * 1024
+# Chunks asked from a peer per request, and hashes per SQL lookup
+FETCH_BATCH = 256
+LOOKUP_BATCH = 500
+# Compressed chunks are kept only if at least this much smaller
+MIN_COMPRESSION_GAIN = 0.9
+
+RECIPE_PATH = '/api/peer/chunkstore/recipe/'
+CHUNKS_PATH = '/api/peer/chunkstore/chunks'
+
+
+def _recipe(data: bytes) -> List[Tuple[bytes, int]]:
+    return list(RECIPE_ENTRY.iter_unpack(data))
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    while len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            raise ValueError('Truncated chunk stream')
+        data += more
+    return data
+
+
+class ChunkReader(io.RawIOBase):
+    """Seekable read-only view of a stored file, rebuilt chunk by chunk from the packs."""
+
+    def __init__(self, store: 'ChunkStore', recipe: List[Tuple[bytes, int]]):
+        self.store = store
+        self.recipe = recipe
+        self.ends: List[int] = []
+        total = 0
+        for _, size in recipe:
+            total += size
+            self.ends.append(total)
+        self.size = total
+        self._pos = 0
+        self._index = -1  # recipe entry of the cached chunk
+        self._chunk = b''
+        self._locations: Dict[bytes, Tuple[int, int, int, int]] = {}
+        self._packs: Dict[int, BinaryIO] = {}
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('Negative seek position')
+        self._pos = offset
+        return offset
+
+    def _load(self, index: int) -> bytes:
+        if index != self._index:
+            digest = self.recipe[index][0]
+            if digest not in self._locations:
+                # Look ahead so sequential reads cost one query per LOOKUP_BATCH chunks
+                ahead = {d for d, _ in self.recipe[index:index + LOOKUP_BATCH]}
+                self._locations = self.store.locate(ahead)
+                if digest not in self._locations:
+                    raise OSError(f"Chunk {digest.hex()} is missing from the store")
+            try:
+                self._chunk = self.store.read_chunk(digest, self._locations[digest], self._packs)
+            except FileNotFoundError:
+                # The pack was compacted away since the lookup; the chunk lives in a newer one now
+                self._locations = self.store.locate({digest})
+                self._chunk = self.store.read_chunk(digest, self._locations[digest], self._packs)
+            self._index = index
+        return self._chunk
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self.size:
+            return 0
+        index = bisect.bisect_right(self.ends, self._pos)
+        chunk = self._load(index)
+        start = self._pos - (self.ends[index] - len(chunk))
+        count = min(len(buffer), len(chunk) - start)
+        buffer[:count] = chunk[start:start + count]
+        self._pos += count
+        return count
+
+    def close(self) -> None:
+        for pack in self._packs.values():
+            pack.close()
+        self._packs.clear()
+        super().close()
+
+
+class ChunkStore:
+    """
+    Deduplicating file store built from content-defined chunks.
+
+    Files are cut into FastCDC chunks; each distinct chunk is kept once,
+    optionally zstd-compressed, in append-only pack files, and a file is
+    a recipe listing its chunks. Versions of a document or VM image share
+    everything but the chunks around their edits. A SQLite index maps a
+    chunk hash to its pack and offset and counts the recipes using it;
+    chunks no recipe uses are dropped when their pack is compacted.
+
+    Reads stream the file back through a seekable reader. Pulling a file
+    from a peer first fetches its recipe, then only the chunks this store
+    does not have yet.
+    """
+
+    def __init__(self, root: str, avg_chunk_size: int = 32 * 1024, pack_size: int = 256 * 1024 * 1024,
+                 compress: bool = True, timeout: float = 30.0):
+        """
+        Initialize the ChunkStore.
+
+        Args:
+            root: Directory holding the packs and the index
+            avg_chunk_size: Typical chunk size in bytes
+            pack_size: A new pack is started once the current one reaches this size
+            compress: Keep chunks zstd-compressed when it saves space (needs zstandard)
+            timeout: Timeout of requests to peers in seconds
+        """
+        self.root = os.path.abspath(root)
+        self.chunker = Chunker(avg_chunk_size)
+        self.pack_size = pack_size
+        self.compress = compress and HAS_ZSTD
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__)
+
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(self.root, exist_ok=True)
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+        self._writer.commit()
+
+        packs = self._pack_ids()
+        self._pack_id = packs[-1] if packs else 1
+        self._pack = open(self._pack_path(self._pack_id), 'ab')
+        self.stats = {'chunks_written': 0, 'chunks_deduplicated': 0, 'bytes_written': 0,
+                      'chunks_fetched': 0, 'bytes_fetched': 0, 'compactions': 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(os.path.join(self.root, 'index.db'), check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        """Per-thread read connection; WAL lets readers run alongside the writer."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    @cached_property
+    def session(self):
+        """Pooled HTTP session, created with the first pull."""
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.headers.update(peer_auth.headers())
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def close(self) -> None:
+        with self._write_lock:
+            self._pack.close()
+            self._writer.close()
+
+    @staticmethod
+    def normalize(path: str) -> str:
+        """Key of a stored file; raises ValueError for empty paths and ``..`` components."""
+        parts = [part for part in path.replace('\\', '/').split('/') if part and part != '.']
+        if not parts or '..' in parts:
+            raise ValueError('Invalid path')
+        return '/'.join(parts)
+
+    # ------------------------------------------------------------------
+    # Packs
+    # ------------------------------------------------------------------
+    def _pack_path(self, pack_id: int) -> str:
+        return os.path.join(self.root, f"pack-{pack_id:06d}.dat")
+
+    def _pack_ids(self) -> List[int]:
+        return sorted(int(name[5:11]) for name in os.listdir(self.root)
+                      if name.startswith('pack-') and name.endswith('.dat'))
+
+    def _append(self, records: List[Tuple[bytes, int, bytes, bool]]) -> List[Tuple[bytes, int, int, int, int, int]]:
+        """Write (hash, size, stored bytes, compressed) records to the current pack. Caller holds the write lock."""
+        rows = []
+        for digest, size, payload, compressed in records:
+            if self._pack.tell() >= self.pack_size:
+                self._pack.close()
+                self._pack_id += 1
+                self._pack = open(self._pack_path(self._pack_id), 'ab')
+            self._pack.write(RECORD_HEADER.pack(digest, int(compressed), len(payload)))
+            rows.append((digest, self._pack_id, self._pack.tell(), len(payload), size, int(compressed)))
+            self._pack.write(payload)
+        # The index must never point at bytes that are not on disk
+        self._pack.flush()
+        os.fsync(self._pack.fileno())
+        return rows
+
+    def _encode(self, data: bytes, compressor) -> Tuple[bytes, bool]:
+        if compressor is not None:
+            packed = compressor.compress(data)
+            if len(packed) < len(data) * MIN_COMPRESSION_GAIN:
+                return packed, True
+        return data, False
+
+    def locate(self, digests: Iterable[bytes]) -> Dict[bytes, Tuple[int, int, int, int]]:
+        """Hash -> (pack, offset, stored size, compressed) of the given chunks that are stored."""
+        digests = list(digests)
+        found = {}
+        conn = self._reader()
+        for i in range(0, len(digests), LOOKUP_BATCH):
+            batch = digests[i:i + LOOKUP_BATCH]
+            rows = conn.execute(
+                f"SELECT hash, pack, offset, stored_size, compressed FROM chunks WHERE hash IN "
+                f"({','.join('?' * len(batch))})", batch)
+            for digest, pack, offset, stored_size, compressed in rows:
+                found[digest] = (pack, offset, stored_size, compressed)
+        return found
+
+    def read_stored(self, location: Tuple[int, int, int, int], packs: Dict[int, BinaryIO]) -> bytes:
+        """Bytes of a chunk as kept in its pack; ``packs`` caches open pack files for the caller."""
+        pack_id, offset, stored_size, _ = location
+        pack = packs.get(pack_id)
+        if pack is None:
+            pack = packs[pack_id] = open(self._pack_path(pack_id), 'rb')
+        pack.seek(offset)
+        return _read_exact(pack, stored_size)
+
+    def read_chunk(self, digest: bytes, location: Tuple[int, int, int, int], packs: Dict[int, BinaryIO]) -> bytes:
+        data = self.read_stored(location, packs)
+        if location[3]:
+            data = zstandard.ZstdDecompressor().decompress(data)
+        return data
+
+    # ------------------------------------------------------------------
+    # Reference counting
+    # ------------------------------------------------------------------
+    def _claim(self, counts: Counter) -> Set[bytes]:
+        """Add references to stored chunks; returns the hashes that are not stored. Caller holds the write lock."""
+        missing = set()
+        for digest, count in counts.items():
+            cursor = self._writer.execute('UPDATE chunks SET refs = refs + ? WHERE hash = ?', (count, digest))
+            if not cursor.rowcount:
+                missing.add(digest)
+        return missing
+
+    def _release(self, counts: Counter) -> None:
+        """Caller holds the write lock; unreferenced chunks stay until their pack is compacted."""
+        self._writer.executemany('UPDATE chunks SET refs = refs - ? WHERE hash = ?',
+                                 [(count, digest) for digest, count in counts.items()])
+
+    def _add(self, chunks: List[Tuple[bytes, int, Optional[bytes], bool]], counts: Counter) -> None:
+        """
+        Reference ``counts`` chunks, storing those not present from ``chunks``.
+
+        Args:
+            chunks: (hash, size, stored bytes, compressed) for every hash in ``counts``
+            counts: References to add per hash
+        """
+        with self._write_lock:
+            try:
+                missing = self._claim(counts)
+                records = [chunk for chunk in chunks if chunk[0] in missing]
+                if len(records) != len(missing) or any(chunk[2] is None for chunk in records):
+                    raise ValueError('Chunk data is missing')
+                rows = self._append(records)
+                self._writer.executemany(
+                    'INSERT INTO chunks (hash, pack, offset, stored_size, size, compressed, refs) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [row + (counts[row[0]],) for row in rows])
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+        self.stats['chunks_written'] += len(rows)
+        self.stats['chunks_deduplicated'] += sum(counts.values()) - len(rows)
+        self.stats['bytes_written'] += sum(row[3] for row in rows)
+
+    def _commit(self, path: str, recipe: List[Tuple[bytes, int]], mtime: Optional[float]) -> Dict[str, Any]:
+        """Point ``path`` at ``recipe`` (whose chunks are referenced already), releasing its previous version."""
+        size = sum(size for _, size in recipe)
+        with self._write_lock:
+            row = self._writer.execute('SELECT recipe FROM files WHERE path = ?', (path,)).fetchone()
+            if row:
+                self._release(Counter(digest for digest, _ in _recipe(row[0])))
+            self._writer.execute(
+                'INSERT OR REPLACE INTO files (path, size, mtime, recipe) VALUES (?, ?, ?, ?)',
+                (path, size, mtime or time.time(), b''.join(RECIPE_ENTRY.pack(*entry) for entry in recipe)))
+            self._writer.commit()
+        return {'path': path, 'size': size, 'chunks': len(recipe), 'unique_chunks': len({d for d, _ in recipe})}
+
+    def _undo(self, counts: Counter) -> None:
+        with self._write_lock:
+            self._release(counts)
+            self._writer.commit()
+
+    # ------------------------------------------------------------------
+    # Files
+    # ------------------------------------------------------------------
+    def put(self, path: str, stream: BinaryIO, mtime: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Store everything read from ``stream`` as ``path``, replacing an earlier version.
+
+        Returns:
+            path, size, chunks and unique_chunks of the stored file
+        """
+        path = self.normalize(path)
+        compressor = zstandard.ZstdCompressor(level=3) if self.compress else None
+        recipe: List[Tuple[bytes, int]] = []
+        referenced: Counter = Counter()
+        batch: List[bytes] = []
+        batch_bytes = 0
+
+        def flush():
+            digests = [hashlib.sha256(chunk).digest() for chunk in batch]
+            counts = Counter(digests)
+            unique = dict(zip(digests, batch))
+            known = self.locate(unique)
+            # Only chunks the store lacks are compressed
+            chunks = [(digest, len(chunk), *(self._encode(chunk, compressor) if digest not in known else (None, False)))
+                      for digest, chunk in unique.items()]
+            try:
+                self._add(chunks, counts)
+            except ValueError:
+                # A compaction dropped a chunk between locate() and _add(); store every chunk's data this time
+                self._add([(digest, len(chunk), *self._encode(chunk, compressor))
+                           for digest, chunk in unique.items()], counts)
+            referenced.update(counts)
+            recipe.extend((digest, len(chunk)) for digest, chunk in zip(digests, batch))
+
+        try:
+            for chunk in self.chunker.chunks(stream):
+                batch.append(chunk)
+                batch_bytes += len(chunk)
+                if batch_bytes >= BATCH_BYTES:
+                    flush()
+                    batch, batch_bytes = [], 0
+            if batch:
+                flush()
+            return self._commit(path, recipe, mtime)
+        except BaseException:
+            self._undo(referenced)
+            raise
+
+    def stat(self, path: str) -> Optional[Dict[str, Any]]:
+        row = self._reader().execute('SELECT size, mtime, recipe FROM files WHERE path = ?',
+                                     (self.normalize(path),)).fetchone()
+        if row is None:
+            return None
+        return {'path': self.normalize(path), 'size': row[0], 'mtime': row[1], 'recipe': _recipe(row[2]),
+                'etag': hashlib.sha256(row[2]).hexdigest()[:32]}
+
+    def open(self, path: str) -> Optional[ChunkReader]:
+        """Streaming reader of a stored file, or None; the caller closes it."""
+        info = self.stat(path)
+        return ChunkReader(self, info['recipe']) if info else None
+
+    def remove(self, path: str) -> bool:
+        path = self.normalize(path)
+        with self._write_lock:
+            row = self._writer.execute('SELECT recipe FROM files WHERE path = ?', (path,)).fetchone()
+            if row is None:
+                return False
+            self._release(Counter(digest for digest, _ in _recipe(row[0])))
+            self._writer.execute('DELETE FROM files WHERE path = ?', (path,))
+            self._writer.commit()
+        return True
+
+    def list(self, prefix: str = '') -> List[Dict[str, Any]]:
+        prefix = prefix.strip('/')
+        rows = self._reader().execute(
+            "SELECT path, size, mtime, length(recipe) FROM files WHERE path >= ? AND path < ? ORDER BY path",
+            (f"{prefix}/", f"{prefix}0") if prefix else ('', '\U0010ffff'))
+        return [{'path': path, 'size': size, 'mtime': mtime, 'chunks': length // RECIPE_ENTRY.size}
+                for path, size, mtime, length in rows]
+
+    # ------------------------------------------------------------------
+    # Peer transfers
+    # ------------------------------------------------------------------
+    def iter_records(self, digests: List[bytes], compressed: bool = True) -> Iterator[bytes]:
+        """
+        Wire records (header and stored bytes) of the requested chunks that are stored, in pack order.
+
+        Args:
+            compressed: The receiver reads zstd; otherwise compressed chunks are sent decompressed
+        """
+        locations = self.locate(digests)
+        packs: Dict[int, BinaryIO] = {}
+        try:
+            for digest, location in sorted(locations.items(), key=lambda item: item[1][:2]):
+                if location[3] and not compressed:
+                    data, flag = self.read_chunk(digest, location, packs), 0
+                else:
+                    data, flag = self.read_stored(location, packs), location[3]
+                yield RECORD_HEADER.pack(digest, flag, len(data)) + data
+        finally:
+            for pack in packs.values():
+                pack.close()
+
+    def _fetch(self, url: str, digests: List[bytes], sizes: Dict[bytes, int]):
+        """Chunks of a peer as (hash, size, stored bytes, compressed), each verified against its hash."""
+        request = {'chunks': [digest.hex() for digest in digests], 'compressed': HAS_ZSTD}
+        body, headers = wire.encode_request(request, f"{url}{CHUNKS_PATH}")
+        response = self.session.post(f"{url}{CHUNKS_PATH}", data=body, headers=headers, stream=True,
+                                     timeout=(5, self.timeout))
+        with response:
+            response.raise_for_status()
+            records = []
+            stream = response.raw
+            while True:
+                header = stream.read(RECORD_HEADER.size)
+                if not header:
+                    break
+                if len(header) < RECORD_HEADER.size:
+                    header += _read_exact(stream, RECORD_HEADER.size - len(header))
+                digest, compressed, stored_size = RECORD_HEADER.unpack(header)
+                payload = _read_exact(stream, stored_size)
+                data = zstandard.ZstdDecompressor().decompress(payload) if compressed else payload
+                if digest not in sizes or hashlib.sha256(data).digest() != digest:
+                    raise ValueError(f"Peer sent a corrupt chunk {digest.hex()}")
+                if compressed and not self.compress:
+                    payload, compressed = data, False
+                records.append((digest, len(data), payload, bool(compressed)))
+                self.stats['bytes_fetched'] += RECORD_HEADER.size + stored_size
+        if len(records) != len(digests):
+            raise ValueError('Peer is missing chunks of the file')
+        self.stats['chunks_fetched'] += len(records)
+        return records
+
+    def pull(self, url: str, path: str, dest: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Copy a file from the chunk store of the peer at ``url``, transferring only the chunks missing here.
+
+        Args:
+            url: Base URL of the peer
+            path: Path of the file in the peer's store
+            dest: Path to store it under (default: the same path)
+
+        Raises:
+            FileNotFoundError: The peer does not have the file
+            ValueError: The peer's answer is invalid
+            requests.RequestException: The peer cannot be reached
+        """
+        path = self.normalize(path)
+        dest = self.normalize(dest or path)
+        response = self.session.get(f"{url}{RECIPE_PATH}{quote(path)}", headers=wire.client_headers(),
+                                    timeout=self.timeout)
+        if response.status_code == 404:
+            raise FileNotFoundError(path)
+        response.raise_for_status()
+        data = wire.decode_response(response)
+        try:
+            recipe = [(bytes.fromhex(digest), int(size)) for digest, size in data['chunks']]
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid recipe: {e}") from e
+        if any(len(digest) != HASH_SIZE for digest, _ in recipe):
+            raise ValueError('Invalid recipe: bad chunk hash')
+
+        counts = Counter(digest for digest, _ in recipe)
+        sizes = dict(recipe)
+        referenced: Counter = Counter()
+        fetched_bytes = self.stats['bytes_fetched']
+        try:
+            with self._write_lock:
+                missing = self._claim(counts)
+                self._writer.commit()
+            referenced.update({digest: count for digest, count in counts.items() if digest not in missing})
+            missing = [digest for digest in counts if digest in missing]
+            for i in range(0, len(missing), FETCH_BATCH):
+                batch = missing[i:i + FETCH_BATCH]
+                records = self._fetch(url, batch, sizes)
+                batch_counts = Counter({digest: counts[digest] for digest in batch})
+                self._add(records, batch_counts)
+                referenced.update(batch_counts)
+            result = self._commit(dest, recipe, data.get('mtime'))
+        except BaseException:
+            self._undo(referenced)
+            raise
+        result.update({'source': path, 'missing_chunks': len(missing),
+                       'transferred': self.stats['bytes_fetched'] - fetched_bytes})
+        return result
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+    def compact(self, min_garbage: float = 0.25) -> Dict[str, Any]:
+        """
+        Rewrite packs in which at least ``min_garbage`` of the bytes belong to unreferenced chunks.
+
+        Live chunks are appended to the current pack and the old pack is
+        deleted. Blocks writers while it runs.
+        """
+        result = {'packs_rewritten': 0, 'bytes_freed': 0, 'chunks_dropped': 0}
+        with self._write_lock:
+            live = dict(self._writer.execute(
+                'SELECT pack, SUM(stored_size + ?) FROM chunks WHERE refs > 0 GROUP BY pack', (RECORD_HEADER.size,)))
+            for pack_id in self._pack_ids():
+                if pack_id == self._pack_id:
+                    continue
+                pack_path = self._pack_path(pack_id)
+                size = os.path.getsize(pack_path)
+                if not size or (size - live.get(pack_id, 0)) / size < min_garbage:
+                    continue
+                rows = self._writer.execute(
+                    'SELECT hash, size, offset, stored_size, compressed FROM chunks '
+                    'WHERE pack = ? AND refs > 0 ORDER BY offset', (pack_id,)).fetchall()
+                packs: Dict[int, BinaryIO] = {}
+                try:
+                    records = [(digest, chunk_size,
+                                self.read_stored((pack_id, offset, stored_size, compressed), packs), bool(compressed))
+                               for digest, chunk_size, offset, stored_size, compressed in rows]
+                finally:
+                    for pack in packs.values():
+                        pack.close()
+                moved = self._append(records)
+                self._writer.executemany('UPDATE chunks SET pack = ?, offset = ? WHERE hash = ?',
+                                         [(row[1], row[2], row[0]) for row in moved])
+                dropped = self._writer.execute('DELETE FROM chunks WHERE pack = ? AND refs <= 0', (pack_id,))
+                self._writer.commit()
+                os.unlink(pack_path)
+                result['packs_rewritten'] += 1
+                result['chunks_dropped'] += dropped.rowcount
+                result['bytes_freed'] += size - sum(RECORD_HEADER.size + len(r[2]) for r in records)
+        self.stats['compactions'] += 1
+        self.logger.info(f"Chunk store compacted: {result}")
+        return result
+
+    def disk_usage(self) -> int:
+        """Bytes taken by the packs."""
+        return sum(os.path.getsize(self._pack_path(pack_id)) for pack_id in self._pack_ids())
+
+    def get_stats(self) -> Dict[str, Any]:
+        conn = self._reader()
+        files, logical = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files').fetchone()
+        chunks, unique, stored, unreferenced = conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0), '
+            'COALESCE(SUM(refs <= 0), 0) FROM chunks').fetchone()
+        disk = self.disk_usage()
+        return {
+            'files': files,
+            'logical_bytes': logical,
+            'chunks': chunks,
+            'unreferenced_chunks': unreferenced,
+            'unique_bytes': unique,
+            'stored_bytes': stored,
+            'disk_bytes': disk,
+            'packs': len(self._pack_ids()),
+            'dedup_ratio': round(logical / unique, 2) if unique else None,
+            'savings': round(1 - disk / logical, 4) if logical else None,
+            'avg_chunk_size': self.chunker.avg_size,
+            'compression': self.compress,
+            **self.stats
+        }
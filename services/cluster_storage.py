@@ -0,0 +1,404 @@
+import os
+import math
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from functools import cached_property
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+from utils.lazy_import import lazy_import
+from utils import wire, peer_auth
+from services.hash_ring import HashRing
+
+requests = lazy_import('requests')
+
+INFO_PATH = '/api/peer/cluster/info'
+STORE_PATH = '/api/peer/cluster/store/'
+FILE_PATH = '/api/peer/file/'
+READ_SIZE = 64 * 1024
+# A node that missed this many refreshes in a row is left out of the ring
+MISSED_REFRESHES = 2
+
+
+class _Node:
+    """A cluster member as last reported by itself."""
+
+    def __init__(self, node_id: str, url: Optional[str]):
+        self.node_id = node_id
+        self.url = url  # None for this node
+        self.free = 0
+        self.rtt: Optional[float] = None
+        self.seen = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'node_id': self.node_id,
+            'url': self.url,
+            'local': self.url is None,
+            'free': self.free,
+            'rtt_ms': round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            'seen': round(time.monotonic() - self.seen, 1)
+        }
+
+
+class ClusterStorage:
+    """
+    Files spread over the cluster by consistent hashing.
+
+    Every node reports its free quota; a node gets one point on the hash
+    ring per ``vnode_size`` bytes free, so fuller nodes receive fewer new
+    files. A file is stored on the first ``replication`` distinct nodes
+    clockwise from the hash of its path. Reads go to a local copy if there
+    is one, otherwise to the live replica with the lowest round-trip time,
+    then to any other live node (a copy may not have moved yet after a
+    membership change). Rebalancing moves only the files whose replica set
+    changed, roughly 1/N of them when a node joins.
+
+    Cluster files live in ``folder`` inside the shared folder; keys are
+    paths relative to it.
+    """
+
+    def __init__(self, base_path: str, folder: str, get_peers: Callable[[], Iterable[Tuple[str, str]]],
+                 get_free: Callable[[], int], replication: int = 2, vnode_size: int = 64 * 1024 * 1024,
+                 max_vnodes: int = 1024, refresh_interval: float = 10.0, timeout: float = 30.0):
+        """
+        Initialize the ClusterStorage.
+
+        Args:
+            base_path: Shared root
+            folder: Folder inside the shared root holding the cluster files
+            get_peers: Returns (device id, base URL) of every peer to consider
+            get_free: Free quota of this node in bytes
+            replication: Copies kept of every file
+            vnode_size: Free bytes per ring point
+            max_vnodes: Ring points of one node at most
+            refresh_interval: Seconds between quota/latency refreshes of the peers
+            timeout: Timeout of transfers between nodes in seconds
+        """
+        self.base_path = os.path.abspath(base_path)
+        self.root = os.path.join(self.base_path, folder)
+        self.folder = folder
+        self.get_peers = get_peers
+        self.get_free = get_free
+        self.replication = replication
+        self.vnode_size = vnode_size
+        self.max_vnodes = max_vnodes
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__)
+
+        self.node_id: Optional[str] = None
+        self._nodes: Dict[str, _Node] = {}
+        self._ring = HashRing({})
+        self._lock = threading.Lock()
+        self._running = False
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._rebalance: Optional[Dict[str, Any]] = None
+        self.stats = {'stored': 0, 'replicas_sent': 0, 'replicas_received': 0, 'local_reads': 0,
+                      'remote_reads': 0, 'fallback_reads': 0, 'ring_changes': 0}
+
+    @cached_property
+    def session(self):
+        """Pooled HTTP session, created with the first refresh."""
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.headers.update(peer_auth.headers())
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def start(self, node_id: str) -> None:
+        """Join the ring as ``node_id`` (the id every peer reports for this node)."""
+        if self._running:
+            return
+        self.node_id = node_id
+        os.makedirs(self.root, exist_ok=True)
+        self._running = True
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name="ClusterStorage", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+        self._wakeup.set()
+
+    # ------------------------------------------------------------------
+    # Membership and ring
+    # ------------------------------------------------------------------
+    def vnodes(self, free: int) -> int:
+        return max(1, min(self.max_vnodes, math.ceil(free / self.vnode_size))) if free > 0 else 0
+
+    def info(self) -> Dict[str, Any]:
+        """What this node reports to its peers."""
+        return {'node_id': self.node_id, 'free': self.get_free(), 'replication': self.replication}
+
+    def _probe(self, url: str) -> Optional[Dict[str, Any]]:
+        started = time.monotonic()
+        try:
+            response = self.session.get(f"{url}{INFO_PATH}", headers=wire.client_headers(), timeout=5)
+            response.raise_for_status()
+            data = wire.decode_response(response)
+        except (requests.RequestException, ValueError) as e:
+            self.logger.debug(f"Cluster info from {url} failed: {e}")
+            return None
+        if not isinstance(data, dict) or not data.get('node_id'):
+            return None
+        return {**data, 'rtt': time.monotonic() - started}
+
+    def refresh(self) -> None:
+        """Ask every peer for its id and free quota, then rebuild the ring if the weights changed."""
+        now = time.monotonic()
+        local = _Node(self.node_id, None)
+        local.free = self.get_free()
+        local.rtt = 0.0
+        local.seen = now
+        answers = {self.node_id: local}
+        for _, url in self.get_peers():
+            data = self._probe(url)
+            if data is None or data['node_id'] == self.node_id:
+                continue
+            node = _Node(data['node_id'], url)
+            node.free = int(data.get('free') or 0)
+            node.rtt = data['rtt']
+            node.seen = now
+            answers[node.node_id] = node
+
+        with self._lock:
+            # Keep nodes that missed only a refresh or two, so one timeout does not reshuffle the ring
+            cutoff = now - MISSED_REFRESHES * self.refresh_interval - 1
+            for node_id, node in self._nodes.items():
+                if node_id not in answers and node.seen >= cutoff:
+                    answers[node_id] = node
+            self._nodes = answers
+            weights = {node_id: self.vnodes(node.free) for node_id, node in answers.items()}
+            if weights != self._ring.weights:
+                self._ring = HashRing(weights)
+                self.stats['ring_changes'] += 1
+                self.logger.info(f"Cluster ring: {', '.join(f'{n} ({w})' for n, w in sorted(weights.items()))}")
+
+    def _run(self) -> None:
+        while self._running:
+            if self._wakeup.wait(self.refresh_interval):
+                break
+            try:
+                self.refresh()
+            except Exception as e:
+                self.logger.error(f"Cluster refresh failed: {e}", exc_info=True)
+
+    def replicas(self, key: str) -> List[str]:
+        """Node ids that should hold ``key``, primary first."""
+        return self._ring.nodes_for(self.normalize(key), self.replication)
+
+    # ------------------------------------------------------------------
+    # Local files
+    # ------------------------------------------------------------------
+    @staticmethod
+    def normalize(key: str) -> str:
+        return key.replace('\\', '/').strip('/')
+
+    def resolve(self, key: str) -> str:
+        """Absolute path of a cluster file; raises ValueError if it escapes the cluster folder."""
+        key = self.normalize(key)
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not key or not path.startswith(self.root + os.sep):
+            raise ValueError('Path escapes the cluster folder')
+        return path
+
+    def shared_path(self, key: str) -> str:
+        """Path of a cluster file relative to the shared root, as other peer endpoints expect it."""
+        return f"{self.folder}/{self.normalize(key)}"
+
+    def store_local(self, key: str, stream: BinaryIO) -> int:
+        """Write a replica from ``stream``; replaced atomically. Returns the bytes written."""
+        path = self.resolve(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.cluster-', dir=os.path.dirname(path))
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(READ_SIZE)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.stats['replicas_received'] += 1
+        return size
+
+    # ------------------------------------------------------------------
+    # Placement
+    # ------------------------------------------------------------------
+    def _send(self, node: _Node, key: str, source: str) -> None:
+        with open(source, 'rb') as f:
+            response = self.session.post(f"{node.url}{STORE_PATH}{quote(self.normalize(key))}", data=f,
+                                         headers={'Content-Type': 'application/octet-stream'},
+                                         timeout=self.timeout)
+        response.raise_for_status()
+        self.stats['replicas_sent'] += 1
+
+    def store(self, key: str, source: str) -> Dict[str, Any]:
+        """
+        Place a file on its replicas.
+
+        Args:
+            key: Path of the file inside the cluster folder
+            source: Local file with the content; left in place
+
+        The local replica is written only if this node's free quota holds
+        it; otherwise it is reported as failed, like an unreachable peer.
+
+        Returns:
+            key, replicas (node, ok, error) and stored (copies written)
+
+        Raises:
+            ValueError: Bad key, or no node is available
+        """
+        key = self.normalize(key)
+        self.resolve(key)
+        with self._lock:
+            targets = [self._nodes[node_id] for node_id in self._ring.nodes_for(key, self.replication)]
+        if not targets:
+            raise ValueError('No cluster node is available')
+
+        results = []
+        for node in targets:
+            try:
+                if node.url is None:
+                    if os.path.getsize(source) > self.get_free():
+                        self.logger.warning(f"Not storing {key} locally: not enough disk space")
+                        results.append({'node': node.node_id, 'ok': False, 'error': 'Not enough disk space'})
+                        continue
+                    with open(source, 'rb') as f:
+                        self.store_local(key, f)
+                else:
+                    self._send(node, key, source)
+                results.append({'node': node.node_id, 'ok': True})
+            except (OSError, requests.RequestException) as e:
+                self.logger.warning(f"Storing {key} on {node.node_id} failed: {e}")
+                results.append({'node': node.node_id, 'ok': False, 'error': str(e)})
+        stored = sum(1 for result in results if result['ok'])
+        if stored:
+            self.stats['stored'] += 1
+        return {'key': key, 'replicas': results, 'stored': stored}
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def local_copy(self, key: str) -> Optional[str]:
+        path = self.resolve(key)
+        return path if os.path.isfile(path) else None
+
+    def candidates(self, key: str) -> List[_Node]:
+        """Remote nodes to read ``key`` from: live replicas by round-trip time, then every other live node."""
+        key = self.normalize(key)
+        with self._lock:
+            owners = set(self._ring.nodes_for(key, self.replication))
+            remote = [node for node in self._nodes.values() if node.url is not None]
+        by_rtt = lambda node: node.rtt if node.rtt is not None else float('inf')
+        return sorted((n for n in remote if n.node_id in owners), key=by_rtt) + \
+            sorted((n for n in remote if n.node_id not in owners), key=by_rtt)
+
+    def open_remote(self, key: str, headers: Optional[Dict[str, str]] = None):
+        """
+        Streaming response for ``key`` from the closest node that has it, or None.
+
+        The caller must close the response.
+        """
+        owners = set(self.replicas(key))
+        for node in self.candidates(key):
+            try:
+                response = self.session.get(f"{node.url}{FILE_PATH}{quote(self.shared_path(key))}",
+                                            headers=headers, stream=True, timeout=(5, self.timeout))
+            except requests.RequestException as e:
+                self.logger.info(f"Reading {key} from {node.node_id} failed: {e}")
+                continue
+            if response.status_code in (200, 206):
+                self.stats['remote_reads' if node.node_id in owners else 'fallback_reads'] += 1
+                return response
+            response.close()
+        return None
+
+    # ------------------------------------------------------------------
+    # Rebalancing
+    # ------------------------------------------------------------------
+    def _has(self, node: _Node, key: str) -> bool:
+        response = self.session.head(f"{node.url}{FILE_PATH}{quote(self.shared_path(key))}", timeout=self.timeout)
+        return response.status_code == 200
+
+    def rebalance(self) -> Dict[str, Any]:
+        """
+        Bring the local cluster files in line with the current ring.
+
+        A file is copied to each owner that lacks it; the local copy is
+        deleted only once every owner has it and this node is no longer one
+        of them. Files whose replica set is unchanged are not touched.
+        """
+        state = {'started': time.time(), 'finished': None, 'files': 0, 'unchanged': 0,
+                 'copied': 0, 'removed': 0, 'errors': 0}
+        self._rebalance = state
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith('.cluster-'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, '/')
+                state['files'] += 1
+                with self._lock:
+                    owners = [self._nodes[node_id] for node_id in self._ring.nodes_for(key, self.replication)]
+                remote_owners = [node for node in owners if node.url is not None]
+                if len(remote_owners) == len(owners) - 1:
+                    # Still ours; remote copies are the other owners' business when they rebalance
+                    state['unchanged'] += 1
+                    continue
+                everywhere = True
+                for node in remote_owners:
+                    try:
+                        if not self._has(node, key):
+                            self._send(node, key, path)
+                            state['copied'] += 1
+                    except (OSError, requests.RequestException) as e:
+                        everywhere = False
+                        state['errors'] += 1
+                        self.logger.warning(f"Moving {key} to {node.node_id} failed: {e}")
+                if everywhere and remote_owners:
+                    os.unlink(path)
+                    state['removed'] += 1
+        state['finished'] = time.time()
+        return state
+
+    def start_rebalance(self) -> bool:
+        """Rebalance in the background; False if one is already running."""
+        if self._rebalance is not None and self._rebalance['finished'] is None:
+            return False
+        self._rebalance = {'started': time.time(), 'finished': None}
+        threading.Thread(target=self.rebalance, name="ClusterRebalance", daemon=True).start()
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            nodes = [node.to_dict() for node in self._nodes.values()]
+            shares = self._ring.shares()
+            weights = dict(self._ring.weights)
+        for node in nodes:
+            node['vnodes'] = weights.get(node['node_id'], 0)
+            node['share'] = round(shares.get(node['node_id'], 0.0), 4)
+        return {
+            'node_id': self.node_id,
+            'running': self._running,
+            'replication': self.replication,
+            'nodes': sorted(nodes, key=lambda node: node['node_id']),
+            'rebalance': self._rebalance,
+            **self.stats
+        }
@@ -0,0 +1,502 @@
+import os
+import re
+import html
+import time
+import queue
+import sqlite3
+import hashlib
+import logging
+import zipfile
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import configure_rarfile
+from utils.lazy_import import lazy_import
+
+try:
+    from pypdf import PdfReader
+    HAS_PYPDF = True
+except ImportError:
+    HAS_PYPDF = False
+
+rarfile = lazy_import('rarfile', on_load=configure_rarfile)
+
+TEXT_EXTENSIONS = {
+    'txt', 'md', 'log', 'csv', 'tsv', 'json', 'xml', 'html', 'htm', 'css', 'js', 'ts', 'py', 'java',
+    'c', 'cpp', 'h', 'hpp', 'cs', 'go', 'rs', 'rb', 'php', 'sh', 'bat', 'ps1', 'ini', 'conf', 'cfg',
+    'yaml', 'yml', 'toml', 'sql', 'tex', 'rst', 'srt'
+}
+ARCHIVE_EXTENSIONS = {'zip', 'rar'}
+
+# Chunk size used when hashing and reading files
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Markers placed around matches by FTS5 snippet(); replaced after HTML escaping
+_MATCH_START = '\x02'
+_MATCH_END = '\x03'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    content_hash TEXT NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    member TEXT NOT NULL DEFAULT '',
+    content_hash TEXT NOT NULL,
+    UNIQUE(path, member)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS content_fts USING fts5(
+    body, tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+
+def _extension(name: str) -> str:
+    return os.path.splitext(name)[1][1:].lower()
+
+
+def _decode_text(data: bytes) -> str:
+    """Decode text content, accepting the encodings commonly found on Turkish systems."""
+    for encoding in ('utf-8', 'cp1254'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='ignore')
+
+
+class IOThrottle:
+    """Token bucket limiting how many bytes per second the indexer reads from disk."""
+
+    def __init__(self, bytes_per_second: int):
+        self.rate = bytes_per_second
+        self._allowance = float(bytes_per_second)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes: int) -> None:
+        """Account for ``nbytes`` read, sleeping when the budget is exhausted."""
+        if self.rate <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= nbytes
+            delay = -self._allowance / self.rate if self._allowance < 0 else 0
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ContentIndex:
+    """Incremental full-text index over text files, PDFs and text members of ZIP/RAR archives."""
+
+    def __init__(self, base_path: str, db_path: str, workers: int = 2,
+                 max_file_bytes: int = 20 * 1024 * 1024, io_limit: int = 20 * 1024 * 1024,
+                 enabled: bool = True):
+        """
+        Initialize the ContentIndex.
+
+        Args:
+            base_path: Root directory that is indexed
+            db_path: Location of the SQLite database
+            workers: Number of background indexing threads
+            max_file_bytes: Files and archive members larger than this are skipped
+            io_limit: Read budget for all workers together in bytes per second (0 = unlimited)
+            enabled: When False, nothing is queued for indexing
+        """
+        self.base_path = os.path.abspath(base_path)
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.enabled = enabled
+        self.max_file_bytes = max_file_bytes
+        self.throttle = IOThrottle(io_limit)
+        self.logger = logging.getLogger(__name__)
+
+        self._queue: 'queue.Queue[str]' = queue.Queue()
+        self._queued = set()
+        self._queued_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._threads: List[threading.Thread] = []
+        self._running = False
+        self.stats = {'indexed': 0, 'skipped': 0, 'failed': 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._writer = self._connect()
+        with self._write_lock, self._writer:
+            self._writer.executescript(SCHEMA)
+
+        if enabled and not HAS_PYPDF:
+            self.logger.warning("pypdf is not installed, PDF text will not be indexed (pip install pypdf)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def relative_path(self, abs_path: str) -> Optional[str]:
+        rel_path = os.path.relpath(os.path.abspath(abs_path), self.base_path).replace('\\', '/')
+        if rel_path == '.' or rel_path == '..' or rel_path.startswith('../'):
+            return None
+        return rel_path
+
+    def is_indexable(self, file_path: str) -> bool:
+        """Check whether the file type is one the indexer extracts text from."""
+        ext = _extension(file_path)
+        return ext in TEXT_EXTENSIONS or ext in ARCHIVE_EXTENSIONS or (ext == 'pdf' and HAS_PYPDF)
+
+    # ------------------------------------------------------------------
+    # Worker pool
+    # ------------------------------------------------------------------
+    def start(self) -> None:
+        """Start the background indexing threads."""
+        if self._running or not self.enabled:
+            return
+        self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ContentIndexer-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Stop the indexing threads after their current file."""
+        self._running = False
+        for _ in self._threads:
+            self._queue.put(None)
+        self._threads = []
+
+    def schedule(self, abs_path: str) -> None:
+        """Queue a file for (re)indexing; repeated requests for a queued file are merged."""
+        if not self.enabled or not self.is_indexable(abs_path):
+            return
+        with self._queued_lock:
+            if abs_path in self._queued:
+                return
+            self._queued.add(abs_path)
+        self._queue.put(abs_path)
+
+    def schedule_tree(self, abs_dir: Optional[str] = None) -> None:
+        """Queue every indexable file below a directory (the whole share by default)."""
+        for root, _, files in os.walk(abs_dir or self.base_path):
+            for name in files:
+                self.schedule(os.path.join(root, name))
+
+    def start_background_scan(self) -> None:
+        """Walk the share in a background thread; unchanged files are skipped cheaply."""
+        threading.Thread(target=self._catch_up, name="ContentIndexScan", daemon=True).start()
+
+    def _catch_up(self) -> None:
+        removed = self.prune_missing()
+        if removed:
+            self.logger.info(f"Dropped {removed} files deleted since the last run from the content index")
+        self.schedule_tree()
+
+    def prune_missing(self) -> int:
+        """Drop indexed files that no longer exist (deleted while nothing was watching). Returns how many."""
+        paths = [row[0] for row in self._reader().execute('SELECT path FROM files')]
+        removed = 0
+        for rel_path in paths:
+            abs_path = os.path.join(self.base_path, rel_path)
+            if not os.path.isfile(abs_path):
+                self.remove(abs_path)
+                removed += 1
+        return removed
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _worker(self) -> None:
+        while self._running:
+            abs_path = self._queue.get()
+            if abs_path is None:
+                break
+            with self._queued_lock:
+                self._queued.discard(abs_path)
+            try:
+                self.index_file(abs_path)
+            except Exception as e:
+                self.stats['failed'] += 1
+                self.logger.error(f"Content indexing failed for {abs_path}: {e}", exc_info=True)
+
+    # ------------------------------------------------------------------
+    # Indexing
+    # ------------------------------------------------------------------
+    def index_file(self, abs_path: str) -> bool:
+        """
+        Index a single file.
+
+        Unchanged files are skipped twice over: first by size and mtime, then
+        by a content hash, so touching a file without changing it does not
+        re-extract anything.
+
+        Args:
+            abs_path: Absolute path to the file
+
+        Returns:
+            True if the file's documents were (re)written
+        """
+        rel_path = self.relative_path(abs_path)
+        if rel_path is None:
+            return False
+
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            self.remove(abs_path)
+            return False
+
+        if st.st_size > self.max_file_bytes and _extension(abs_path) not in ARCHIVE_EXTENSIONS:
+            return False
+
+        known = self._reader().execute(
+            'SELECT size, mtime, content_hash FROM files WHERE path = ?', (rel_path,)
+        ).fetchone()
+        if known and known['size'] == st.st_size and known['mtime'] == st.st_mtime:
+            self.stats['skipped'] += 1
+            return False
+
+        content_hash = self._hash_file(abs_path)
+        if content_hash is None:
+            return False
+        if known and known['content_hash'] == content_hash:
+            self._record_file(rel_path, st, content_hash)
+            self.stats['skipped'] += 1
+            return False
+
+        documents = list(self._extract(abs_path))
+        self._store(rel_path, st, content_hash, documents)
+        self.stats['indexed'] += 1
+        return True
+
+    def _hash_file(self, abs_path: str) -> Optional[str]:
+        digest = hashlib.sha1()
+        try:
+            with open(abs_path, 'rb') as f:
+                while True:
+                    chunk = f.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.throttle.consume(len(chunk))
+                    digest.update(chunk)
+        except OSError as e:
+            self.logger.warning(f"Could not read {abs_path}: {e}")
+            return None
+        return digest.hexdigest()
+
+    def _extract(self, abs_path: str) -> Iterable[Tuple[str, str]]:
+        """Yield (member, text) pairs; member is '' for the file itself."""
+        ext = _extension(abs_path)
+        if ext in ARCHIVE_EXTENSIONS:
+            yield from self._extract_archive(abs_path)
+            return
+
+        with open(abs_path, 'rb') as f:
+            data = f.read(self.max_file_bytes)
+        self.throttle.consume(len(data))
+        text = self._extract_bytes(abs_path, data)
+        if text:
+            yield '', text
+
+    def _extract_bytes(self, name: str, data: bytes) -> str:
+        ext = _extension(name)
+        if ext == 'pdf':
+            return self._extract_pdf(data)
+        return _decode_text(data)
+
+    @staticmethod
+    def _extract_pdf(data: bytes) -> str:
+        if not HAS_PYPDF:
+            return ''
+        import io
+        reader = PdfReader(io.BytesIO(data))
+        pages = []
+        for page in reader.pages:
+            try:
+                pages.append(page.extract_text() or '')
+            except Exception:
+                continue
+        return '\n'.join(pages)
+
+    def _extract_archive(self, abs_path: str) -> Iterable[Tuple[str, str]]:
+        """Extract text from the text/PDF members of a ZIP or RAR archive, one member at a time."""
+        try:
+            if abs_path.lower().endswith('.rar'):
+                archive = rarfile.RarFile(abs_path)
+            else:
+                archive = zipfile.ZipFile(abs_path)
+        except Exception as e:
+            self.logger.warning(f"Could not open archive {abs_path}: {e}")
+            return
+
+        with archive:
+            for info in archive.infolist():
+                name = info.filename
+                if name.endswith('/') or info.file_size > self.max_file_bytes:
+                    continue
+                ext = _extension(name)
+                if ext not in TEXT_EXTENSIONS and not (ext == 'pdf' and HAS_PYPDF):
+                    continue
+                try:
+                    with archive.open(info) as member:
+                        data = member.read()
+                    self.throttle.consume(len(data))
+                    text = self._extract_bytes(name, data)
+                except Exception as e:
+                    self.logger.warning(f"Could not read {name} in {abs_path}: {e}")
+                    continue
+                if text:
+                    yield name.replace('\\', '/'), text
+
+    def _record_file(self, rel_path: str, st: os.stat_result, content_hash: str) -> None:
+        with self._write_lock, self._writer:
+            self._writer.execute(
+                """INSERT INTO files (path, size, mtime, content_hash, indexed_at) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime,
+                       content_hash = excluded.content_hash, indexed_at = excluded.indexed_at""",
+                (rel_path, st.st_size, st.st_mtime, content_hash, time.time())
+            )
+
+    def _store(self, rel_path: str, st: os.stat_result, content_hash: str,
+               documents: List[Tuple[str, str]]) -> None:
+        """Replace the documents of a file, leaving members whose text hash is unchanged untouched."""
+        with self._write_lock, self._writer:
+            existing = {
+                row['member']: (row['id'], row['content_hash'])
+                for row in self._writer.execute(
+                    'SELECT id, member, content_hash FROM documents WHERE path = ?', (rel_path,)
+                )
+            }
+
+            for member, text in documents:
+                text_hash = hashlib.sha1(text.encode('utf-8', errors='ignore')).hexdigest()
+                current = existing.pop(member, None)
+                if current and current[1] == text_hash:
+                    continue
+                if current:
+                    self._writer.execute('DELETE FROM content_fts WHERE rowid = ?', (current[0],))
+                    self._writer.execute('UPDATE documents SET content_hash = ? WHERE id = ?',
+                                         (text_hash, current[0]))
+                    doc_id = current[0]
+                else:
+                    doc_id = self._writer.execute(
+                        'INSERT INTO documents (path, member, content_hash) VALUES (?, ?, ?)',
+                        (rel_path, member, text_hash)
+                    ).lastrowid
+                self._writer.execute('INSERT INTO content_fts (rowid, body) VALUES (?, ?)', (doc_id, text))
+
+            # Members that disappeared from the file
+            for doc_id, _ in existing.values():
+                self._writer.execute('DELETE FROM content_fts WHERE rowid = ?', (doc_id,))
+                self._writer.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+
+            self._writer.execute(
+                """INSERT INTO files (path, size, mtime, content_hash, indexed_at) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime,
+                       content_hash = excluded.content_hash, indexed_at = excluded.indexed_at""",
+                (rel_path, st.st_size, st.st_mtime, content_hash, time.time())
+            )
+
+    def remove(self, abs_path: str) -> None:
+        """Drop a file, or every file below a directory, from the index."""
+        rel_path = self.relative_path(abs_path)
+        if rel_path is None:
+            return
+        low, high = f"{rel_path}/", f"{rel_path}0"
+        match = 'path = ? OR (path >= ? AND path < ?)'
+        params = (rel_path, low, high)
+        with self._write_lock, self._writer:
+            self._writer.execute(
+                f'DELETE FROM content_fts WHERE rowid IN (SELECT id FROM documents WHERE {match})', params
+            )
+            self._writer.execute(f'DELETE FROM documents WHERE {match}', params)
+            self._writer.execute(f'DELETE FROM files WHERE {match}', params)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _match_expression(query: str) -> str:
+        """Turn free text into an FTS5 expression: every word must match, ``word*`` is a prefix match."""
+        terms = []
+        for word in re.findall(r'[\w*]+', query, flags=re.UNICODE):
+            prefix = word.endswith('*')
+            word = word.strip('*')
+            if word:
+                terms.append(f'"{word}"' + ('*' if prefix else ''))
+        return ' AND '.join(terms)
+
+    def search(self, query: str, path: str = '', limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Full-text search with highlighted snippets.
+
+        Args:
+            query: Words to search for (all must match, ``word*`` for prefixes)
+            path: Restrict results to this directory (relative) and its subdirectories
+            limit: Maximum number of results
+            offset: Number of results to skip
+
+        Returns:
+            List of matches ordered by relevance; ``snippet`` is HTML-escaped
+            with matches wrapped in ``<mark>``
+        """
+        expression = self._match_expression(query)
+        if not expression:
+            return []
+
+        sql = f"""SELECT documents.path, documents.member,
+                         snippet(content_fts, 0, '{_MATCH_START}', '{_MATCH_END}', '…', 16) AS snippet,
+                         bm25(content_fts) AS score
+                  FROM content_fts JOIN documents ON documents.id = content_fts.rowid
+                  WHERE content_fts MATCH ?"""
+        params: List[Any] = [expression]
+        if path:
+            path = path.strip('/')
+            sql += ' AND documents.path >= ? AND documents.path < ?'
+            params.extend([f"{path}/", f"{path}0"])
+        sql += ' ORDER BY score LIMIT ? OFFSET ?'
+        params.extend([int(limit), int(offset)])
+
+        results = []
+        for row in self._reader().execute(sql, params):
+            snippet = html.escape(row['snippet'] or '')
+            snippet = snippet.replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+            results.append({
+                'path': row['path'],
+                'member': row['member'] or None,
+                'snippet': snippet,
+                'score': round(-row['score'], 4)
+            })
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Index size and worker state for the status endpoint."""
+        conn = self._reader()
+        return {
+            'files': conn.execute('SELECT COUNT(*) FROM files').fetchone()[0],
+            'documents': conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0],
+            'pending': self.pending(),
+            'pdf_support': HAS_PYPDF,
+            **self.stats
+        }
+
+    def close(self) -> None:
+        self.stop()
+        with self._write_lock:
+            self._writer.close()
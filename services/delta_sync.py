@@ -0,0 +1,472 @@
+import os
+import mmap
+import errno
+import math
+import zlib
+import struct
+import hashlib
+import logging
+import tempfile
+from functools import cached_property
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+from utils.lazy_import import lazy_import
+from utils import peer_auth
+
+requests = lazy_import('requests')
+
+# Wire formats (all integers big-endian):
+#   signature: 'DSS1' block_size:u32 file_size:u64 count:u32, then per block weak:u32 strong:16 bytes
+#   delta:     'DSD1' block_size:u32 new_size:u64, then operations
+#              'C' first_block:u32 count:u32   copy blocks of the receiver's file
+#              'L' length:u32 data              literal bytes
+#              'E' sha256:32 bytes              end, digest of the complete new file
+SIGNATURE_MAGIC = b'DSS1'
+DELTA_MAGIC = b'DSD1'
+OP_COPY = b'C'
+OP_LITERAL = b'L'
+OP_END = b'E'
+
+SIGNATURE_HEADER = struct.Struct('>4sIQI')
+SIGNATURE_ENTRY = struct.Struct('>I16s')
+DELTA_HEADER = struct.Struct('>4sIQ')
+COPY_ARGS = struct.Struct('>II')
+LENGTH = struct.Struct('>I')
+
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 128 * 1024
+# Literal runs are split so neither side buffers more than this
+LITERAL_CHUNK = 1024 * 1024
+# Encoded delta bytes collected before they are handed to the transport
+FLUSH_SIZE = 256 * 1024
+# The window rolls byte by byte in Python (a few MB/s). Once the unmatched bytes rolled over
+# exceed this share of the file (and MIN_SCAN_BYTES), the rest is sent as literals unsearched
+MAX_SCAN_RATIO = 0.2
+MIN_SCAN_BYTES = 1024 * 1024
+ADLER_MOD = 65521
+
+SIGNATURE_PATH = '/api/peer/signature/'
+DELTA_PATH = '/api/peer/delta/'
+PATCH_PATH = '/api/peer/patch/'
+
+
+def block_size_for(file_size: int) -> int:
+    """Block size for a file: about sqrt(size), rounded to 1 KB, as rsync does."""
+    size = int(math.sqrt(max(file_size, 1)))
+    size = (size + 1023) // 1024 * 1024
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, size))
+
+
+def _strong(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def make_signature(path: str, block_size: Optional[int] = None) -> bytes:
+    """
+    Block signatures of the local copy of a file. A missing file has no blocks.
+
+    Args:
+        path: File to describe
+        block_size: Fixed block size; chosen from the file size when omitted
+
+    Returns:
+        Encoded signature
+    """
+    try:
+        file_size = os.path.getsize(path)
+    except OSError:
+        file_size = 0
+    block_size = block_size or block_size_for(file_size)
+    entries = []
+    if file_size:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                entries.append(SIGNATURE_ENTRY.pack(zlib.adler32(block), _strong(block)))
+    header = SIGNATURE_HEADER.pack(SIGNATURE_MAGIC, block_size, file_size, len(entries))
+    return header + b''.join(entries)
+
+
+def parse_signature(data: bytes) -> Tuple[int, int, List[Tuple[int, bytes]]]:
+    """Decode a signature into (block size, file size, [(weak, strong), ...]); raises ValueError."""
+    if len(data) < SIGNATURE_HEADER.size:
+        raise ValueError('Truncated signature')
+    magic, block_size, file_size, count = SIGNATURE_HEADER.unpack_from(data)
+    if magic != SIGNATURE_MAGIC:
+        raise ValueError('Not a delta signature')
+    if not MIN_BLOCK_SIZE // 4 <= block_size <= MAX_BLOCK_SIZE * 8:
+        raise ValueError(f'Unsupported block size {block_size}')
+    if count != (file_size + block_size - 1) // block_size:
+        raise ValueError('Block count does not match file size')
+    if len(data) != SIGNATURE_HEADER.size + count * SIGNATURE_ENTRY.size:
+        raise ValueError('Signature length does not match block count')
+    blocks = list(SIGNATURE_ENTRY.iter_unpack(data[SIGNATURE_HEADER.size:]))
+    return block_size, file_size, blocks
+
+
+def _find(candidates: List[Tuple[int, bytes]], window) -> Optional[int]:
+    """Index of the block whose strong hash matches the window, if any."""
+    strong = _strong(window)
+    for index, digest in candidates:
+        if digest == strong:
+            return index
+    return None
+
+
+def _scan(data, block_size: int, table: Dict[int, List[Tuple[int, bytes]]],
+          tail: Optional[Tuple[int, int, bytes]]) -> Iterator[Tuple]:
+    """
+    Match the new file against the receiver's blocks.
+
+    Yields ('C', first block, count) and ('L', start, end) operations. At a
+    block boundary the window checksum comes straight from zlib, so runs of
+    unchanged blocks cost one C call each; only inside changed regions does
+    the window roll forward byte by byte. That is slow, so a mostly
+    rewritten file stops being searched after MAX_SCAN_RATIO of it and the
+    remainder goes out whole.
+    """
+    n = len(data)
+    p = literal_start = 0
+    budget = max(MIN_SCAN_BYTES, int(n * MAX_SCAN_RATIO))
+    run = None  # [first block, count] of consecutive copied blocks
+    a = b = None
+    # Without full blocks to look for (new or tiny receiver file) everything is literal
+    while table and n - p >= block_size:
+        if a is None:
+            value = zlib.adler32(data[p:p + block_size])
+            a, b = value & 0xffff, value >> 16
+        candidates = table.get((b << 16) | a)
+        index = _find(candidates, data[p:p + block_size]) if candidates else None
+        if index is not None:
+            if literal_start < p:
+                if run:
+                    yield ('C', run[0], run[1])
+                    run = None
+                yield ('L', literal_start, p)
+            if run and run[0] + run[1] == index:
+                run[1] += 1
+            else:
+                if run:
+                    yield ('C', run[0], run[1])
+                run = [index, 1]
+            p += block_size
+            literal_start = p
+            a = None
+            continue
+
+        if n - p == block_size:
+            break
+        # Slide the window one byte: drop data[p], take in data[p + block_size]
+        out_byte, in_byte = data[p], data[p + block_size]
+        a = (a - out_byte + in_byte) % ADLER_MOD
+        b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+        p += 1
+        budget -= 1
+        if not budget:
+            break
+        if p - literal_start >= LITERAL_CHUNK:
+            if run:
+                yield ('C', run[0], run[1])
+                run = None
+            yield ('L', literal_start, p)
+            literal_start = p
+
+    # The receiver's last block may be shorter than block_size and can only match at the very end
+    end = n
+    if tail is not None:
+        index, length, digest = tail
+        if n - literal_start >= length and _strong(data[n - length:n]) == digest:
+            end = n - length
+        else:
+            tail = None
+    if literal_start < end:
+        if run:
+            yield ('C', run[0], run[1])
+            run = None
+        for start in range(literal_start, end, LITERAL_CHUNK):
+            yield ('L', start, min(start + LITERAL_CHUNK, end))
+    if tail is not None:
+        if run and run[0] + run[1] == tail[0]:
+            run[1] += 1
+        else:
+            if run:
+                yield ('C', run[0], run[1])
+            run = [tail[0], 1]
+    if run:
+        yield ('C', run[0], run[1])
+
+
+def compute_delta(path: str, signature: bytes) -> Iterator[bytes]:
+    """
+    Encode a file as a delta against the receiver's signature.
+
+    The signature is validated and the file opened before this returns, so
+    errors surface to the caller rather than in the middle of a stream.
+
+    Args:
+        path: New version of the file (on the sender)
+        signature: Encoded signature of the receiver's copy
+
+    Returns:
+        Iterator over the encoded delta
+    """
+    block_size, file_size, blocks = parse_signature(signature)
+    table: Dict[int, List[Tuple[int, bytes]]] = {}
+    tail = None
+    for index, (weak, strong) in enumerate(blocks):
+        length = min(block_size, file_size - index * block_size)
+        if length == block_size:
+            table.setdefault(weak, []).append((index, strong))
+        else:
+            tail = (index, length, strong)
+    f = open(path, 'rb')
+    return _encode_delta(f, block_size, table, tail)
+
+
+def _encode_delta(f: BinaryIO, block_size: int, table, tail) -> Iterator[bytes]:
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        yield DELTA_HEADER.pack(DELTA_MAGIC, block_size, size)
+        if size == 0:
+            yield OP_END + hashlib.sha256().digest()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # Digest up front: if the file changes mid-transfer the receiver rejects the result
+            digest = hashlib.sha256(data).digest()
+            buffer = bytearray()
+            for op in _scan(data, block_size, table, tail):
+                if op[0] == 'C':
+                    buffer += OP_COPY + COPY_ARGS.pack(op[1], op[2])
+                else:
+                    buffer += OP_LITERAL + LENGTH.pack(op[2] - op[1])
+                    buffer += data[op[1]:op[2]]
+                if len(buffer) >= FLUSH_SIZE:
+                    yield bytes(buffer)
+                    buffer.clear()
+            buffer += OP_END + digest
+            yield bytes(buffer)
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ValueError('Truncated delta')
+        data += chunk
+    return data
+
+
+def apply_delta(base_path: str, stream: BinaryIO, out_path: str, max_size: Optional[int] = None) -> Dict[str, int]:
+    """
+    Rebuild a file from the receiver's copy and a delta read from ``stream``.
+
+    The result is written next to ``out_path`` and atomically moved into
+    place only after its SHA-256 matches the sender's, so an interrupted or
+    corrupt transfer leaves the old file untouched. ``base_path`` and
+    ``out_path`` may be the same file.
+
+    Returns:
+        Transfer statistics: size, literal_bytes, copied_bytes
+
+    Raises:
+        OSError: ENOSPC if the announced size exceeds ``max_size``
+    """
+    magic, block_size, size = DELTA_HEADER.unpack(_read_exact(stream, DELTA_HEADER.size))
+    if magic != DELTA_MAGIC:
+        raise ValueError('Not a delta')
+    if max_size is not None and size > max_size:
+        raise OSError(errno.ENOSPC, 'Not enough disk space')
+
+    base = open(base_path, 'rb') if base_path and os.path.isfile(base_path) else None
+    base_size = os.fstat(base.fileno()).st_size if base else 0
+    block_count = (base_size + block_size - 1) // block_size
+    stats = {'size': size, 'literal_bytes': 0, 'copied_bytes': 0}
+
+    fd, tmp_path = tempfile.mkstemp(prefix='.delta-', dir=os.path.dirname(os.path.abspath(out_path)))
+    try:
+        digest = hashlib.sha256()
+        written = 0
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                op = _read_exact(stream, 1)
+                if op == OP_COPY:
+                    first, count = COPY_ARGS.unpack(_read_exact(stream, COPY_ARGS.size))
+                    if first + count > block_count:
+                        raise ValueError('Delta refers to a block the base file does not have')
+                    base.seek(first * block_size)
+                    remaining = min(count * block_size, base_size - first * block_size)
+                    stats['copied_bytes'] += remaining
+                    while remaining:
+                        chunk = base.read(min(remaining, LITERAL_CHUNK))
+                        if not chunk:
+                            raise ValueError('Base file changed during the transfer')
+                        out.write(chunk)
+                        digest.update(chunk)
+                        remaining -= len(chunk)
+                        written += len(chunk)
+                elif op == OP_LITERAL:
+                    length, = LENGTH.unpack(_read_exact(stream, LENGTH.size))
+                    if length > LITERAL_CHUNK:
+                        raise ValueError('Literal run too long')
+                    chunk = _read_exact(stream, length)
+                    out.write(chunk)
+                    digest.update(chunk)
+                    stats['literal_bytes'] += length
+                    written += length
+                elif op == OP_END:
+                    expected = _read_exact(stream, 32)
+                    break
+                else:
+                    raise ValueError(f'Unknown delta operation {op!r}')
+                if written > size:
+                    raise ValueError('Delta is longer than announced')
+        if written != size or digest.digest() != expected:
+            raise ValueError('Rebuilt file does not match the sender')
+        if base:
+            base.close()
+            os.chmod(tmp_path, os.stat(base_path).st_mode & 0o7777)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        if base:
+            base.close()
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return stats
+
+
+class DeltaSync:
+    """
+    rsync-style file transfer between instances.
+
+    The receiver describes its copy of a file as block signatures (a weak
+    rolling checksum plus a strong hash per block); the sender slides over
+    the new version looking for those blocks and sends only block
+    references and the literal bytes in between. A file that changed in a
+    few places therefore costs a few blocks on the wire instead of its full
+    size. Both pulling (receiver asks) and pushing (sender offers) use the
+    same three peer endpoints.
+    """
+
+    def __init__(self, base_path: str, block_size: int = 0, timeout: float = 30.0):
+        """
+        Initialize the DeltaSync.
+
+        Args:
+            base_path: Shared root; all paths are relative to it
+            block_size: Fixed block size in bytes; 0 picks one per file
+            timeout: Timeout for peer requests in seconds
+        """
+        self.base_path = os.path.abspath(base_path)
+        self.block_size = block_size or None
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__)
+        self.stats = {'sent': 0, 'received': 0, 'literal_bytes': 0, 'copied_bytes': 0}
+
+    @cached_property
+    def session(self):
+        session = requests.Session()
+        session.headers.update(peer_auth.headers())
+        return session
+
+    def resolve(self, rel_path: str) -> str:
+        """Absolute path of a shared file; raises ValueError if it escapes the shared root."""
+        rel_path = rel_path.replace('\\', '/').strip('/')
+        path = os.path.abspath(os.path.join(self.base_path, rel_path))
+        if not rel_path or not path.startswith(self.base_path + os.sep):
+            raise ValueError(f'Invalid path: {rel_path}')
+        return path
+
+    def _record(self, stats: Dict[str, int]) -> None:
+        self.stats['literal_bytes'] += stats['literal_bytes']
+        self.stats['copied_bytes'] += stats['copied_bytes']
+
+    # ------------------------------------------------------------------
+    # Local side of the peer endpoints
+    # ------------------------------------------------------------------
+    def signature(self, rel_path: str) -> bytes:
+        path = self.resolve(rel_path)
+        if os.path.isdir(path):
+            raise ValueError(f'Not a file: {rel_path}')
+        return make_signature(path, self.block_size)
+
+    def delta(self, rel_path: str, signature: bytes) -> Iterator[bytes]:
+        """Delta of a shared file against a peer's signature; raises FileNotFoundError or ValueError."""
+        path = self.resolve(rel_path)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(rel_path)
+        self.stats['sent'] += 1
+        return compute_delta(path, signature)
+
+    def apply(self, rel_path: str, stream: BinaryIO, max_growth: Optional[int] = None) -> Dict[str, int]:
+        """Apply a delta received from a peer to a shared file; ENOSPC if it would grow by more than ``max_growth``."""
+        path = self.resolve(rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        max_size = None
+        if max_growth is not None:
+            max_size = max_growth + (os.path.getsize(path) if os.path.isfile(path) else 0)
+        stats = apply_delta(path, stream, path, max_size)
+        self.stats['received'] += 1
+        self._record(stats)
+        return stats
+
+    # ------------------------------------------------------------------
+    # Transfers with a peer
+    # ------------------------------------------------------------------
+    def pull(self, peer_url: str, rel_path: str, local_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Bring a local file up to date with the peer's version.
+
+        Args:
+            peer_url: Base URL of the peer, e.g. http://192.168.1.5:5000
+            rel_path: Path of the file on the peer, relative to its shared root
+            local_path: Destination; defaults to the same relative path here
+        """
+        local_path = local_path or self.resolve(rel_path)
+        signature = make_signature(local_path, self.block_size)
+        url = f"{peer_url.rstrip('/')}{DELTA_PATH}{quote(rel_path.strip('/'))}"
+        with self.session.post(url, data=signature, stream=True, timeout=self.timeout,
+                               headers={'Content-Type': 'application/octet-stream'}) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+            stats = apply_delta(local_path, response.raw, local_path)
+        self.stats['received'] += 1
+        self._record(stats)
+        self.logger.info(f"Pulled {rel_path} from {peer_url}: {stats['literal_bytes']} literal, "
+                         f"{stats['copied_bytes']} reused bytes")
+        return {'path': local_path, **stats}
+
+    def push(self, peer_url: str, rel_path: str, local_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Bring the peer's copy of a file up to date with the local version.
+
+        Args:
+            peer_url: Base URL of the peer
+            rel_path: Path of the file on the peer, relative to its shared root
+            local_path: Source file; defaults to the same relative path here
+        """
+        local_path = local_path or self.resolve(rel_path)
+        base = peer_url.rstrip('/')
+        quoted = quote(rel_path.strip('/'))
+        response = self.session.get(f"{base}{SIGNATURE_PATH}{quoted}", timeout=self.timeout)
+        response.raise_for_status()
+
+        # Spool the delta so it is sent with a Content-Length instead of chunked
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as body:
+            for chunk in compute_delta(local_path, response.content):
+                body.write(chunk)
+            body.seek(0)
+            response = self.session.post(f"{base}{PATCH_PATH}{quoted}", data=body, timeout=self.timeout,
+                                         headers={'Content-Type': 'application/octet-stream'})
+        response.raise_for_status()
+        stats = response.json()['result']
+        self.stats['sent'] += 1
+        self._record(stats)
+        return {'path': rel_path, **stats}
@@ -0,0 +1,205 @@
+import copy
+import math
+import time
+import logging
+import threading
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, NamedTuple, Optional
+
+# Timer kinds kept on the wheel for every device
+STALE = 'stale'    # not heard from within the online window
+EXPIRE = 'expire'  # not heard from within the TTL, removed
+
+
+class DeviceSnapshot(NamedTuple):
+    """Immutable view of the registry at one version."""
+    version: int
+    devices: Mapping[str, Any]
+    offline: frozenset
+
+
+class DeviceRegistry:
+    """
+    Known devices, safe to use from discovery, watcher and request threads.
+
+    Writers serialize on a lock and publish a new copy of the device table
+    (copy-on-write); readers just grab the current snapshot and never
+    block. Staleness and expiry are driven by a timing wheel with one slot
+    per cleanup interval, so touching, going offline and expiring are O(1)
+    per device instead of a scan of the whole table. Device objects in a
+    published snapshot are never modified; a touch stores a copy.
+    """
+
+    def __init__(self, ttl: float = 300, tick: float = 60, online_window: float = 60,
+                 on_expire: Optional[Callable[[Any], None]] = None):
+        """
+        Initialize the DeviceRegistry.
+
+        Args:
+            ttl: Seconds without contact after which a device is removed
+            tick: Wheel resolution in seconds; expiry happens at most one tick late
+            online_window: Seconds without contact after which a device is shown offline
+            on_expire: Called with each removed device
+        """
+        self.ttl = ttl
+        self.tick = tick
+        self.online_window = min(online_window, ttl)
+        self.on_expire = on_expire
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._snapshot = DeviceSnapshot(0, MappingProxyType({}), frozenset())
+        self._listing_lock = threading.Lock()
+        self._listing: Optional[tuple] = None  # (version, list of dicts)
+
+        # A timer due after d seconds lands ceil(d / tick) + 1 slots ahead, which is never early
+        self._wheel: List[Dict[str, str]] = [dict() for _ in range(math.ceil(ttl / tick) + 2)]
+        self._cursor = 0
+        self._timers: Dict[str, Dict[str, int]] = {}  # device id -> kind -> slot
+        self._running = False
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="DeviceRegistry", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+        self._wakeup.set()
+
+    # ------------------------------------------------------------------
+    # Timing wheel (caller holds the lock)
+    # ------------------------------------------------------------------
+    def _schedule(self, device_id: str, kind: str, delay: float) -> None:
+        timers = self._timers.setdefault(device_id, {})
+        old = timers.get(kind)
+        if old is not None:
+            self._wheel[old].pop(device_id + '\0' + kind, None)
+        slot = (self._cursor + math.ceil(delay / self.tick) + 1) % len(self._wheel)
+        self._wheel[slot][device_id + '\0' + kind] = device_id
+        timers[kind] = slot
+
+    def _cancel(self, device_id: str) -> None:
+        for kind, slot in self._timers.pop(device_id, {}).items():
+            self._wheel[slot].pop(device_id + '\0' + kind, None)
+
+    def _publish(self, devices: Dict[str, Any], offline: frozenset) -> None:
+        self._snapshot = DeviceSnapshot(self._snapshot.version + 1, MappingProxyType(devices), offline)
+
+    def advance(self) -> List[Any]:
+        """Process the next wheel slot; returns the devices that expired."""
+        expired = []
+        with self._lock:
+            self._cursor = (self._cursor + 1) % len(self._wheel)
+            due = self._wheel[self._cursor]
+            if not due:
+                return expired
+            self._wheel[self._cursor] = {}
+            devices = dict(self._snapshot.devices)
+            offline = set(self._snapshot.offline)
+            for key, device_id in due.items():
+                kind = key.rpartition('\0')[2]
+                timers = self._timers.get(device_id, {})
+                timers.pop(kind, None)
+                if kind == STALE:
+                    if device_id in devices:
+                        offline.add(device_id)
+                elif device_id in devices:
+                    expired.append(devices.pop(device_id))
+                    offline.discard(device_id)
+                    self._cancel(device_id)
+            self._publish(devices, frozenset(offline))
+        for device in expired:
+            self.logger.info(f"Device {device.device_id} expired")
+            if self.on_expire:
+                try:
+                    self.on_expire(device)
+                except Exception as e:
+                    self.logger.error(f"Device expiry callback failed: {e}", exc_info=True)
+        return expired
+
+    def _run(self) -> None:
+        while self._running:
+            if self._wakeup.wait(self.tick):
+                break
+            try:
+                self.advance()
+            except Exception as e:
+                self.logger.error(f"Device registry tick failed: {e}", exc_info=True)
+
+    # ------------------------------------------------------------------
+    # Writers
+    # ------------------------------------------------------------------
+    def upsert(self, device: Any) -> None:
+        """Add or replace a device; it counts as seen now."""
+        device.last_seen = time.time()
+        with self._lock:
+            devices = dict(self._snapshot.devices)
+            devices[device.device_id] = device
+            self._schedule(device.device_id, STALE, self.online_window)
+            self._schedule(device.device_id, EXPIRE, self.ttl)
+            self._publish(devices, self._snapshot.offline - {device.device_id})
+
+    def touch(self, device_id: str) -> bool:
+        """Record contact with a known device; False if it is not registered."""
+        with self._lock:
+            current = self._snapshot.devices.get(device_id)
+            if current is None:
+                return False
+            device = copy.copy(current)
+            device.last_seen = time.time()
+            devices = dict(self._snapshot.devices)
+            devices[device_id] = device
+            self._schedule(device_id, STALE, self.online_window)
+            self._schedule(device_id, EXPIRE, self.ttl)
+            self._publish(devices, self._snapshot.offline - {device_id})
+        return True
+
+    def remove(self, device_id: str) -> bool:
+        with self._lock:
+            if device_id not in self._snapshot.devices:
+                return False
+            devices = dict(self._snapshot.devices)
+            del devices[device_id]
+            self._cancel(device_id)
+            self._publish(devices, self._snapshot.offline - {device_id})
+        return True
+
+    # ------------------------------------------------------------------
+    # Readers (lock-free)
+    # ------------------------------------------------------------------
+    def snapshot(self) -> DeviceSnapshot:
+        return self._snapshot
+
+    def get(self, device_id: str) -> Optional[Any]:
+        return self._snapshot.devices.get(device_id)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._snapshot.devices
+
+    def __len__(self) -> int:
+        return len(self._snapshot.devices)
+
+    def listing(self) -> List[Dict[str, Any]]:
+        """
+        Devices as dictionaries with an 'online'/'offline' status.
+
+        Built once per snapshot version and shared by every reader until
+        the registry changes again; callers must not modify it.
+        """
+        snapshot = self._snapshot
+        cached = self._listing
+        if cached is not None and cached[0] == snapshot.version:
+            return cached[1]
+        with self._listing_lock:
+            cached = self._listing
+            if cached is not None and cached[0] == snapshot.version:
+                return cached[1]
+            devices = [{**device.to_dict(), 'status': 'offline' if device_id in snapshot.offline else 'online'}
+                       for device_id, device in snapshot.devices.items()]
+            self._listing = (snapshot.version, devices)
+            return devices
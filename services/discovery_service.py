@@ -1,72 +1,204 @@
-
+import os
+import json
 import time
 import socket
+import logging
+import tempfile
 import threading
-from zeroconf import ServiceBrowser, Zeroconf
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, List, Optional
+
 from config import Config
 from models.device import Device
+from services.device_registry import DeviceRegistry
+
+if TYPE_CHECKING:
+    from zeroconf import ServiceStateChange, Zeroconf
+
+# Peers in the last-known file older than this are not restored
+WARM_START_MAX_AGE = 24 * 3600
+# How often the last-known peers file is rewritten (only when the registry changed)
+PEERS_SAVE_INTERVAL = 30
+# Milliseconds to wait for a service's address records
+RESOLVE_TIMEOUT = 2000
+
 
 class DiscoveryService:
-    def __init__(self, network_service):
+    """
+    One long-lived mDNS browser for the whole process.
+
+    A single Zeroconf instance and ServiceBrowser run from the first
+    ``start_discovery_thread`` call until shutdown, and announcements are
+    resolved on a small thread pool and written to the device registry as
+    they arrive. Requests only read the registry. The registry is
+    warm-started from the last-known peers file, so known devices are
+    listed immediately after a restart; they expire normally if they do
+    not answer again.
+    """
+
+    def __init__(self, network_service=None, registry: Optional[DeviceRegistry] = None,
+                 peers_file: Optional[str] = None, service_type: str = "_http._tcp.local.",
+                 device_factory: Callable[..., Any] = Device):
+        """
+        Initialize the DiscoveryService.
+
+        Args:
+            network_service: NetworkService of the app (kept for callers that pass it)
+            registry: Registry that discovered devices are written to
+            peers_file: JSON file of last-known peers, read at start and rewritten on changes
+            service_type: mDNS service type to browse
+            device_factory: Builds a device from (device_id, ip, port, shared_folders)
+        """
         self.network_service = network_service
+        if registry is None:
+            registry = DeviceRegistry(ttl=Config.DEVICE_TIMEOUT, tick=Config.DEVICE_CLEANUP_INTERVAL)
+            registry.start()
+        self.registry = registry
+        self.peers_file = peers_file
+        self.service_type = service_type
+        self.device_factory = device_factory
+        self.logger = logging.getLogger(__name__)
+
         self.zeroconf = None
         self.browser = None
         self.running = False
         self.thread = None
-    
-    def start_discovery_thread(self):
-        """Start the discovery service in a background thread"""
-        if self.running:
-            return
-            
-        self.running = True
-        self.zeroconf = Zeroconf()
-        self.listener = self.DeviceListener(self.network_service)
-        self.browser = ServiceBrowser(self.zeroconf, "_http._tcp.local.", self.listener)
-        
-        def discovery_loop():
+        self._start_lock = threading.Lock()
+        self._resolver: Optional[ThreadPoolExecutor] = None
+        self._saved_version = -1
+
+    def start_discovery_thread(self) -> bool:
+        """Start the browser if it is not running yet; safe to call from any request."""
+        with self._start_lock:
+            if self.running:
+                return True
+            from zeroconf import IPVersion, ServiceBrowser, Zeroconf
             try:
-                while self.running:
-                    time.sleep(1)
+                self.warm_start()
+                self._resolver = ThreadPoolExecutor(max_workers=4, thread_name_prefix='DiscoveryResolve')
+                self.zeroconf = Zeroconf(ip_version=IPVersion.V4Only)
+                self.browser = ServiceBrowser(self.zeroconf, self.service_type,
+                                              handlers=[self._on_service_state_change])
             except Exception as e:
-                print(f"Discovery thread error: {e}")
-            finally:
-                self.zeroconf.close()
-                
-        self.thread = threading.Thread(target=discovery_loop, daemon=True)
-        self.thread.start()
-        return True
-    
+                self.logger.error(f"Could not start device discovery: {e}")
+                if self.zeroconf:
+                    self.zeroconf.close()
+                    self.zeroconf = None
+                return False
+            self.running = True
+            self.thread = threading.Thread(target=self._save_loop, name="DiscoverySave", daemon=True)
+            self.thread.start()
+            return True
+
     def stop_discovery(self):
-        """Stop the discovery service"""
-        self.running = False
+        """Stop the browser and persist the peers seen so far."""
+        with self._start_lock:
+            if not self.running:
+                return
+            self.running = False
+            if self.browser:
+                self.browser.cancel()
+                self.browser = None
+            if self._resolver:
+                self._resolver.shutdown(wait=False)
+            if self.zeroconf:
+                self.zeroconf.close()
+                self.zeroconf = None
         if self.thread:
             self.thread.join(timeout=5)
             self.thread = None
-        if self.zeroconf:
-            self.zeroconf.close()
-            self.zeroconf = None
-    
-    def discover_devices(self):
-        """Discover other devices on the local network"""
-        if not self.zeroconf:
-            self.start_discovery_thread()
-        return []
-    
-    class DeviceListener:
-        def __init__(self, network_service):
-            self.network_service = network_service
-            
-        def remove_service(self, zeroconf, type, name):
-            print(f"Service {name} removed")
-            
-        def add_service(self, zeroconf, type, name):
-            info = zeroconf.get_service_info(type, name)
-            if info:
-                print(f"Service {name} added, service info: {info}")
-                
-        def update_service(self, zeroconf, type, name):
-            # This method is called when a service is updated
-            info = zeroconf.get_service_info(type, name)
-            if info:
-                print(f"Service {name} updated, service info: {info}")
\ No newline at end of file
+        self.save_peers()
+
+    def discover_devices(self) -> List[Any]:
+        """Devices currently known; starts the browser on first use."""
+        self.start_discovery_thread()
+        return list(self.registry.snapshot().devices.values())
+
+    # ------------------------------------------------------------------
+    # Browser callbacks
+    # ------------------------------------------------------------------
+    def _on_service_state_change(self, zeroconf: 'Zeroconf', service_type: str, name: str,
+                                 state_change: 'ServiceStateChange') -> None:
+        # Runs on the browser thread: resolving is handed off so announcements are never delayed
+        from zeroconf import ServiceStateChange
+        device_id = name.split('.')[0]
+        if state_change is ServiceStateChange.Removed:
+            if self.registry.remove(device_id):
+                self.logger.info(f"Device {device_id} left")
+            return
+        if self._resolver and self.running:
+            try:
+                self._resolver.submit(self._resolve, zeroconf, service_type, name, device_id)
+            except RuntimeError:
+                pass  # shutting down
+
+    def _resolve(self, zeroconf: 'Zeroconf', service_type: str, name: str, device_id: str) -> None:
+        try:
+            info = zeroconf.get_service_info(service_type, name, timeout=RESOLVE_TIMEOUT)
+        except Exception as e:
+            self.logger.debug(f"Resolving {name} failed: {e}")
+            return
+        if not info or not info.addresses:
+            return
+        address = socket.inet_ntoa(info.addresses[0])
+        current = self.registry.get(device_id)
+        if current is not None and (current.ip, current.port) == (address, info.port):
+            self.registry.touch(device_id)
+            return
+        self.registry.upsert(self.device_factory(device_id, address, info.port, []))
+        self.logger.info(f"Discovered device: {device_id} at {address}:{info.port}")
+
+    # ------------------------------------------------------------------
+    # Last-known peers
+    # ------------------------------------------------------------------
+    def warm_start(self) -> int:
+        """Load the last-known peers file into the registry; returns the number restored."""
+        if not self.peers_file:
+            return 0
+        try:
+            with open(self.peers_file, 'r', encoding='utf-8') as f:
+                peers = json.load(f)
+        except (OSError, ValueError):
+            return 0
+
+        restored = 0
+        cutoff = time.time() - WARM_START_MAX_AGE
+        for peer in peers:
+            try:
+                if peer.get('last_seen', 0) < cutoff or peer['device_id'] in self.registry:
+                    continue
+                self.registry.upsert(self.device_factory(peer['device_id'], peer['ip'], int(peer['port']),
+                                                         peer.get('shared_folders') or []))
+                restored += 1
+            except (KeyError, TypeError, ValueError):
+                continue
+        if restored:
+            self.logger.info(f"Restored {restored} last-known peers")
+        return restored
+
+    def save_peers(self) -> None:
+        """Write the current devices to the last-known peers file if the registry changed."""
+        snapshot = self.registry.snapshot()
+        if not self.peers_file or snapshot.version == self._saved_version:
+            return
+        peers = [{'device_id': d.device_id, 'ip': d.ip, 'port': d.port,
+                  'shared_folders': d.shared_folders, 'last_seen': d.last_seen}
+                 for d in snapshot.devices.values()]
+        try:
+            directory = os.path.dirname(os.path.abspath(self.peers_file))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.peers-', dir=directory)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(peers, f)
+            os.replace(tmp_path, self.peers_file)
+            self._saved_version = snapshot.version
+        except OSError as e:
+            self.logger.warning(f"Could not save last-known peers: {e}")
+
+    def _save_loop(self) -> None:
+        next_save = time.monotonic() + PEERS_SAVE_INTERVAL
+        while self.running:
+            time.sleep(1)
+            if time.monotonic() >= next_save:
+                self.save_peers()
+                next_save = time.monotonic() + PEERS_SAVE_INTERVAL
@@ -0,0 +1,386 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Bytes hashed from each end of a file in the partial-hash stage
+PARTIAL_HASH_SIZE = 64 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+# How often hashing progress is written to disk
+CHECKPOINT_INTERVAL = 10
+
+
+class DuplicateService:
+    """
+    Staged duplicate finder.
+
+    Files are grouped by size first, then by a hash of their first and last
+    64 KB, and only files that still collide are hashed in full. Hashes are
+    cached on disk keyed by size and mtime, so an interrupted scan resumes
+    where it left off and a rescan only hashes files that changed.
+    """
+
+    def __init__(self, base_path: str, state_path: str, workers: int = 4, min_size: int = 1,
+                 path_index=None):
+        """
+        Initialize the DuplicateService.
+
+        Args:
+            base_path: Root directory that is scanned
+            state_path: JSON file holding the hash cache and the last results
+            workers: Number of hashing threads
+            min_size: Files smaller than this are ignored
+            path_index: Optional PathIndex used to list files without walking the disk
+        """
+        self.base_path = os.path.abspath(base_path)
+        self.state_path = state_path
+        self.workers = max(1, workers)
+        self.min_size = max(1, min_size)
+        self.path_index = path_index
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # one writer of the state file at a time
+        self._thread: Optional[threading.Thread] = None
+        self._last_checkpoint = 0.0
+        self.state = self._load_state()
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def _load_state(self) -> Dict[str, Any]:
+        state = {'status': 'idle', 'stage': None, 'started': None, 'finished': None,
+                 'progress': {}, 'hashes': {}, 'groups': []}
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable duplicate state {self.state_path}: {e}")
+        return state
+
+    def _save_state(self) -> None:
+        with self._save_lock:
+            self._write_state()
+
+    def _write_state(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with self._lock:
+            data = json.dumps(self.state)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.state_path)
+        self._last_checkpoint = time.monotonic()
+
+    def _checkpoint(self) -> None:
+        # Hashing workers call this concurrently; one checkpoint at a time is enough
+        if time.monotonic() - self._last_checkpoint >= CHECKPOINT_INTERVAL and \
+                self._save_lock.acquire(blocking=False):
+            try:
+                self._write_state()
+            finally:
+                self._save_lock.release()
+
+    # ------------------------------------------------------------------
+    # Job control
+    # ------------------------------------------------------------------
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def interrupted(self) -> bool:
+        """True if the last scan was still running when the process stopped."""
+        return self.state.get('status') == 'running' and not self.running
+
+    def start(self) -> bool:
+        """Start a scan in the background; returns False if one is already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self._thread = threading.Thread(target=self._run, name="DuplicateScan", daemon=True)
+            self._thread.start()
+        return True
+
+    def resume_if_interrupted(self) -> None:
+        if self.interrupted:
+            self.logger.info("Resuming interrupted duplicate scan")
+            self.start()
+
+    def _run(self) -> None:
+        with self._lock:
+            self.state.update({'status': 'running', 'stage': 'listing', 'started': time.time(),
+                               'finished': None, 'progress': {}})
+        self._save_state()
+        try:
+            groups = self.scan()
+            with self._lock:
+                self.state.update({'status': 'done', 'stage': None, 'finished': time.time(), 'groups': groups})
+        except Exception as e:
+            self.logger.error(f"Duplicate scan failed: {e}", exc_info=True)
+            with self._lock:
+                self.state.update({'status': 'failed', 'error': str(e), 'finished': time.time()})
+        self._save_state()
+
+    def _set_stage(self, stage: str, total: int) -> None:
+        with self._lock:
+            self.state['stage'] = stage
+            self.state['progress'] = {'done': 0, 'total': total}
+
+    def _advance(self) -> None:
+        with self._lock:
+            self.state['progress']['done'] += 1
+
+    # ------------------------------------------------------------------
+    # Scanning
+    # ------------------------------------------------------------------
+    def _iter_files(self) -> Iterable[Tuple[str, int]]:
+        """Yield (relative path, size) for every regular file."""
+        if self.path_index is not None and self.path_index.count() > 0:
+            for rel_path, size, _ in self.path_index.iter_files():
+                yield rel_path, size
+            return
+
+        stack = [self.base_path]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file(follow_symlinks=False):
+                                rel_path = os.path.relpath(entry.path, self.base_path).replace('\\', '/')
+                                yield rel_path, entry.stat(follow_symlinks=False).st_size
+                        except OSError:
+                            continue
+            except OSError as e:
+                self.logger.warning(f"Cannot scan {directory}: {e}")
+
+    def _cached_hash(self, rel_path: str, kind: str, hasher: Callable[[str, int], str]) -> Optional[Tuple[str, os.stat_result]]:
+        """Return the cached or freshly computed hash of a file together with its stat."""
+        abs_path = os.path.join(self.base_path, rel_path)
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            return None
+
+        key = [st.st_size, st.st_mtime_ns]
+        with self._lock:
+            cached = self.state['hashes'].get(rel_path)
+            if cached and cached.get('key') == key and kind in cached:
+                return cached[kind], st
+
+        try:
+            digest = hasher(abs_path, st.st_size)
+        except OSError as e:
+            self.logger.warning(f"Cannot hash {abs_path}: {e}")
+            return None
+
+        with self._lock:
+            cached = self.state['hashes'].get(rel_path)
+            if not cached or cached.get('key') != key:
+                cached = {'key': key}
+                self.state['hashes'][rel_path] = cached
+            cached[kind] = digest
+        return digest, st
+
+    @staticmethod
+    def partial_hash(abs_path: str, size: int) -> str:
+        """Hash of the size plus the first and last 64 KB of a file."""
+        digest = hashlib.sha1(str(size).encode())
+        with open(abs_path, 'rb') as f:
+            digest.update(f.read(PARTIAL_HASH_SIZE))
+            if size > PARTIAL_HASH_SIZE:
+                f.seek(max(PARTIAL_HASH_SIZE, size - PARTIAL_HASH_SIZE))
+                digest.update(f.read(PARTIAL_HASH_SIZE))
+        return digest.hexdigest()
+
+    @staticmethod
+    def full_hash(abs_path: str, size: int) -> str:
+        digest = hashlib.sha256()
+        with open(abs_path, 'rb') as f:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _hash_stage(self, stage: str, candidates: List[List[str]], kind: str,
+                    hasher: Callable[[str, int], str]) -> List[List[Tuple[str, os.stat_result]]]:
+        """Hash every candidate in parallel and split each candidate group by the hash."""
+        total = sum(len(group) for group in candidates)
+        self._set_stage(stage, total)
+
+        def work(rel_path):
+            result = self._cached_hash(rel_path, kind, hasher)
+            self._advance()
+            self._checkpoint()
+            return rel_path, result
+
+        refined = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"Dup-{kind}") as pool:
+            for group in candidates:
+                buckets: Dict[str, List[Tuple[str, os.stat_result]]] = defaultdict(list)
+                for rel_path, result in pool.map(work, group):
+                    if result is not None:
+                        buckets[result[0]].append((rel_path, result[1]))
+                refined.extend(bucket for bucket in buckets.values() if self._distinct_inodes(bucket) > 1)
+        return refined
+
+    @staticmethod
+    def _distinct_inodes(files: List[Tuple[str, os.stat_result]]) -> int:
+        return len({(st.st_dev, st.st_ino) for _, st in files})
+
+    def scan(self) -> List[Dict[str, Any]]:
+        """
+        Run all stages and return duplicate groups, largest reclaimable size first.
+
+        Returns:
+            List of groups with the full hash as ``id``, file size, the files
+            and the bytes freed by keeping a single copy
+        """
+        by_size: Dict[int, List[str]] = defaultdict(list)
+        for rel_path, size in self._iter_files():
+            if size >= self.min_size:
+                by_size[size].append(rel_path)
+        candidates = [paths for paths in by_size.values() if len(paths) > 1]
+        del by_size
+
+        partial_groups = self._hash_stage('partial', candidates, 'partial', self.partial_hash)
+
+        # Files that fit into the two sampled blocks are already fully compared
+        small = [group for group in partial_groups if group[0][1].st_size <= 2 * PARTIAL_HASH_SIZE]
+        large = [[rel_path for rel_path, _ in group] for group in partial_groups
+                 if group[0][1].st_size > 2 * PARTIAL_HASH_SIZE]
+        full_groups = self._hash_stage('full', large, 'full', self.full_hash)
+
+        with self._lock:
+            hashes = self.state['hashes']
+            groups = []
+            for kind, buckets in (('partial', small), ('full', full_groups)):
+                for bucket in buckets:
+                    size = bucket[0][1].st_size
+                    copies = self._distinct_inodes(bucket)
+                    groups.append({
+                        'id': hashes[bucket[0][0]][kind],
+                        'size': size,
+                        'files': sorted(rel_path for rel_path, _ in bucket),
+                        'reclaimable': size * (copies - 1)
+                    })
+
+            # Forget cached hashes of files that no longer exist
+            listed = {rel_path for group in candidates for rel_path in group}
+            for rel_path in [p for p in hashes if p not in listed]:
+                del hashes[rel_path]
+
+        groups.sort(key=lambda g: g['reclaimable'], reverse=True)
+        return groups
+
+    # ------------------------------------------------------------------
+    # Results and actions
+    # ------------------------------------------------------------------
+    def get_status(self) -> Dict[str, Any]:
+        with self._lock:
+            groups = self.state.get('groups', [])
+            return {
+                'status': 'running' if self.running else self.state.get('status'),
+                'stage': self.state.get('stage'),
+                'progress': dict(self.state.get('progress') or {}),
+                'started': self.state.get('started'),
+                'finished': self.state.get('finished'),
+                'groups': len(groups),
+                'reclaimable': sum(g['reclaimable'] for g in groups)
+            }
+
+    def get_groups(self, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.state.get('groups', [])[offset:offset + limit])
+
+    def _find_group(self, group_id: str) -> Optional[Dict[str, Any]]:
+        for group in self.state.get('groups', []):
+            if group['id'] == group_id:
+                return group
+        return None
+
+    def resolve(self, group_id: str, keep: str, action: str = 'hardlink') -> Dict[str, Any]:
+        """
+        Remove the redundancy in a duplicate group.
+
+        Every file other than ``keep`` is either replaced by a hard link to
+        ``keep`` or deleted. Files that changed since the scan are left alone.
+
+        Args:
+            group_id: ``id`` of the group as returned by get_groups()
+            keep: Relative path of the copy to keep
+            action: 'hardlink' or 'delete'
+
+        Returns:
+            Dictionary with the processed and skipped files and the bytes freed
+        """
+        if action not in ('hardlink', 'delete'):
+            raise ValueError(f"Unknown action: {action}")
+        if self.running:
+            raise RuntimeError("A duplicate scan is running")
+
+        with self._lock:
+            group = self._find_group(group_id)
+            if group is None:
+                raise KeyError(group_id)
+            if keep not in group['files']:
+                raise ValueError(f"{keep} is not part of the group")
+            expected = {p: (self.state['hashes'].get(p) or {}).get('key') for p in group['files']}
+
+        keep_path = os.path.join(self.base_path, keep)
+        keep_stat = os.stat(keep_path)
+        if [keep_stat.st_size, keep_stat.st_mtime_ns] != expected[keep]:
+            raise RuntimeError(f"{keep} changed since the scan, rescan first")
+
+        processed, skipped, freed = [], [], 0
+        for rel_path in group['files']:
+            if rel_path == keep:
+                continue
+            abs_path = os.path.join(self.base_path, rel_path)
+            try:
+                st = os.stat(abs_path)
+                if [st.st_size, st.st_mtime_ns] != expected[rel_path]:
+                    skipped.append(rel_path)
+                    continue
+                already_linked = (st.st_dev, st.st_ino) == (keep_stat.st_dev, keep_stat.st_ino)
+                if action == 'hardlink':
+                    if not already_linked:
+                        # Link next to the target first so the swap is atomic
+                        tmp_path = f"{abs_path}.dup-link"
+                        os.link(keep_path, tmp_path)
+                        os.replace(tmp_path, abs_path)
+                else:
+                    os.remove(abs_path)
+                if not already_linked:
+                    freed += st.st_size
+                processed.append(rel_path)
+            except OSError as e:
+                self.logger.error(f"Could not {action} {abs_path}: {e}")
+                skipped.append(rel_path)
+
+        with self._lock:
+            group = self._find_group(group_id)
+            if group is not None:
+                if action == 'delete':
+                    group['files'] = [p for p in group['files'] if p not in processed]
+                remaining = [p for p in group['files'] if p == keep or p in skipped]
+                if len(remaining) <= 1:
+                    self.state['groups'].remove(group)
+                else:
+                    group['reclaimable'] = max(0, group['reclaimable'] - freed)
+        self._save_state()
+
+        return {'processed': processed, 'skipped': skipped, 'freed': freed}
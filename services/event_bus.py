@@ -0,0 +1,225 @@
+import os
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+
+@dataclass
+class FileEvent:
+    """One logical change to a path, after coalescing"""
+    action: str  # 'created', 'modified', 'deleted' or 'moved'
+    path: str
+    is_directory: bool = False
+    src_path: Optional[str] = None  # previous location for 'moved'
+    first_seen: float = 0.0
+    last_seen: float = 0.0
+    count: int = 1  # raw events merged into this one
+
+    def to_dict(self):
+        return {
+            'action': self.action,
+            'path': self.path,
+            'is_directory': self.is_directory,
+            'src_path': self.src_path,
+            'count': self.count
+        }
+
+
+class _Subscriber:
+    """A consumer with its own queue and worker thread, so a slow one cannot hold up the others."""
+
+    def __init__(self, name: str, callback: Callable[[List[FileEvent]], None], logger: logging.Logger):
+        self.name = name
+        self.callback = callback
+        self.logger = logger
+        self.queue: 'queue.Queue[Optional[List[FileEvent]]]' = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name=f"EventBus-{name}", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = self.queue.get()
+            try:
+                if batch is None:
+                    return
+                self.callback(batch)
+            except Exception as e:
+                self.logger.error(f"Event subscriber '{self.name}' failed: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+
+class EventBus:
+    """
+    Coalescing, debounced queue between the file watcher and its consumers.
+
+    Raw watcher events are merged per path until the path has been quiet
+    for ``window`` seconds (or ``max_delay`` has passed since the first
+    event), so a large upload that produces thousands of modify events is
+    delivered as one change. Ready events are handed to every subscriber in
+    batches on the subscriber's own thread.
+    """
+
+    def __init__(self, window: float = 1.0, max_delay: float = 30.0, batch_size: int = 500):
+        """
+        Initialize the EventBus.
+
+        Args:
+            window: Seconds a path must be quiet before its change is dispatched
+            max_delay: Upper bound on how long a busy path's change is held back
+            batch_size: Maximum number of events per subscriber call
+        """
+        self.window = window
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.logger = logging.getLogger(__name__)
+
+        self._pending: 'OrderedDict[str, FileEvent]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._subscribers: List[_Subscriber] = []
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {'received': 0, 'dispatched': 0, 'batches': 0}
+
+    def subscribe(self, name: str, callback: Callable[[List[FileEvent]], None]) -> None:
+        """Register a consumer; it is called with lists of coalesced events."""
+        self._subscribers.append(_Subscriber(name, callback, self.logger))
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="EventBus", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Dispatch whatever is pending and stop the bus and its subscribers."""
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.flush()
+        for subscriber in self._subscribers:
+            subscriber.queue.put(None)
+
+    # ------------------------------------------------------------------
+    # Publishing
+    # ------------------------------------------------------------------
+    def publish(self, action: str, path: str, is_directory: bool = False, dest_path: Optional[str] = None) -> None:
+        """
+        Record a raw watcher event. Cheap enough to call on the observer thread.
+
+        Args:
+            action: 'created', 'modified', 'deleted' or 'moved'
+            path: Path the event refers to (the source path for moves)
+            is_directory: Whether the path is a directory
+            dest_path: New location for 'moved'
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.stats['received'] += 1
+            if action == 'moved':
+                self._merge_move(path, dest_path, is_directory, now)
+            else:
+                self._merge(FileEvent(action, path, is_directory, first_seen=now, last_seen=now))
+
+    def _merge(self, event: FileEvent) -> None:
+        previous = self._pending.pop(event.path, None)
+        if event.action == 'deleted' and event.is_directory:
+            # Changes below a deleted directory are superseded by its deletion
+            prefix = event.path.rstrip(os.sep) + os.sep
+            for path in [p for p in self._pending if p.startswith(prefix)]:
+                del self._pending[path]
+
+        if previous is not None:
+            event.first_seen = previous.first_seen
+            event.count += previous.count
+            action = self._combine(previous, event)
+            if action is None:
+                return
+            if previous.action == 'moved' and action == 'deleted':
+                # Moved and then deleted: to consumers the source simply disappeared
+                event.path, event.src_path = previous.src_path, None
+            elif action == 'moved':
+                event.src_path = previous.src_path
+            event.action = action
+        self._pending[event.path] = event
+
+    @staticmethod
+    def _combine(previous: FileEvent, event: FileEvent) -> Optional[str]:
+        """Action of two consecutive events on one path, or None if they cancel out."""
+        if event.action == 'deleted':
+            return None if previous.action == 'created' else 'deleted'
+        if event.action == 'created':
+            # Deleted and recreated: the path still exists with new content
+            return 'modified' if previous.action == 'deleted' else previous.action
+        # modified after created/modified/moved keeps the earlier, stronger action
+        return previous.action if previous.action in ('created', 'moved') else 'modified'
+
+    def _merge_move(self, src_path: str, dest_path: str, is_directory: bool, now: float) -> None:
+        previous = self._pending.pop(src_path, None)
+        if is_directory:
+            # Pending changes below the old location now live below the new one
+            prefix = src_path.rstrip(os.sep) + os.sep
+            for path in [p for p in self._pending if p.startswith(prefix)]:
+                moved = self._pending.pop(path)
+                moved.path = dest_path.rstrip(os.sep) + os.sep + path[len(prefix):]
+                self._pending[moved.path] = moved
+
+        if previous is not None and previous.action == 'created':
+            # Never seen by consumers at the old location: just created at the new one
+            event = FileEvent('created', dest_path, is_directory, first_seen=previous.first_seen,
+                              last_seen=now, count=previous.count + 1)
+        else:
+            origin = previous.src_path if previous is not None and previous.action == 'moved' else src_path
+            event = FileEvent('moved', dest_path, is_directory, src_path=origin,
+                              first_seen=previous.first_seen if previous else now, last_seen=now,
+                              count=previous.count + 1 if previous else 1)
+        self._pending.pop(dest_path, None)
+        self._pending[dest_path] = event
+
+    # ------------------------------------------------------------------
+    # Dispatching
+    # ------------------------------------------------------------------
+    def _take_ready(self, force: bool = False) -> List[FileEvent]:
+        now = time.monotonic()
+        with self._lock:
+            ready = [
+                path for path, event in self._pending.items()
+                if force or now - event.last_seen >= self.window or now - event.first_seen >= self.max_delay
+            ]
+            return [self._pending.pop(path) for path in ready]
+
+    def _dispatch(self, events: List[FileEvent]) -> None:
+        for i in range(0, len(events), self.batch_size):
+            batch = events[i:i + self.batch_size]
+            for subscriber in self._subscribers:
+                subscriber.queue.put(batch)
+            self.stats['batches'] += 1
+        self.stats['dispatched'] += len(events)
+
+    def _run(self) -> None:
+        while self._running:
+            self._wakeup.wait(self.window / 2)
+            self._wakeup.clear()
+            events = self._take_ready()
+            if events:
+                self._dispatch(events)
+
+    def flush(self, wait: bool = True) -> None:
+        """Dispatch all pending events now, optionally waiting until subscribers processed them."""
+        events = self._take_ready(force=True)
+        if events:
+            self._dispatch(events)
+        if wait:
+            for subscriber in self._subscribers:
+                subscriber.queue.join()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
@@ -0,0 +1,226 @@
+import os
+import time
+import logging
+import threading
+from functools import cached_property
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+from utils.lazy_import import lazy_import
+from utils import wire, peer_auth
+
+requests = lazy_import('requests')
+
+LIST_PATH = '/api/peer/list'
+SEARCH_PATH = '/api/peer/search'
+# Peer responses kept in the cache at most
+CACHE_ENTRIES = 512
+# Seconds to wait for the TCP connection to a peer
+CONNECT_TIMEOUT = 1.0
+# A request that misses the fan-out deadline keeps running this long, so its answer can fill the cache
+LATE_ANSWER_TIMEOUT = 15.0
+
+
+class FederatedBrowser:
+    """
+    Directory listings and searches across all online peers at once.
+
+    A query is sent to every peer in parallel over one pooled keep-alive
+    session and the answers are yielded in the order they arrive, so the
+    caller can stream them; the whole query takes as long as the slowest
+    peer that answers within the deadline. Peers that miss the deadline or
+    fail are reported as such. Their request keeps running in the
+    background and a late answer still lands in the short-lived response
+    cache, so the next query gets it immediately.
+    """
+
+    def __init__(self, base_path: str, get_peers: Callable[[], Iterable[Tuple[str, str]]],
+                 timeout: float = 3.0, cache_ttl: float = 10.0, max_workers: int = 16):
+        """
+        Initialize the FederatedBrowser.
+
+        Args:
+            base_path: Shared root; listed paths are relative to it
+            get_peers: Returns (device id, base URL) of every peer to ask
+            timeout: Deadline in seconds for a whole fan-out
+            cache_ttl: Seconds a peer's answer is reused for the same query
+            max_workers: Peer requests in flight at once
+        """
+        self.base_path = os.path.abspath(base_path)
+        self.get_peers = get_peers
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.max_workers = max_workers
+        self.logger = logging.getLogger(__name__)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='Federated')
+        self._cache: 'OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._in_flight: Dict[Tuple, Any] = {}  # cache key -> future, one request per peer and query
+        self._peer_stats: Dict[str, Dict[str, Any]] = {}
+        self.stats = {'queries': 0, 'peer_requests': 0, 'cache_hits': 0, 'timeouts': 0, 'errors': 0}
+
+    @cached_property
+    def session(self):
+        """Pooled HTTP session, created with the first fan-out."""
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.headers.update(peer_auth.headers())
+        adapter = HTTPAdapter(pool_connections=max(self.max_workers, 10), pool_maxsize=self.max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    # ------------------------------------------------------------------
+    # Local side (served to peers)
+    # ------------------------------------------------------------------
+    def resolve(self, rel_path: str) -> str:
+        """Absolute path of a shared directory; raises ValueError if it escapes the shared root."""
+        rel_path = rel_path.replace('\\', '/').strip('/')
+        path = os.path.abspath(os.path.join(self.base_path, rel_path))
+        if path != self.base_path and not path.startswith(self.base_path + os.sep):
+            raise ValueError('Path escapes the shared folder')
+        return path
+
+    def list_local(self, rel_path: str = '') -> List[Dict[str, Any]]:
+        """
+        Entries of a shared directory, ordered by name.
+
+        Raises:
+            ValueError: the path escapes the shared folder
+            FileNotFoundError: the path is not a directory
+        """
+        path = self.resolve(rel_path)
+        if not os.path.isdir(path):
+            raise FileNotFoundError(rel_path)
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                    st = entry.stat()
+                except OSError:
+                    continue  # removed while listing
+                entries.append({'name': entry.name, 'is_dir': is_dir,
+                                'size': 0 if is_dir else st.st_size, 'mtime': st.st_mtime})
+        entries.sort(key=lambda e: (not e['is_dir'], e['name'].lower()))
+        return entries
+
+    # ------------------------------------------------------------------
+    # Fan-out
+    # ------------------------------------------------------------------
+    def _cache_get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is None:
+                return None
+            if cached[0] < time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return cached[1]
+
+    def _cache_put(self, key: Tuple, payload: Dict[str, Any]) -> None:
+        with self._cache_lock:
+            self._cache[key] = (time.monotonic() + self.cache_ttl, payload)
+            self._cache.move_to_end(key)
+            while len(self._cache) > CACHE_ENTRIES:
+                self._cache.popitem(last=False)
+
+    def _ask(self, device_id: str, url: str, params: Dict[str, Any], key: Tuple) -> Dict[str, Any]:
+        started = time.monotonic()
+        self.stats['peer_requests'] += 1
+        try:
+            response = self.session.get(url, params=params, headers=wire.client_headers(),
+                                        timeout=(CONNECT_TIMEOUT, max(self.timeout, LATE_ANSWER_TIMEOUT)))
+            if response.status_code == 404:
+                payload = {'status': 'not_found'}
+            else:
+                response.raise_for_status()
+                data = wire.decode_response(response)
+                payload = {'status': 'ok', 'entries': data.get('entries', data.get('results', []))}
+            self._cache_put(key, payload)
+        except (requests.RequestException, ValueError) as e:
+            self.stats['errors'] += 1
+            payload = {'status': 'error', 'error': str(e)}
+        finally:
+            with self._cache_lock:
+                self._in_flight.pop(key, None)
+        elapsed = time.monotonic() - started
+        self._peer_stats[device_id] = {'status': payload['status'], 'took_ms': round(elapsed * 1000, 1),
+                                       'at': time.time(), 'error': payload.get('error')}
+        return {**payload, 'took_ms': round(elapsed * 1000, 1)}
+
+    def fan_out(self, endpoint: str, params: Dict[str, Any], path: str = '',
+                timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Send one query to every peer; the returned iterator yields each answer as it arrives.
+
+        The requests go out immediately, so the caller can do its own work
+        (e.g. the local listing) before it starts iterating.
+
+        Args:
+            endpoint: LIST_PATH or SEARCH_PATH
+            params: Query string for the peers
+            path: Appended to the endpoint (URL-quoted)
+            timeout: Deadline for the whole fan-out; defaults to the configured one
+
+        Returns:
+            Iterator of one dict per peer: device, status ('ok', 'not_found',
+            'error' or 'timeout'), cached, took_ms and, when ok, entries
+        """
+        deadline = timeout if timeout is not None else self.timeout
+        self.stats['queries'] += 1
+        suffix = quote(path.strip('/')) if path else ''
+        frozen = tuple(sorted((k, str(v)) for k, v in params.items()))
+
+        cached_answers = []
+        futures = {}
+        for device_id, base_url in self.get_peers():
+            url = f"{base_url.rstrip('/')}{endpoint}" + (f"/{suffix}" if suffix else '')
+            key = (url, frozen)
+            cached = self._cache_get(key)
+            if cached is not None:
+                self.stats['cache_hits'] += 1
+                cached_answers.append({'device': device_id, 'cached': True, 'took_ms': 0.0, **cached})
+                continue
+            with self._cache_lock:
+                # A slow peer still working on the same query is not asked again
+                future = self._in_flight.get(key)
+                if future is None:
+                    future = self._in_flight[key] = self._executor.submit(self._ask, device_id, url, params, key)
+            futures[future] = device_id
+        return self._collect(cached_answers, futures, time.monotonic() + deadline, deadline)
+
+    def _collect(self, cached_answers: List[Dict[str, Any]], futures: Dict[Any, str],
+                 deadline_at: float, deadline: float) -> Iterator[Dict[str, Any]]:
+        yield from cached_answers
+        try:
+            for future in as_completed(futures, timeout=max(0.0, deadline_at - time.monotonic())):
+                device_id = futures.pop(future)
+                yield {'device': device_id, 'cached': False, **future.result()}
+        except FuturesTimeout:
+            pass
+        for device_id in futures.values():
+            # Still running; a late answer is cached for the next query
+            self.stats['timeouts'] += 1
+            self._peer_stats[device_id] = {'status': 'timeout', 'took_ms': None, 'at': time.time(), 'error': None}
+            yield {'device': device_id, 'cached': False, 'status': 'timeout', 'took_ms': round(deadline * 1000, 1)}
+
+    def list(self, path: str = '', timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """Every peer's listing of ``path``, as each arrives."""
+        return self.fan_out(LIST_PATH, {}, path=path, timeout=timeout)
+
+    def search(self, params: Dict[str, Any], timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """Every peer's search results for the same query parameters, as each arrives."""
+        return self.fan_out(SEARCH_PATH, params, timeout=timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cache_lock:
+            cached = len(self._cache)
+        return {**self.stats, 'cached_responses': cached, 'peers': dict(self._peer_stats)}
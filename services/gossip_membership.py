@@ -0,0 +1,433 @@
+import math
+import time
+import random
+import logging
+import threading
+from functools import cached_property
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from utils.lazy_import import lazy_import
+from utils import wire, peer_auth
+
+requests = lazy_import('requests')
+
+PING_PATH = '/api/peer/gossip/ping'
+PING_REQ_PATH = '/api/peer/gossip/ping-req'
+
+ALIVE = 'alive'
+SUSPECT = 'suspect'
+DEAD = 'dead'
+
+# Membership updates carried by one message at most, whatever the cluster size
+MAX_PIGGYBACK = 16
+# Seconds a dead member is remembered, so stale gossip cannot bring it back
+DEAD_RETENTION = 300
+# Seconds between join attempts towards seeds that are not members yet
+JOIN_INTERVAL = 30
+
+
+class _Member:
+    """What this node believes about one other node."""
+
+    def __init__(self, member_id: str, addr: str, incarnation: int, state: str = ALIVE):
+        self.id = member_id
+        self.addr = addr  # host:port
+        self.incarnation = incarnation
+        self.state = state
+        self.changed = time.monotonic()
+        self.last_contact: Optional[float] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.addr}"
+
+    def to_update(self) -> Dict[str, Any]:
+        return {'id': self.id, 'addr': self.addr, 'incarnation': self.incarnation, 'state': self.state}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **self.to_update(),
+            'since': round(time.monotonic() - self.changed, 1),
+            'last_contact': self.last_contact
+        }
+
+
+class GossipMembership:
+    """
+    SWIM-style membership among peers, over the peer HTTP API.
+
+    Every protocol period the node pings one member, going round-robin
+    through a shuffled list. If the ping is not answered in time, a few
+    other members are asked to ping it on our behalf (indirect probes), so
+    one bad link does not get a node declared failed. A member nobody
+    could reach becomes suspect; it can refute that by raising its
+    incarnation number, otherwise it is declared dead after a timeout that
+    grows with log(cluster size).
+
+    Membership changes travel piggybacked on the pings and acks, a
+    bounded number per message, and each one is retransmitted about
+    log(cluster size) times. Each node therefore sends one ping per period
+    and messages of bounded size, however large the cluster is.
+    """
+
+    def __init__(self, node_id: str, port: int, get_seeds: Optional[Callable[[], Iterable[str]]] = None,
+                 interval: float = 1.0, ping_timeout: float = 0.5, indirect_probes: int = 3,
+                 suspect_mult: int = 4, retransmit_mult: int = 3,
+                 on_change: Optional[Callable[[_Member], None]] = None,
+                 on_contact: Optional[Callable[[_Member], None]] = None):
+        """
+        Initialize the GossipMembership.
+
+        Args:
+            node_id: Identifier of this node, unique in the cluster
+            port: Port this node's peer API listens on
+            get_seeds: Returns host:port addresses to join through (configured seeds, mDNS finds)
+            interval: Protocol period in seconds
+            ping_timeout: Seconds to wait for a direct ack before probing indirectly
+            indirect_probes: Members asked to probe an unresponsive member
+            suspect_mult: Suspicion lasts suspect_mult * log2(cluster size) periods before a member is dead
+            retransmit_mult: Each update is piggybacked retransmit_mult * log2(cluster size) times
+            on_change: Called with a member whenever its state changes (alive, suspect, dead)
+            on_contact: Called with a member whenever it answered us or sent us a message
+        """
+        self.node_id = node_id
+        self.port = port
+        self.get_seeds = get_seeds
+        self.interval = interval
+        self.ping_timeout = ping_timeout
+        self.indirect_probes = indirect_probes
+        self.suspect_mult = suspect_mult
+        self.retransmit_mult = retransmit_mult
+        self.on_change = on_change
+        self.on_contact = on_contact
+        self.logger = logging.getLogger(__name__)
+
+        # A restarted node starts above any incarnation it had before, so its old death is overridden
+        self.incarnation = int(time.time())
+        self._lock = threading.Lock()
+        self._members: Dict[str, _Member] = {}
+        self._updates: Dict[str, List[Any]] = {}  # member id -> [update, times sent]
+        self._probe_order: List[str] = []
+        self._joined_at: Dict[str, float] = {}  # seed address -> last join attempt
+        self._executor = ThreadPoolExecutor(max_workers=max(indirect_probes, 1) + 2, thread_name_prefix='Gossip')
+        self._running = False
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {'periods': 0, 'pings_sent': 0, 'ping_reqs_sent': 0, 'messages_received': 0,
+                      'indirect_acks': 0, 'suspicions': 0, 'refutations': 0, 'deaths': 0}
+
+    @cached_property
+    def session(self):
+        """Pooled HTTP session, created with the first message."""
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.headers.update(peer_auth.headers())
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=self.indirect_probes + 2)
+        session.mount('http://', adapter)
+        return session
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="GossipMembership", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+        self._wakeup.set()
+        self._executor.shutdown(wait=False)
+
+    # ------------------------------------------------------------------
+    # Membership state (caller holds the lock)
+    # ------------------------------------------------------------------
+    def _cluster_log(self) -> int:
+        return max(1, math.ceil(math.log2(len(self._members) + 2)))
+
+    def _enqueue(self, update: Dict[str, Any]) -> None:
+        self._updates[update['id']] = [update, 0]
+
+    def _piggyback(self) -> List[Dict[str, Any]]:
+        """The least-sent pending updates; each is dropped after enough retransmissions."""
+        limit = self.retransmit_mult * self._cluster_log()
+        chosen = sorted(self._updates.items(), key=lambda item: item[1][1])[:MAX_PIGGYBACK]
+        updates = []
+        for member_id, entry in chosen:
+            updates.append(entry[0])
+            entry[1] += 1
+            if entry[1] >= limit:
+                del self._updates[member_id]
+        return updates
+
+    def _self_update(self) -> Dict[str, Any]:
+        return {'id': self.node_id, 'addr': None, 'incarnation': self.incarnation, 'state': ALIVE}
+
+    def _apply(self, update: Dict[str, Any], changed: List[_Member]) -> None:
+        """Merge one update by SWIM precedence; members whose state changed are appended to ``changed``."""
+        try:
+            member_id = str(update['id'])
+            incarnation = int(update['incarnation'])
+            state = update['state']
+        except (KeyError, TypeError, ValueError):
+            return
+        if state not in (ALIVE, SUSPECT, DEAD):
+            return
+        if member_id == self.node_id:
+            if state != ALIVE and incarnation >= self.incarnation:
+                # Someone suspects us: refute with a higher incarnation
+                self.incarnation = incarnation + 1
+                self.stats['refutations'] += 1
+                self._enqueue(self._self_update())
+            return
+
+        member = self._members.get(member_id)
+        addr = update.get('addr')
+        if member is None:
+            if state == DEAD or not addr:
+                return
+            member = self._members[member_id] = _Member(member_id, addr, incarnation, state)
+            self._enqueue(member.to_update())
+            changed.append(member)
+            return
+
+        if member.state == DEAD:
+            override = state == ALIVE and incarnation > member.incarnation
+        elif state == ALIVE:
+            override = incarnation > member.incarnation
+        elif state == SUSPECT:
+            override = incarnation > member.incarnation or (incarnation == member.incarnation and member.state == ALIVE)
+        else:
+            override = True
+        if not override:
+            return
+        state_changed = state != member.state
+        member.incarnation = incarnation
+        member.state = state
+        if addr:
+            member.addr = addr
+        self._enqueue(member.to_update())
+        if state_changed:
+            member.changed = time.monotonic()
+            changed.append(member)
+
+    def _notify(self, changed: List[_Member], contacted: Optional[_Member] = None) -> None:
+        """Run the callbacks outside the lock."""
+        for member in changed:
+            self.logger.info(f"Member {member.id} ({member.addr}) is {member.state}")
+            if member.state == DEAD:
+                self.stats['deaths'] += 1
+            if self.on_change:
+                try:
+                    self.on_change(member)
+                except Exception as e:
+                    self.logger.error(f"Membership change callback failed: {e}", exc_info=True)
+        if contacted is not None and self.on_contact:
+            try:
+                self.on_contact(contacted)
+            except Exception as e:
+                self.logger.error(f"Membership contact callback failed: {e}", exc_info=True)
+
+    # ------------------------------------------------------------------
+    # Messages
+    # ------------------------------------------------------------------
+    def _message(self, **extra: Any) -> Dict[str, Any]:
+        with self._lock:
+            return {'from': self.node_id, 'port': self.port, 'incarnation': self.incarnation,
+                    'updates': self._piggyback(), **extra}
+
+    def _receive(self, message: Dict[str, Any], host: str) -> Optional[_Member]:
+        """Merge the sender's own state and its piggybacked updates; returns the sender."""
+        self.stats['messages_received'] += 1
+        changed: List[_Member] = []
+        sender = None
+        with self._lock:
+            sender_id = message.get('from')
+            if sender_id and sender_id != self.node_id and message.get('port'):
+                self._apply({'id': sender_id, 'addr': f"{host}:{message['port']}",
+                             'incarnation': message.get('incarnation', 0), 'state': ALIVE}, changed)
+                sender = self._members.get(sender_id)
+                if sender is not None and sender.state == ALIVE:
+                    sender.last_contact = time.time()
+            for update in message.get('updates') or []:
+                if isinstance(update, dict):
+                    self._apply(update, changed)
+            for update in message.get('members') or []:
+                if isinstance(update, dict):
+                    self._apply(update, changed)
+        self._notify(changed, sender)
+        return sender
+
+    def _send(self, addr: str, path: str, message: Dict[str, Any], timeout: float) -> Optional[Dict[str, Any]]:
+        url = f"http://{addr}{path}"
+        try:
+            body, headers = wire.encode_request(message, url)
+            response = self.session.post(url, data=body, headers=headers, timeout=timeout)
+            response.raise_for_status()
+            answer = wire.decode_response(response)
+        except (requests.RequestException, ValueError) as e:
+            self.logger.debug(f"Gossip message to {addr} failed: {e}")
+            return None
+        return answer if isinstance(answer, dict) else None
+
+    def _ping(self, addr: str, timeout: float) -> bool:
+        self.stats['pings_sent'] += 1
+        ack = self._send(addr, PING_PATH, self._message(), timeout)
+        if ack is None:
+            return False
+        self._receive(ack, addr.rpartition(':')[0])
+        return True
+
+    def _ping_req(self, helper: _Member, target: _Member, timeout: float) -> bool:
+        self.stats['ping_reqs_sent'] += 1
+        answer = self._send(helper.addr, PING_REQ_PATH,
+                            self._message(target={'id': target.id, 'addr': target.addr}), timeout)
+        if answer is None:
+            return False
+        self._receive(answer, helper.addr.rpartition(':')[0])
+        return bool(answer.get('ack'))
+
+    def handle_ping(self, message: Dict[str, Any], remote_addr: str) -> Dict[str, Any]:
+        """Answer a ping (or a join) from another node with our ack."""
+        self._receive(message, remote_addr)
+        if message.get('join'):
+            with self._lock:
+                members = [m.to_update() for m in self._members.values() if m.state != DEAD]
+            return self._message(members=members)
+        return self._message()
+
+    def handle_ping_req(self, message: Dict[str, Any], remote_addr: str) -> Dict[str, Any]:
+        """Ping a member on behalf of the sender, whose direct ping went unanswered."""
+        self._receive(message, remote_addr)
+        target = message.get('target') or {}
+        ack = bool(target.get('addr')) and target.get('id') != self.node_id and \
+            self._ping(str(target['addr']), self.ping_timeout)
+        return self._message(ack=ack)
+
+    def merge(self, updates: Iterable[Dict[str, Any]]) -> None:
+        """Merge updates piggybacked on other peer traffic (e.g. change notifications)."""
+        changed: List[_Member] = []
+        with self._lock:
+            for update in updates:
+                if isinstance(update, dict):
+                    self._apply(update, changed)
+        self._notify(changed)
+
+    def piggyback(self) -> List[Dict[str, Any]]:
+        """Pending updates to attach to other peer traffic."""
+        with self._lock:
+            return self._piggyback()
+
+    def join(self, addr: str) -> bool:
+        """Ask a node at host:port for the member list; True if it answered."""
+        ack = self._send(addr, PING_PATH, self._message(join=True), self.ping_timeout * 4)
+        if ack is None:
+            return False
+        self._receive(ack, addr.rpartition(':')[0])
+        return True
+
+    # ------------------------------------------------------------------
+    # Protocol period
+    # ------------------------------------------------------------------
+    def _run(self) -> None:
+        while self._running:
+            started = time.monotonic()
+            try:
+                self._join_seeds()
+                self._probe_next(started + self.interval)
+                self._expire()
+            except Exception as e:
+                self.logger.error(f"Gossip period failed: {e}", exc_info=True)
+            self.stats['periods'] += 1
+            if self._wakeup.wait(max(0.0, started + self.interval - time.monotonic())):
+                break
+
+    def _join_seeds(self) -> None:
+        if not self.get_seeds:
+            return
+        now = time.monotonic()
+        with self._lock:
+            known = {m.addr for m in self._members.values() if m.state != DEAD}
+        for addr in self.get_seeds():
+            if addr in known or now - self._joined_at.get(addr, float('-inf')) < JOIN_INTERVAL:
+                continue
+            self._joined_at[addr] = now
+            self._executor.submit(self.join, addr)
+
+    def _next_target(self) -> Optional[_Member]:
+        with self._lock:
+            while True:
+                if not self._probe_order:
+                    self._probe_order = [m.id for m in self._members.values() if m.state != DEAD]
+                    random.shuffle(self._probe_order)
+                    if not self._probe_order:
+                        return None
+                member = self._members.get(self._probe_order.pop())
+                if member is not None and member.state != DEAD:
+                    return member
+
+    def _probe_next(self, period_end: float) -> None:
+        target = self._next_target()
+        if target is None or self._ping(target.addr, self.ping_timeout):
+            return
+
+        with self._lock:
+            helpers = [m for m in self._members.values() if m.state == ALIVE and m.id != target.id]
+        helpers = random.sample(helpers, min(self.indirect_probes, len(helpers)))
+        remaining = max(0.05, period_end - time.monotonic())
+        acked = False
+        if helpers:
+            futures = [self._executor.submit(self._ping_req, helper, target, remaining) for helper in helpers]
+            try:
+                for future in as_completed(futures, timeout=remaining):
+                    if future.result():
+                        acked = True
+                        self.stats['indirect_acks'] += 1
+                        break
+            except FuturesTimeout:
+                pass
+        if acked:
+            return
+
+        changed: List[_Member] = []
+        with self._lock:
+            if target.state == ALIVE:
+                self.stats['suspicions'] += 1
+                self._apply({**target.to_update(), 'state': SUSPECT}, changed)
+        self._notify(changed)
+
+    def _expire(self) -> None:
+        """Declare long-suspected members dead and forget long-dead ones."""
+        now = time.monotonic()
+        changed: List[_Member] = []
+        with self._lock:
+            timeout = self.suspect_mult * self._cluster_log() * self.interval
+            for member in list(self._members.values()):
+                if member.state == SUSPECT and now - member.changed > timeout:
+                    self._apply({**member.to_update(), 'state': DEAD}, changed)
+                elif member.state == DEAD and now - member.changed > DEAD_RETENTION:
+                    del self._members[member.id]
+                    self._updates.pop(member.id, None)
+        self._notify(changed)
+
+    # ------------------------------------------------------------------
+    # Readers
+    # ------------------------------------------------------------------
+    def members(self, state: Optional[str] = None) -> List[_Member]:
+        with self._lock:
+            return [m for m in self._members.values() if state is None or m.state == state]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            members = sorted((m.to_dict() for m in self._members.values()), key=lambda m: m['id'])
+            pending = len(self._updates)
+        periods = self.stats['periods'] or 1
+        return {
+            'node_id': self.node_id,
+            'incarnation': self.incarnation,
+            'running': self._running,
+            **self.stats,
+            'sent_per_period': round((self.stats['pings_sent'] + self.stats['ping_reqs_sent']) / periods, 2),
+            'pending_updates': pending,
+            'members': members
+        }
@@ -0,0 +1,60 @@
+import bisect
+import hashlib
+from typing import Dict, List, Mapping
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring with weighted nodes.
+
+    Every node owns ``weight`` points (virtual nodes) on a 64-bit ring; a
+    key belongs to the nodes owning the first points clockwise from its
+    hash. Point ``i`` of a node is always at the same place, so adding a
+    node, removing one or changing a weight only moves the keys next to
+    the points that appeared or disappeared: about 1/N of all keys when an
+    equal node joins a cluster of N-1. Instances are immutable.
+    """
+
+    def __init__(self, weights: Mapping[str, int]):
+        """
+        Args:
+            weights: Node id -> number of virtual nodes (nodes with 0 are left out)
+        """
+        self.weights = {node: int(weight) for node, weight in weights.items() if weight > 0}
+        points = sorted((_hash(f"{node}#{i}"), node) for node, weight in self.weights.items() for i in range(weight))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    def __contains__(self, node: str) -> bool:
+        return node in self.weights
+
+    def nodes_for(self, key: str, count: int = 1) -> List[str]:
+        """The ``count`` distinct nodes responsible for ``key``, primary first."""
+        if not self._hashes:
+            return []
+        count = min(count, len(self.weights))
+        start = bisect.bisect(self._hashes, _hash(key))
+        nodes: List[str] = []
+        for i in range(len(self._hashes)):
+            node = self._owners[(start + i) % len(self._hashes)]
+            if node not in nodes:
+                nodes.append(node)
+                if len(nodes) == count:
+                    break
+        return nodes
+
+    def shares(self) -> Dict[str, float]:
+        """Fraction of the key space for which each node is the primary."""
+        shares = dict.fromkeys(self.weights, 0.0)
+        size = 2 ** 64
+        for i, point in enumerate(self._hashes):
+            previous = self._hashes[i - 1] if i else self._hashes[-1] - size
+            shares[self._owners[i]] += (point - previous) / size
+        return shares
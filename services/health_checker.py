@@ -0,0 +1,235 @@
+import time
+import heapq
+import random
+import logging
+import threading
+from functools import cached_property
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.lazy_import import lazy_import
+
+requests = lazy_import('requests')
+
+# Healthy targets are probed every interval * uniform(1 - JITTER, 1 + JITTER)
+JITTER = 0.1
+
+
+class _Target:
+    """One probed endpoint and the outcome of its latest checks."""
+
+    def __init__(self, name: str, url: str, interval: float):
+        self.name = name
+        self.url = url
+        self.interval = interval
+        self.healthy: Optional[bool] = None  # None until the first probe finished
+        self.failures = 0  # consecutive
+        self.checks = 0
+        self.latency: Optional[float] = None
+        self.last_checked: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.next_due = 0.0
+        self.checked = threading.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'url': self.url,
+            'healthy': self.healthy,
+            'failures': self.failures,
+            'checks': self.checks,
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'last_checked': self.last_checked,
+            'next_check_in': max(0.0, self.next_due - time.monotonic()),
+            'last_error': self.last_error
+        }
+
+
+class HealthChecker:
+    """
+    Background health probes of remote endpoints (RAR processor, relays).
+
+    Every target is probed on its own interval by one scheduler thread
+    over a pooled keep-alive session. A failing target is probed again
+    after exponentially growing, jittered delays, so a dead endpoint costs
+    little and many targets do not probe in lockstep. The latest result
+    of every target is published as an immutable mapping; request paths
+    read it without locks or network calls.
+    """
+
+    def __init__(self, timeout: float = 2.0, max_backoff: float = 300.0, max_workers: int = 4,
+                 on_change: Optional[Callable[[str, bool], None]] = None):
+        """
+        Initialize the HealthChecker.
+
+        Args:
+            timeout: Timeout of each probe in seconds
+            max_backoff: Longest delay in seconds between probes of a failing target
+            max_workers: Probes running at once
+            on_change: Called with (name, healthy) whenever a target's state changes
+        """
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.max_workers = max_workers
+        self.on_change = on_change
+        self.logger = logging.getLogger(__name__)
+
+        self._targets: Dict[str, _Target] = {}
+        self._health: MappingProxyType = MappingProxyType({})  # name -> healthy, replaced on every change
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='HealthProbe')
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    @cached_property
+    def session(self):
+        """Pooled HTTP session, created with the first probe."""
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=self.max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def start(self) -> None:
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="HealthChecker", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._executor.shutdown(wait=False)
+
+    # ------------------------------------------------------------------
+    # Targets
+    # ------------------------------------------------------------------
+    def register(self, name: str, url: str, interval: float = 30.0) -> None:
+        """
+        Probe ``url`` every ``interval`` seconds, starting now; re-registering only updates the interval.
+
+        The checker starts on the first registration. A target counts as
+        healthy when its URL answers with a 2xx status.
+        """
+        with self._cond:
+            target = self._targets.get(name)
+            if target is not None and target.url == url:
+                target.interval = interval
+                return
+            self._targets[name] = _Target(name, url, interval)
+            self._push(name, time.monotonic())
+        self.start()
+
+    def unregister(self, name: str) -> None:
+        with self._cond:
+            if self._targets.pop(name, None) is not None:
+                self._publish()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._targets
+
+    def _push(self, name: str, due: float) -> None:
+        """Caller holds the lock."""
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, name))
+        self._targets[name].next_due = due
+        self._cond.notify()
+
+    def _publish(self) -> None:
+        """Caller holds the lock."""
+        self._health = MappingProxyType({name: target.healthy for name, target in self._targets.items()})
+
+    # ------------------------------------------------------------------
+    # Probing
+    # ------------------------------------------------------------------
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._running and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                if not self._running:
+                    return
+                due, _, name = heapq.heappop(self._heap)
+                target = self._targets.get(name)
+                if target is None or target.next_due != due:
+                    continue  # unregistered or replaced since it was scheduled
+            try:
+                self._executor.submit(self._probe, target)
+            except RuntimeError:
+                return  # executor shut down
+
+    def _probe(self, target: _Target) -> None:
+        started = time.monotonic()
+        error = None
+        try:
+            response = self.session.get(target.url, timeout=self.timeout)
+            response.content  # read the body so the connection goes back to the pool
+            if not 200 <= response.status_code < 300:
+                error = f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            error = str(e)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finished = time.monotonic()
+
+        with self._cond:
+            if self._targets.get(target.name) is not target:
+                return
+            was_healthy = target.healthy
+            target.healthy = error is None
+            target.checks += 1
+            target.latency = finished - started
+            target.last_checked = time.time()
+            target.last_error = error
+            if error is None:
+                target.failures = 0
+                delay = target.interval * random.uniform(1 - JITTER, 1 + JITTER)
+            else:
+                target.failures += 1
+                delay = min(self.max_backoff, target.interval * 2 ** (target.failures - 1))
+                delay *= random.uniform(0.5, 1.0)
+            self._push(target.name, finished + delay)
+            changed = was_healthy != target.healthy
+            if changed:
+                self._publish()
+        target.checked.set()
+
+        if changed:
+            if error is None:
+                self.logger.info(f"{target.name} is healthy")
+            else:
+                self.logger.warning(f"{target.name} is unavailable: {error}")
+            if self.on_change:
+                try:
+                    self.on_change(target.name, target.healthy)
+                except Exception as e:
+                    self.logger.error(f"Health change callback failed: {e}", exc_info=True)
+
+    # ------------------------------------------------------------------
+    # Readers
+    # ------------------------------------------------------------------
+    def is_healthy(self, name: str, wait: float = 0) -> bool:
+        """
+        Result of the latest probe of ``name``; False if unknown or not probed yet.
+
+        Args:
+            wait: Seconds to wait for the first probe of a new target (for one-off CLI calls)
+        """
+        healthy = self._health.get(name)
+        if healthy is None and wait:
+            target = self._targets.get(name)
+            if target is not None and target.checked.wait(wait):
+                healthy = self._health.get(name)
+        return bool(healthy)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            targets = [target.to_dict() for target in self._targets.values()]
+        return {'running': self._running, 'targets': targets}
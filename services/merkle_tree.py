@@ -0,0 +1,245 @@
+import time
+import hashlib
+import logging
+import threading
+from functools import cached_property
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from utils.lazy_import import lazy_import
+from utils import wire, peer_auth
+
+requests = lazy_import('requests')
+
+MERKLE_PATH = '/api/peer/merkle'
+# Directories requested from the peer per comparison round trip
+COMPARE_BATCH = 200
+# Differences listed per category before a comparison stops descending
+MAX_DIFFERENCES = 1000
+
+
+def _encode(name: str) -> bytes:
+    return name.encode('utf-8', 'surrogatepass')
+
+
+class MerkleTree:
+    """
+    Merkle digests of the shared tree, one per directory.
+
+    A directory's digest hashes its children in name order: each file's
+    name, size and (optionally) mtime in whole seconds, and each
+    subdirectory's name and digest. Equal digests therefore mean equal
+    subtrees, and two devices can compare their roots and descend only
+    into directories that differ. Digests come from the path index and are
+    cached; a change only invalidates the directories between it and the
+    root, which are recomputed on the next query.
+    """
+
+    def __init__(self, path_index, use_mtime: bool = True, timeout: float = 10.0):
+        """
+        Initialize the MerkleTree.
+
+        Args:
+            path_index: PathIndex the digests are computed from
+            use_mtime: Include file mtimes; when off only names and sizes are compared
+            timeout: Timeout for peer requests in seconds
+        """
+        self.path_index = path_index
+        self.use_mtime = use_mtime
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__)
+
+        self._nodes: Dict[str, Tuple[bytes, int, int]] = {}  # directory -> (digest, files, bytes)
+        self._compute_lock = threading.Lock()
+        self._invalid: Set[Tuple[str, str]] = set()  # (kind, path) not yet applied to _nodes
+        self._lock = threading.Lock()
+        path_index.add_listener(self._on_index_change)
+
+    def _on_index_change(self, kind: str, rel_path: str) -> None:
+        with self._lock:
+            self._invalid.add((kind, rel_path))
+        if kind == 'crawl' and not rel_path:
+            # Rebuild after a full crawl in the background, so the next comparison is instant
+            threading.Thread(target=self.root, name="MerkleWarmup", daemon=True).start()
+
+    def _apply_invalidations(self) -> None:
+        """Drop cached digests made stale by index changes; caller holds the compute lock."""
+        with self._lock:
+            invalid, self._invalid = self._invalid, set()
+        subtrees = []
+        for kind, path in invalid:
+            if kind == 'crawl':
+                if not path:
+                    self._nodes.clear()
+                    return
+                subtrees.append(path + '/')
+            # Removed directories may leave entries behind; nothing refers to them until the
+            # path reappears, and then it is invalidated again by its own update or crawl
+            self._nodes.pop(path, None)
+            while path:
+                path = path.rpartition('/')[0]
+                self._nodes.pop(path, None)
+        if subtrees:
+            prefixes = tuple(subtrees)
+            for path in [p for p in self._nodes if p.startswith(prefixes)]:
+                del self._nodes[path]
+
+    # ------------------------------------------------------------------
+    # Digests
+    # ------------------------------------------------------------------
+    def _file_leaf(self, name: str, size: int, mtime: float) -> bytes:
+        return b'f\0%s\0%d\0%d\n' % (_encode(name), size, int(mtime) if self.use_mtime else 0)
+
+    @staticmethod
+    def _dir_leaf(name: str, digest: bytes) -> bytes:
+        return b'd\0%s\0%s\n' % (_encode(name), digest)
+
+    def _compute(self, path: str) -> Tuple[bytes, int, int]:
+        node = self._nodes.get(path)
+        if node is not None:
+            return node
+        prefix = f"{path}/" if path else ''
+        digest = hashlib.blake2b(digest_size=16)
+        files = total = 0
+        for row in self.path_index.children(path):
+            if row['is_dir']:
+                child_digest, child_files, child_bytes = self._compute(prefix + row['name'])
+                digest.update(self._dir_leaf(row['name'], child_digest))
+                files += child_files
+                total += child_bytes
+            else:
+                digest.update(self._file_leaf(row['name'], row['size'], row['mtime']))
+                files += 1
+                total += row['size']
+        node = (digest.digest(), files, total)
+        self._nodes[path] = node
+        return node
+
+    def _node(self, path: str, children: bool) -> Optional[Dict[str, Any]]:
+        if path:
+            entry = self.path_index.get(path)
+            if entry is None or not entry['is_dir']:
+                return None
+        digest, files, total = self._compute(path)
+        node = {'path': path, 'digest': digest.hex(), 'files': files, 'size': total}
+        if children:
+            prefix = f"{path}/" if path else ''
+            node['children'] = []
+            for row in self.path_index.children(path):
+                if row['is_dir']:
+                    child_digest, child_files, child_bytes = self._compute(prefix + row['name'])
+                    node['children'].append({'name': row['name'], 'is_dir': True, 'digest': child_digest.hex(),
+                                             'files': child_files, 'size': child_bytes})
+                else:
+                    leaf = self._file_leaf(row['name'], row['size'], row['mtime'])
+                    node['children'].append({'name': row['name'], 'is_dir': False,
+                                             'digest': hashlib.blake2b(leaf, digest_size=16).hexdigest(),
+                                             'size': row['size'], 'mtime': row['mtime']})
+        return node
+
+    def nodes(self, paths: List[str], children: bool = True) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Digests of several directories.
+
+        Args:
+            paths: Directories relative to the shared root ('' is the root)
+            children: Also list each directory's children with their digests
+
+        Returns:
+            Node per path; None for paths that are not indexed directories
+        """
+        with self._compute_lock:
+            self._apply_invalidations()
+            return {path: self._node(path.strip('/'), children) for path in paths}
+
+    def node(self, path: str = '', children: bool = True) -> Optional[Dict[str, Any]]:
+        return self.nodes([path], children)[path]
+
+    def root(self) -> Dict[str, Any]:
+        """Digest of the whole tree."""
+        return self.node('', children=False)
+
+    # ------------------------------------------------------------------
+    # Comparison with a peer
+    # ------------------------------------------------------------------
+    @cached_property
+    def session(self):
+        session = requests.Session()
+        session.headers.update(peer_auth.headers())
+        return session
+
+    def _fetch(self, peer_url: str, paths: List[str], children: bool = True) -> Dict[str, Any]:
+        url = f"{peer_url.rstrip('/')}{MERKLE_PATH}"
+        body, headers = wire.encode_request({'paths': paths, 'children': children}, url)
+        response = self.session.post(url, data=body, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        data = wire.decode_response(response)
+        if data.get('use_mtime') != self.use_mtime:
+            raise ValueError('Peer compares files with a different mtime setting')
+        return data['nodes']
+
+    def compare(self, peer_url: str, path: str = '') -> Dict[str, Any]:
+        """
+        Find where a peer's tree differs from ours.
+
+        Compares the digests of ``path`` first and then descends level by
+        level, one request per ``COMPARE_BATCH`` differing directories.
+
+        Returns:
+            in_sync, requests made, elapsed seconds and the differing paths:
+            only_local, only_remote and different (files, or a file on one
+            side and a directory on the other)
+        """
+        started = time.time()
+        path = path.strip('/')
+        result = {'in_sync': False, 'requests': 1, 'only_local': [], 'only_remote': [],
+                  'different': [], 'truncated': False}
+
+        remote = self._fetch(peer_url, [path], children=False)[path]
+        local = self.node(path, children=False)
+        if remote is not None and local is not None and remote['digest'] == local['digest']:
+            result['in_sync'] = True
+        elif remote is None or local is None:
+            if local is not None:
+                result['only_local'].append(path)
+            elif remote is not None:
+                result['only_remote'].append(path)
+            else:
+                result['in_sync'] = True
+        else:
+            self._descend(peer_url, [path], result)
+
+        result['elapsed'] = round(time.time() - started, 3)
+        return result
+
+    def _descend(self, peer_url: str, frontier: List[str], result: Dict[str, Any]) -> None:
+        while frontier and not result['truncated']:
+            batch, frontier = frontier[:COMPARE_BATCH], frontier[COMPARE_BATCH:]
+            remote_nodes = self._fetch(peer_url, batch)
+            result['requests'] += 1
+            local_nodes = self.nodes(batch)
+            for path in batch:
+                local, remote = local_nodes.get(path), remote_nodes.get(path)
+                if local is None or remote is None:
+                    # Changed on either side since the parent was compared
+                    result['different'].append(path)
+                    continue
+                prefix = f"{path}/" if path else ''
+                local_children = {child['name']: child for child in local['children']}
+                remote_children = {child['name']: child for child in remote['children']}
+                for name in sorted(local_children.keys() | remote_children.keys()):
+                    mine, theirs = local_children.get(name), remote_children.get(name)
+                    if theirs is None:
+                        result['only_local'].append(prefix + name)
+                    elif mine is None:
+                        result['only_remote'].append(prefix + name)
+                    elif mine['digest'] == theirs['digest'] and mine['is_dir'] == theirs['is_dir']:
+                        continue
+                    elif mine['is_dir'] and theirs['is_dir']:
+                        frontier.append(prefix + name)
+                    else:
+                        result['different'].append(prefix + name)
+            if any(len(result[key]) >= MAX_DIFFERENCES for key in ('only_local', 'only_remote', 'different')):
+                result['truncated'] = True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'cached_directories': len(self._nodes), 'use_mtime': self.use_mtime}
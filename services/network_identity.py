@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import socket
+import logging
+import ipaddress
+import tempfile
+import threading
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from typing import Any, Dict, List, Optional
+
+from utils.lazy_import import lazy_import
+
+requests = lazy_import('requests')
+netifaces = lazy_import('netifaces')
+HAS_NETIFACES = importlib.util.find_spec('netifaces') is not None
+
+PUBLIC_IP_SERVICES = (
+    'https://api.ipify.org?format=json',
+    'https://ipapi.co/json/',
+    'https://ipinfo.io/json'
+)
+# Seconds between public address lookups while none succeeds (e.g. offline)
+PUBLIC_RETRY_INTERVAL = 60
+# rtnetlink multicast groups: link state and IPv4/IPv6 address changes
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+
+class NetworkIdentity:
+    """
+    Cached local and public addresses of this machine.
+
+    Local interfaces are enumerated once and again only when the kernel
+    reports an address or link change (rtnetlink on Linux) or the TTL
+    runs out. The public address comes from several lookup services
+    queried at the same time in the background; the first valid answer
+    wins and is persisted, so after a restart the last known value is
+    available immediately. Readers never wait on the network.
+    """
+
+    def __init__(self, state_path: str, local_ttl: float = 300, public_ttl: float = 3600,
+                 timeout: float = 5.0, services=PUBLIC_IP_SERVICES):
+        """
+        Initialize the NetworkIdentity.
+
+        Args:
+            state_path: JSON file holding the last public address
+            local_ttl: Seconds after which interfaces are enumerated again without a change event
+            public_ttl: Seconds after which the public address is looked up again
+            timeout: Timeout of each public address lookup in seconds
+            services: Lookup URLs answering with JSON containing 'ip'
+        """
+        self.state_path = state_path
+        self.local_ttl = local_ttl
+        self.public_ttl = public_ttl
+        self.timeout = timeout
+        self.services = services
+        self.logger = logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        self._local_ip: Optional[str] = None
+        self._addresses: List[str] = []
+        self._local_resolved = 0.0
+        self._local_refreshing = False
+
+        self._public_ip: Optional[str] = None
+        self._public_resolved = 0.0
+        self._public_attempted = float('-inf')
+        self._public_done = threading.Event()
+        self._public_refreshing = False
+        self._load_state()
+
+        self._running = False
+        self._watch_thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Resolve interfaces, start the public lookup and listen for interface changes."""
+        if self._running:
+            return
+        self._running = True
+        self._refresh_local()
+        self.refresh_public_ip()
+        self._watch_thread = threading.Thread(target=self._watch_interfaces, name="NetworkIdentity", daemon=True)
+        self._watch_thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+
+    # ------------------------------------------------------------------
+    # Local addresses
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _enumerate() -> List[str]:
+        """Non-loopback IPv4 addresses, the one used for outgoing traffic first."""
+        addresses = []
+        if HAS_NETIFACES:
+            try:
+                for interface in netifaces.interfaces():
+                    for addr in netifaces.ifaddresses(interface).get(netifaces.AF_INET, []):
+                        if not addr['addr'].startswith('127.'):
+                            addresses.append(addr['addr'])
+            except Exception:
+                addresses = []
+        try:
+            # No packet is sent; this only asks the kernel which source address it would route from
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                s.connect(("8.8.8.8", 80))
+                primary = s.getsockname()[0]
+            finally:
+                s.close()
+            if primary in addresses:
+                addresses.remove(primary)
+            addresses.insert(0, primary)
+        except OSError:
+            pass
+        if not addresses:
+            try:
+                ip = socket.gethostbyname(socket.gethostname())
+                if not ip.startswith('127.'):
+                    addresses.append(ip)
+            except OSError:
+                pass
+        return addresses
+
+    def _refresh_local(self) -> None:
+        addresses = self._enumerate()
+        with self._lock:
+            changed = addresses != self._addresses
+            self._addresses = addresses
+            self._local_ip = addresses[0] if addresses else '127.0.0.1'
+            self._local_resolved = time.monotonic()
+            self._local_refreshing = False
+        if changed:
+            self.logger.info(f"Local addresses: {', '.join(addresses) or 'none'}")
+
+    def local_ip(self) -> str:
+        """Primary local address; cached, refreshed in the background when stale."""
+        with self._lock:
+            ip = self._local_ip
+            stale = time.monotonic() - self._local_resolved > self.local_ttl
+            refresh = ip is not None and stale and not self._local_refreshing
+            if refresh:
+                self._local_refreshing = True
+        if ip is None:
+            self._refresh_local()
+            return self._local_ip
+        if refresh:
+            threading.Thread(target=self._refresh_local, name="LocalAddressRefresh", daemon=True).start()
+        return ip
+
+    def local_addresses(self) -> List[str]:
+        self.local_ip()
+        return list(self._addresses)
+
+    def _watch_interfaces(self) -> None:
+        """Refresh on rtnetlink address/link events; without netlink the TTL alone applies."""
+        if not hasattr(socket, 'AF_NETLINK'):
+            return
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+            sock.settimeout(1.0)
+        except OSError as e:
+            self.logger.info(f"Interface change events unavailable, using TTL refresh: {e}")
+            return
+        try:
+            while self._running:
+                try:
+                    sock.recv(65536)
+                except socket.timeout:
+                    continue
+                # A burst of messages usually follows one change; let it settle
+                time.sleep(0.5)
+                sock.settimeout(0)
+                try:
+                    while sock.recv(65536):
+                        pass
+                except (BlockingIOError, socket.timeout):
+                    pass
+                sock.settimeout(1.0)
+                before = self._local_ip
+                self._refresh_local()
+                if self._local_ip != before:
+                    self.refresh_public_ip(force=True)
+        finally:
+            sock.close()
+
+    # ------------------------------------------------------------------
+    # Public address
+    # ------------------------------------------------------------------
+    def _load_state(self) -> None:
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            ipaddress.ip_address(state['public_ip'])
+            self._public_ip = state['public_ip']
+            # Wall clock in the file, monotonic in memory
+            age = max(0.0, time.time() - float(state.get('resolved_at', 0)))
+            self._public_resolved = time.monotonic() - age
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def _save_state(self) -> None:
+        try:
+            directory = os.path.dirname(os.path.abspath(self.state_path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.identity-', dir=directory)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'public_ip': self._public_ip, 'resolved_at': time.time()}, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            self.logger.warning(f"Could not save network identity: {e}")
+
+    def _lookup(self, url: str) -> Optional[str]:
+        response = requests.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        ip = response.json().get('ip')
+        ipaddress.ip_address(ip)
+        return ip
+
+    def _race(self) -> None:
+        pool = ThreadPoolExecutor(max_workers=len(self.services), thread_name_prefix='PublicIP')
+        ip = None
+        try:
+            futures = {pool.submit(self._lookup, url): url for url in self.services}
+            for future in as_completed(futures, timeout=self.timeout + 1):
+                try:
+                    ip = future.result()
+                    break
+                except Exception as e:
+                    self.logger.debug(f"Public IP lookup via {futures[future]} failed: {e}")
+        except FuturesTimeout:
+            pass
+        finally:
+            # Slower lookups finish in the background; their answers are ignored
+            pool.shutdown(wait=False)
+
+        with self._lock:
+            if ip:
+                self._public_ip = ip
+                self._public_resolved = time.monotonic()
+            self._public_refreshing = False
+        if ip:
+            self._save_state()
+        else:
+            self.logger.warning("Could not determine public IP; keeping the last known value")
+        self._public_done.set()
+
+    def refresh_public_ip(self, force: bool = False) -> None:
+        """Start a background lookup if the public address is stale (or ``force``)."""
+        with self._lock:
+            now = time.monotonic()
+            stale = self._public_ip is None or now - self._public_resolved > self.public_ttl
+            if self._public_refreshing or not (stale or force):
+                return
+            if not force and now - self._public_attempted < PUBLIC_RETRY_INTERVAL:
+                return
+            self._public_attempted = now
+            self._public_refreshing = True
+            self._public_done.clear()
+        threading.Thread(target=self._race, name="PublicIPLookup", daemon=True).start()
+
+    def public_ip(self, wait: float = 0) -> Optional[str]:
+        """
+        Public address (last known value, possibly None).
+
+        Args:
+            wait: Seconds to wait for a lookup when none has succeeded yet (for the CLI)
+        """
+        self.refresh_public_ip()
+        if wait and self._public_ip is None:
+            self._public_done.wait(wait)
+        return self._public_ip
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'local_ip': self._local_ip,
+            'local_addresses': list(self._addresses),
+            'public_ip': self._public_ip,
+            'public_age': time.monotonic() - self._public_resolved if self._public_ip else None
+        }
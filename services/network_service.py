@@ -1,10 +1,17 @@
+import time
+import queue
 import socket
 import logging
-from typing import Optional, Dict, Any
-from zeroconf import ServiceInfo, Zeroconf, IPVersion
-import ifaddr
+from typing import TYPE_CHECKING, Optional, Dict, Any, Callable, Iterator, Tuple
 import ipaddress
 
+# zeroconf and ifaddr are imported where they are used; they are not needed to serve requests
+if TYPE_CHECKING:
+    from zeroconf import ServiceInfo
+
+# Upper bound in seconds for resolving one announced service
+RESOLVE_TIMEOUT = 3
+
 class NetworkService:
     def __init__(self, service_name: str, service_port: int, service_properties: Dict[str, str] = None):
         """
@@ -44,6 +51,7 @@ class NetworkService:
         Returns:
             Dict containing interface information keyed by interface name
         """
+        import ifaddr
         interfaces = {}
         try:
             for adapter in ifaddr.get_adapters():
@@ -63,6 +71,7 @@ class NetworkService:
     
     def register_service(self) -> bool:
         """Register the service using Zeroconf."""
+        from zeroconf import ServiceInfo, Zeroconf, IPVersion
         try:
             local_ip = self.get_local_ip()
             if not local_ip or local_ip == "127.0.0.1":
@@ -103,65 +112,119 @@ class NetworkService:
             self.zeroconf = None
             self.service_info = None
     
-    def discover_services(self, service_type: str = "_http._tcp.local.", timeout: int = 5) -> list:
+    @staticmethod
+    def _service_to_dict(info: 'ServiceInfo', service_type: str) -> Dict[str, Any]:
+        properties = {}
+        for key, value in (info.properties or {}).items():
+            try:
+                properties[key.decode()] = value.decode() if isinstance(value, bytes) else value
+            except (AttributeError, UnicodeDecodeError):
+                continue
+        return {
+            'name': info.name.replace(f".{service_type}", ""),
+            'type': service_type,
+            'addresses': [socket.inet_ntoa(addr) for addr in info.addresses],
+            'port': info.port,
+            'properties': properties
+        }
+    
+    def iter_services(self, service_type: str = "_http._tcp.local.", timeout: float = 5,
+                      max_results: Optional[int] = None, quiet_period: float = 0.25) -> Iterator[Dict[str, Any]]:
         """
-        Discover services of the specified type on the local network.
+        Yield services of the specified type as soon as each one is resolved.
+        
+        Browsing is event driven: every announced service is resolved concurrently
+        on the Zeroconf event loop, and the search ends as soon as ``max_results``
+        services were found, or when nothing new was announced for ``quiet_period``
+        seconds and no resolution is outstanding, or at ``timeout`` at the latest.
+        On a quiet network this returns after ``quiet_period`` instead of ``timeout``.
         
         Args:
-            service_type (str): The service type to discover (default: _http._tcp.local.)
-            timeout (int): Time in seconds to wait for responses
-            
-        Returns:
-            List of discovered services with their information
+            service_type (str): The service type to discover
+            timeout (float): Upper bound in seconds
+            max_results (int, optional): Stop after this many services
+            quiet_period (float): Seconds without announcements after which the search ends
         """
-        services = []
-        zeroconf = None
+        import asyncio
+        from zeroconf import ServiceBrowser, ServiceStateChange, Zeroconf, IPVersion
+        from zeroconf.asyncio import AsyncServiceInfo
         
-        class ServiceListener:
-            def __init__(self):
-                self.services = []
-                
-            def add_service(self, zc: Zeroconf, type_: str, name: str) -> None:
-                info = zc.get_service_info(type_, name)
-                if info:
-                    service_info = {
-                        'name': name.replace(f".{service_type}", ""),
-                        'type': type_,
-                        'addresses': [socket.inet_ntoa(addr) for addr in info.addresses],
-                        'port': info.port,
-                        'properties': {}
-                    }
-                    
-                    if info.properties:
-                        for key, value in info.properties.items():
-                            try:
-                                service_info['properties'][key.decode()] = (
-                                    value.decode() if isinstance(value, bytes) else value
-                                )
-                            except Exception as e:
-                                self.logger.warning(f"Error decoding property {key}: {e}")
-                    
-                    self.services.append(service_info)
+        events: 'queue.Queue[Tuple[str, Optional[AsyncServiceInfo]]]' = queue.Queue()
         
+        def on_state_change(zeroconf: Zeroconf, service_type: str, name: str,
+                            state_change: ServiceStateChange) -> None:
+            if state_change is not ServiceStateChange.Added:
+                return
+            events.put(('announced', None))
+            info = AsyncServiceInfo(service_type, name)
+            if info.load_from_cache(zeroconf):
+                events.put(('resolved', info))
+                return
+            future = asyncio.run_coroutine_threadsafe(
+                info.async_request(zeroconf, int(min(timeout, RESOLVE_TIMEOUT) * 1000)), zeroconf.loop)
+            future.add_done_callback(
+                lambda f: events.put(('resolved', info if not f.cancelled() and not f.exception() and f.result() else None)))
+        
+        zeroconf = None
+        browser = None
         try:
-            listener = ServiceListener()
             zeroconf = Zeroconf(ip_version=IPVersion.V4Only)
-            browser = ServiceBrowser(zeroconf, service_type, listener)
-            
-            # Wait for responses
-            import time
-            time.sleep(timeout)
-            
-            services = listener.services
-            self.logger.debug(f"Discovered {len(services)} services of type {service_type}")
-            
+            browser = ServiceBrowser(zeroconf, service_type, handlers=[on_state_change])
+            started = last_event = time.monotonic()
+            unresolved = found = 0
+            while True:
+                deadline = started + timeout
+                if not unresolved:
+                    deadline = min(deadline, last_event + quiet_period)
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    break
+                try:
+                    kind, info = events.get(timeout=wait)
+                except queue.Empty:
+                    break
+                last_event = time.monotonic()
+                if kind == 'announced':
+                    unresolved += 1
+                    continue
+                unresolved -= 1
+                if info is None or not info.addresses:
+                    continue
+                found += 1
+                yield self._service_to_dict(info, service_type)
+                if max_results and found >= max_results:
+                    break
+            self.logger.debug(f"Discovered {found} services of type {service_type} in "
+                              f"{time.monotonic() - started:.3f}s")
         except Exception as e:
             self.logger.error(f"Error discovering services: {e}")
-            
         finally:
+            if browser:
+                browser.cancel()
             if zeroconf:
                 zeroconf.close()
-                
+    
+    def discover_services(self, service_type: str = "_http._tcp.local.", timeout: float = 5,
+                          max_results: Optional[int] = None, quiet_period: float = 0.25,
+                          on_found: Optional[Callable[[Dict[str, Any]], None]] = None) -> list:
+        """
+        Discover services of the specified type on the local network.
+        
+        Args:
+            service_type (str): The service type to discover (default: _http._tcp.local.)
+            timeout (float): Upper bound in seconds; see iter_services for early return
+            max_results (int, optional): Stop after this many services
+            quiet_period (float): Seconds without announcements after which the search ends
+            on_found (callable, optional): Called with each service as it is resolved
+            
+        Returns:
+            List of discovered services with their information
+        """
+        services = []
+        for service in self.iter_services(service_type, timeout, max_results, quiet_period):
+            services.append(service)
+            if on_found:
+                on_found(service)
         return services
     
     def get_public_ip(self) -> Optional[str]:
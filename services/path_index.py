@@ -0,0 +1,503 @@
+import os
+import time
+import sqlite3
+import logging
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Rows written per transaction during a crawl
+CRAWL_BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    is_dir INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    seen INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_files_parent ON files(parent);
+CREATE INDEX IF NOT EXISTS idx_files_ext ON files(ext);
+CREATE INDEX IF NOT EXISTS idx_files_size ON files(size);
+CREATE INDEX IF NOT EXISTS idx_files_mtime ON files(mtime);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Trigram full-text table over file names: substring and glob queries use
+# the index instead of scanning every row
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+    name, content='files', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts(rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts(files_fts, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_au AFTER UPDATE OF name ON files BEGIN
+    INSERT INTO files_fts(files_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO files_fts(rowid, name) VALUES (new.id, new.name);
+END;
+"""
+
+SORT_COLUMNS = {
+    'name': 'files.name COLLATE NOCASE',
+    'size': 'files.size',
+    'mtime': 'files.mtime',
+    'path': 'files.path',
+}
+
+
+def _file_type(name: str, is_dir: bool) -> str:
+    """Coarse file type used for filtering (folder, image, video, text, ...)."""
+    if is_dir:
+        return 'folder'
+    mime_type, _ = mimetypes.guess_type(name)
+    if not mime_type:
+        return 'file'
+    if mime_type == 'application/pdf':
+        return 'pdf'
+    if mime_type in ('application/zip', 'application/x-rar-compressed', 'application/vnd.rar',
+                     'application/x-7z-compressed', 'application/x-tar', 'application/gzip'):
+        return 'archive'
+    return mime_type.split('/', 1)[0]
+
+
+class PathIndex:
+    """Persistent SQLite index of file metadata under the shared folder."""
+
+    def __init__(self, base_path: str, db_path: str, workers: int = 8):
+        """
+        Initialize the PathIndex.
+
+        Args:
+            base_path: Root directory that is indexed
+            db_path: Location of the SQLite database
+            workers: Number of threads used to crawl the tree
+        """
+        self.base_path = os.path.abspath(base_path)
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self.logger = logging.getLogger(__name__)
+
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._crawl_thread = None
+        self._crawl_id = 0
+        self.crawling = False
+        self.has_fts = False
+        self._listeners: List[Callable[[str, str], None]] = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._writer = self._connect()
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        """Per-thread read connection; WAL lets readers run alongside the writer."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self) -> None:
+        with self._write_lock, self._writer:
+            self._writer.executescript(SCHEMA)
+            try:
+                self._writer.executescript(FTS_SCHEMA)
+                self.has_fts = True
+            except sqlite3.OperationalError as e:
+                # SQLite < 3.34 has no trigram tokenizer; fall back to scans
+                self.logger.warning(f"Trigram FTS unavailable, name search will scan: {e}")
+
+    def add_listener(self, callback: Callable[[str, str], None]) -> None:
+        """
+        Register a callback invoked after the index changes.
+
+        The callback receives ``(kind, rel_path)`` where kind is 'update'
+        (one entry added or refreshed), 'remove' (an entry and everything
+        below it) or 'crawl' (a subtree was reconciled; '' is the whole tree).
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, kind: str, rel_path: str) -> None:
+        for callback in self._listeners:
+            try:
+                callback(kind, rel_path)
+            except Exception as e:
+                self.logger.error(f"Path index listener failed: {e}", exc_info=True)
+
+    # ------------------------------------------------------------------
+    # Path helpers
+    # ------------------------------------------------------------------
+    def relative_path(self, abs_path: str) -> Optional[str]:
+        """Convert an absolute path to the '/' separated key used in the index."""
+        rel_path = os.path.relpath(os.path.abspath(abs_path), self.base_path).replace('\\', '/')
+        if rel_path == '.' or rel_path.startswith('../') or rel_path == '..':
+            return None
+        return rel_path
+
+    @staticmethod
+    def _row_for(rel_path: str, name: str, st: os.stat_result, is_dir: bool, seen: int = 0) -> tuple:
+        parent = rel_path.rsplit('/', 1)[0] if '/' in rel_path else ''
+        ext = '' if is_dir else os.path.splitext(name)[1][1:].lower()
+        size = 0 if is_dir else st.st_size
+        return (rel_path, parent, name, ext, size, st.st_mtime, int(is_dir), _file_type(name, is_dir), seen)
+
+    def _upsert_rows(self, rows: List[tuple]) -> None:
+        with self._write_lock, self._writer:
+            self._writer.executemany(
+                """INSERT INTO files (path, parent, name, ext, size, mtime, is_dir, type, seen)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(path) DO UPDATE SET
+                       size = excluded.size, mtime = excluded.mtime, is_dir = excluded.is_dir,
+                       type = excluded.type, ext = excluded.ext, seen = excluded.seen""",
+                rows
+            )
+
+    # ------------------------------------------------------------------
+    # Crawling
+    # ------------------------------------------------------------------
+    def _scan_dir(self, abs_dir: str, crawl_id: int) -> Tuple[List[tuple], List[str]]:
+        """List one directory. Returns index rows and the subdirectories to descend into."""
+        rows, subdirs = [], []
+        try:
+            with os.scandir(abs_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.is_symlink():
+                            continue
+                        is_dir = entry.is_dir()
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    rel_path = self.relative_path(entry.path)
+                    if rel_path is None:
+                        continue
+                    rows.append(self._row_for(rel_path, entry.name, st, is_dir, crawl_id))
+                    if is_dir:
+                        subdirs.append(entry.path)
+        except OSError as e:
+            self.logger.warning(f"Could not scan {abs_dir}: {e}")
+        return rows, subdirs
+
+    def crawl(self, root: Optional[str] = None) -> int:
+        """
+        Crawl the tree (or a subtree) in parallel and bring the index in line with it.
+
+        Directories are listed concurrently by a thread pool while this thread
+        writes the results in large transactions. Entries that were not seen
+        during the crawl are removed afterwards.
+
+        Args:
+            root: Absolute directory to crawl, defaults to the whole shared folder
+
+        Returns:
+            Number of entries indexed
+        """
+        root = os.path.abspath(root or self.base_path)
+        # Subtree crawls during a full crawl share its marker, otherwise the
+        # full crawl's cleanup would drop the rows they wrote
+        crawl_id = self._crawl_id or int(time.time() * 1000)
+        owns_marker = not self._crawl_id
+        self._crawl_id = crawl_id
+        started = time.time()
+
+        try:
+            return self._crawl(root, crawl_id, started)
+        finally:
+            if owns_marker:
+                self._crawl_id = 0
+
+    def _crawl(self, root: str, crawl_id: int, started: float) -> int:
+        total = 0
+        pending_rows: List[tuple] = []
+
+        root_rel = self.relative_path(root)
+        if root_rel is not None:
+            try:
+                self._upsert_rows([self._row_for(root_rel, os.path.basename(root), os.stat(root), True, crawl_id)])
+            except OSError:
+                return 0
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='PathIndexCrawl') as executor:
+            futures = {executor.submit(self._scan_dir, root, crawl_id)}
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rows, subdirs = future.result()
+                    pending_rows.extend(rows)
+                    for subdir in subdirs:
+                        futures.add(executor.submit(self._scan_dir, subdir, crawl_id))
+                if len(pending_rows) >= CRAWL_BATCH_SIZE:
+                    self._upsert_rows(pending_rows)
+                    total += len(pending_rows)
+                    pending_rows = []
+
+        if pending_rows:
+            self._upsert_rows(pending_rows)
+            total += len(pending_rows)
+
+        # Anything not touched by this crawl no longer exists
+        with self._write_lock, self._writer:
+            if root_rel is None:
+                self._writer.execute('DELETE FROM files WHERE seen != ?', (crawl_id,))
+                self._writer.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_crawl', ?)", (str(time.time()),)
+                )
+            else:
+                low, high = self._subtree_range(root_rel)
+                self._writer.execute(
+                    'DELETE FROM files WHERE path >= ? AND path < ? AND seen != ?', (low, high, crawl_id)
+                )
+
+        self.logger.info(f"Indexed {total} entries under {root} in {time.time() - started:.1f}s")
+        self._notify('crawl', root_rel or '')
+        return total
+
+    def start_background_crawl(self) -> None:
+        """Reconcile the index with the filesystem without blocking the caller."""
+        if self._crawl_thread and self._crawl_thread.is_alive():
+            return
+
+        def run():
+            self.crawling = True
+            try:
+                self.crawl()
+            except Exception as e:
+                self.logger.error(f"Path index crawl failed: {e}", exc_info=True)
+            finally:
+                self.crawling = False
+
+        self._crawl_thread = threading.Thread(target=run, name="PathIndexCrawler", daemon=True)
+        self._crawl_thread.start()
+
+    # ------------------------------------------------------------------
+    # Incremental updates (file watcher)
+    # ------------------------------------------------------------------
+    def update_path(self, abs_path: str) -> None:
+        """Add or refresh a single file or directory after a change event."""
+        rel_path = self.relative_path(abs_path)
+        if rel_path is None:
+            return
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            self.remove_path(abs_path)
+            return
+        is_dir = os.path.isdir(abs_path)
+        # Tag with the running crawl (if any) so its cleanup pass keeps the row
+        self._upsert_rows([self._row_for(rel_path, os.path.basename(abs_path), st, is_dir, self._crawl_id)])
+        self._notify('update', rel_path)
+
+    def remove_path(self, abs_path: str) -> None:
+        """Remove a file, or a directory together with everything below it."""
+        rel_path = self.relative_path(abs_path)
+        if rel_path is None:
+            return
+        low, high = self._subtree_range(rel_path)
+        with self._write_lock, self._writer:
+            self._writer.execute(
+                'DELETE FROM files WHERE path = ? OR (path >= ? AND path < ?)', (rel_path, low, high)
+            )
+        self._notify('remove', rel_path)
+
+    def move_path(self, src_path: str, dest_path: str) -> None:
+        """Handle a rename/move by dropping the old entries and indexing the new location."""
+        self.remove_path(src_path)
+        if os.path.isdir(dest_path):
+            self.crawl(dest_path)
+        else:
+            self.update_path(dest_path)
+
+    @staticmethod
+    def _subtree_range(rel_path: str) -> Tuple[str, str]:
+        # Every descendant sorts between "dir/" and "dir0" ('0' follows '/'),
+        # which turns subtree operations into a range scan on the path index
+        return f"{rel_path}/", f"{rel_path}0"
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def search(self, query: str = '', glob: str = '', extensions: Optional[List[str]] = None,
+               min_size: Optional[int] = None, max_size: Optional[int] = None,
+               modified_after: Optional[float] = None, modified_before: Optional[float] = None,
+               path: str = '', file_type: str = '', include_dirs: bool = True,
+               sort: str = '', descending: bool = False,
+               limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Search the index.
+
+        Args:
+            query: Case-insensitive substring of the file name
+            glob: Shell-style pattern matched against the file name (e.g. ``*.pdf``)
+            extensions: Allowed extensions without the dot
+            min_size: Minimum file size in bytes
+            max_size: Maximum file size in bytes
+            modified_after: Only entries modified at or after this Unix timestamp
+            modified_before: Only entries modified before this Unix timestamp
+            path: Restrict results to this directory (relative) and its subdirectories
+            file_type: Coarse type filter (image, video, text, pdf, archive, folder, ...)
+            include_dirs: Whether directories may appear in the results
+            sort: One of ``name``, ``size``, ``mtime``, ``path`` (unsorted if empty)
+            descending: Reverse the sort order
+            limit: Maximum number of results
+            offset: Number of results to skip
+
+        Returns:
+            List of matching entries
+        """
+        joins, where, params = [], [], []
+
+        use_fts = self.has_fts
+        if query:
+            if use_fts and len(query) >= 3:
+                joins.append('JOIN files_fts ON files_fts.rowid = files.id')
+                where.append('files_fts MATCH ?')
+                params.append('"' + query.replace('"', '""') + '"')
+            else:
+                where.append("files.name LIKE ? ESCAPE '\\'")
+                escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                params.append(f"%{escaped}%")
+        if glob:
+            if use_fts and not query:
+                joins.append('JOIN files_fts ON files_fts.rowid = files.id')
+                where.append('files_fts.name GLOB ?')
+            else:
+                where.append('files.name GLOB ?')
+            params.append(glob)
+        if extensions:
+            exts = [e.lower().lstrip('.') for e in extensions if e]
+            where.append(f"files.ext IN ({','.join('?' * len(exts))})")
+            params.extend(exts)
+        if min_size is not None:
+            where.append('files.size >= ?')
+            params.append(int(min_size))
+        if max_size is not None:
+            where.append('files.size <= ?')
+            params.append(int(max_size))
+        if modified_after is not None:
+            where.append('files.mtime >= ?')
+            params.append(float(modified_after))
+        if modified_before is not None:
+            where.append('files.mtime < ?')
+            params.append(float(modified_before))
+        if path:
+            low, high = self._subtree_range(path.strip('/'))
+            where.append('files.path >= ? AND files.path < ?')
+            params.extend([low, high])
+        if file_type:
+            where.append('files.type = ?')
+            params.append(file_type)
+        if not include_dirs or min_size is not None or max_size is not None or extensions:
+            where.append('files.is_dir = 0')
+
+        sql = 'SELECT files.path, files.name, files.size, files.mtime, files.is_dir, files.type FROM files'
+        if joins:
+            sql += ' ' + ' '.join(joins)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        if sort in SORT_COLUMNS:
+            sql += f" ORDER BY {SORT_COLUMNS[sort]} {'DESC' if descending else 'ASC'}"
+        sql += ' LIMIT ? OFFSET ?'
+        params.extend([int(limit), int(offset)])
+
+        rows = self._reader().execute(sql, params).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def iter_files(self, path: str = '') -> Iterator[Tuple[str, int, float]]:
+        """Yield (relative path, size, mtime) for every indexed file, optionally below ``path``."""
+        sql = 'SELECT path, size, mtime FROM files WHERE is_dir = 0'
+        params: List[Any] = []
+        if path:
+            low, high = self._subtree_range(path.strip('/'))
+            sql += ' AND path >= ? AND path < ?'
+            params.extend([low, high])
+        cursor = self._connect().execute(sql, params)
+        try:
+            for row in cursor:
+                yield row['path'], row['size'], row['mtime']
+        finally:
+            cursor.connection.close()
+
+    def iter_entries(self, paths: Optional[List[str]] = None) -> Iterator[tuple]:
+        """
+        Yield (path, parent, ext, type, size, mtime, is_dir) for every entry, or only for ``paths``.
+
+        Used to build columnar snapshots; entries are yielded in path order.
+        """
+        conn = self._connect()
+        try:
+            columns = 'SELECT path, parent, ext, type, size, mtime, is_dir FROM files'
+            if paths is None:
+                yield from conn.execute(f'{columns} ORDER BY path')
+                return
+            # Stay below SQLite's bound-parameter limit
+            for i in range(0, len(paths), 500):
+                chunk = paths[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                yield from conn.execute(f'{columns} WHERE path IN ({placeholders}) ORDER BY path', chunk)
+        finally:
+            conn.close()
+
+    def get(self, rel_path: str) -> Optional[Dict[str, Any]]:
+        """The index entry of one path, or None."""
+        row = self._reader().execute('SELECT * FROM files WHERE path = ?', (rel_path,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def children(self, parent: str = '') -> List[sqlite3.Row]:
+        """(name, size, mtime, is_dir) rows of the direct children of a directory, ordered by name."""
+        return self._reader().execute(
+            'SELECT name, size, mtime, is_dir FROM files WHERE parent = ? ORDER BY name', (parent,)
+        ).fetchall()
+
+    def count(self) -> int:
+        """Number of indexed entries."""
+        return self._reader().execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Index size and crawl state for the status endpoint."""
+        row = self._reader().execute("SELECT value FROM meta WHERE key = 'last_crawl'").fetchone()
+        return {
+            'entries': self.count(),
+            'crawling': self.crawling,
+            'last_crawl': float(row['value']) if row else None,
+            'trigram_search': self.has_fts
+        }
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            'path': row['path'],
+            'name': row['name'],
+            'size': row['size'],
+            'modified': row['mtime'],
+            'modified_iso': datetime.fromtimestamp(row['mtime']).isoformat(),
+            'is_dir': bool(row['is_dir']),
+            'type': row['type']
+        }
+
+    def close(self) -> None:
+        """Close the writer connection."""
+        with self._write_lock:
+            self._writer.close()
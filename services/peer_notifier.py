@@ -0,0 +1,299 @@
+import time
+import random
+import logging
+import threading
+from functools import cached_property
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.lazy_import import lazy_import
+from utils import wire, peer_auth
+
+requests = lazy_import('requests')
+
+INGEST_PATH = '/api/peer/changes'
+# Backoff after failed deliveries: base * 2^failures, capped, with jitter
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 300.0
+# Changes received from each peer that are kept for inspection
+REMOTE_HISTORY = 10000
+# Peers whose received changes are kept; the least recently heard from is dropped first
+REMOTE_SOURCES = 256
+
+
+class _PeerState:
+    """Outbox and delivery state of one peer."""
+
+    def __init__(self, peer_id: str, url: str):
+        self.peer_id = peer_id
+        self.url = url
+        self.outbox: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()  # path -> newest change
+        self.in_flight = False
+        self.failures = 0
+        self.retry_at = 0.0
+        self.overflowed = False
+        self.sent_batches = 0
+        self.sent_changes = 0
+        self.last_error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'peer_id': self.peer_id,
+            'url': self.url,
+            'queued': len(self.outbox),
+            'in_flight': self.in_flight,
+            'failures': self.failures,
+            'retry_in': max(0.0, self.retry_at - time.monotonic()),
+            'overflowed': self.overflowed,
+            'sent_batches': self.sent_batches,
+            'sent_changes': self.sent_changes,
+            'last_error': self.last_error
+        }
+
+
+class PeerNotifier:
+    """
+    Batched change notifications to peer devices.
+
+    Changes are queued per peer (newest change per path wins) and sent by a
+    background sender as batches over one pooled keep-alive session, with
+    bounded concurrency and exponential backoff for unreachable peers.
+    Enqueuing never blocks, so the file watcher cannot stall on slow peers.
+    """
+
+    def __init__(self, device_id: str, get_peers: Callable[[], Iterable[Tuple[str, str]]],
+                 batch_size: int = 1000, interval: float = 1.0, concurrency: int = 8,
+                 timeout: float = 5.0, max_queue: int = 100000,
+                 piggyback: Optional[Callable[[], List[Dict[str, Any]]]] = None):
+        """
+        Initialize the PeerNotifier.
+
+        Args:
+            device_id: Identifier of this device, sent as the source of each batch
+            get_peers: Returns (peer id, base URL) pairs of the current peers
+            batch_size: Maximum changes per request
+            interval: Seconds the sender waits to collect changes into a batch
+            concurrency: Maximum simultaneous requests
+            timeout: Request timeout in seconds
+            max_queue: Changes kept per peer; beyond that the peer is flagged to resync
+            piggyback: Returns extra items sent along with each batch (membership gossip)
+        """
+        self.device_id = device_id
+        self.get_peers = get_peers
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.piggyback = piggyback
+        self.logger = logging.getLogger(__name__)
+
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='PeerNotify')
+
+        self._peers: Dict[str, _PeerState] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+        self._remote: 'OrderedDict[str, deque]' = OrderedDict()
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="PeerNotifier", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+        self._wakeup.set()
+        self._executor.shutdown(wait=False)
+        if 'session' in self.__dict__:
+            self.session.close()
+
+    @cached_property
+    def session(self):
+        """Pooled HTTP session, created with the first notification."""
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.headers.update(peer_auth.headers())
+        adapter = HTTPAdapter(pool_connections=max(self.concurrency, 10), pool_maxsize=self.concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    # ------------------------------------------------------------------
+    # Outgoing
+    # ------------------------------------------------------------------
+    def _sync_peers(self) -> None:
+        """Track the current peer list; caller holds the lock."""
+        current = {peer_id: url.rstrip('/') for peer_id, url in self.get_peers()}
+        for peer_id in [p for p in self._peers if p not in current]:
+            del self._peers[peer_id]
+        for peer_id, url in current.items():
+            state = self._peers.get(peer_id)
+            if state is None:
+                self._peers[peer_id] = _PeerState(peer_id, url)
+            elif state.url != url:
+                state.url = url
+                state.failures, state.retry_at = 0, 0.0
+
+    def enqueue(self, changes: List[Dict[str, Any]]) -> None:
+        """
+        Queue changes for every peer. Each change needs at least ``path``.
+
+        Args:
+            changes: Change dictionaries, oldest first
+        """
+        if not changes:
+            return
+        with self._lock:
+            self._sync_peers()
+            for state in self._peers.values():
+                for change in changes:
+                    self._supersede(state.outbox, change['path'])
+                    state.outbox[change['path']] = change
+                while len(state.outbox) > self.max_queue:
+                    state.outbox.popitem(last=False)
+                    state.overflowed = True
+
+    def _supersede(self, outbox: 'OrderedDict[str, Dict[str, Any]]', path: str) -> None:
+        """
+        Drop the queued change for ``path`` in favour of a newer one. Caller holds the lock.
+
+        A dropped move still has to tell the peer that its source is gone,
+        so it leaves a deletion of the source behind, unless the source was
+        changed again after the move.
+        """
+        previous = outbox.get(path)
+        if previous is None:
+            return
+        src = previous.get('src_path') if previous.get('action') == 'moved' else None
+        if src and src in outbox:
+            keys = list(outbox)
+            if keys.index(src) > keys.index(path):
+                src = None  # the source was changed again after the move; that change stands
+        del outbox[path]
+        if src:
+            self._supersede(outbox, src)
+            outbox[src] = {'action': 'deleted', 'path': src, 'is_dir': previous.get('is_dir', False)}
+
+    def _run(self) -> None:
+        while self._running:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self._send_ready()
+            except Exception as e:
+                self.logger.error(f"Peer notifier failed: {e}", exc_info=True)
+
+    def _send_ready(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for state in self._peers.values():
+                if state.in_flight or not state.outbox or now < state.retry_at:
+                    continue
+                batch = []
+                while state.outbox and len(batch) < self.batch_size:
+                    batch.append(state.outbox.popitem(last=False)[1])
+                resync, state.overflowed = state.overflowed, False
+                state.in_flight = True
+                self._executor.submit(self._deliver, state, batch, resync)
+
+    def _deliver(self, state: _PeerState, batch: List[Dict[str, Any]], resync: bool) -> None:
+        payload = {'source': self.device_id, 'changes': batch, 'resync': resync}
+        url = f"{state.url}{INGEST_PATH}"
+        try:
+            if self.piggyback:
+                payload['gossip'] = self.piggyback()
+            body, headers = wire.encode_request(payload, url)
+            response = self.session.post(url, data=body, headers=headers, timeout=self.timeout)
+            response.raise_for_status()
+            wire.decode_response(response)  # later batches use the most compact format the peer reads
+        except Exception as e:
+            # Anything, not just network errors: the peer must not stay in flight forever
+            with self._lock:
+                # Put the batch back in front; newer queued changes for the same path win
+                for change in reversed(batch):
+                    if change['path'] not in state.outbox:
+                        state.outbox[change['path']] = change
+                        state.outbox.move_to_end(change['path'], last=False)
+                    elif change.get('action') == 'moved' and change.get('src_path') and \
+                            change['src_path'] not in state.outbox:
+                        # The newer change replaces the move, but the peer still has to drop the source
+                        src = change['src_path']
+                        state.outbox[src] = {'action': 'deleted', 'path': src, 'is_dir': change.get('is_dir', False)}
+                        state.outbox.move_to_end(src, last=False)
+                state.overflowed = state.overflowed or resync
+                state.failures += 1
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (state.failures - 1))
+                state.retry_at = time.monotonic() + delay * random.uniform(0.5, 1.0)
+                state.last_error = str(e)
+                state.in_flight = False
+            self.logger.warning(f"Notifying {state.peer_id} failed ({state.failures}x): {e}")
+            return
+
+        with self._lock:
+            state.failures = 0
+            state.retry_at = 0.0
+            state.last_error = None
+            state.sent_batches += 1
+            state.sent_changes += len(batch)
+            state.in_flight = False
+        if state.outbox:
+            self._wakeup.set()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Send everything that can be sent now; returns True if all outboxes drained."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self._send_ready()
+            with self._lock:
+                busy = [s for s in self._peers.values()
+                        if s.in_flight or (s.outbox and s.retry_at <= time.monotonic())]
+                if not busy:
+                    return not any(s.outbox for s in self._peers.values())
+            time.sleep(0.05)
+        return False
+
+    # ------------------------------------------------------------------
+    # Incoming
+    # ------------------------------------------------------------------
+    def receive(self, source: str, changes: List[Dict[str, Any]], resync: bool = False) -> int:
+        """
+        Handle a batch sent by a peer.
+
+        Args:
+            source: Device id of the sender
+            changes: Change dictionaries
+            resync: The sender dropped changes for us and we should do a full comparison
+
+        Returns:
+            Number of changes accepted
+        """
+        with self._lock:
+            history = self._remote.get(source)
+            if history is None:
+                history = self._remote[source] = deque(maxlen=REMOTE_HISTORY)
+                while len(self._remote) > REMOTE_SOURCES:
+                    self._remote.popitem(last=False)
+            self._remote.move_to_end(source)
+            history.extend(changes)
+        if resync:
+            self.logger.info(f"{source} dropped changes for us; a full comparison is needed")
+        return len(changes)
+
+    def recent_remote_changes(self, source: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """Newest ``limit`` changes received from ``source``, oldest first."""
+        with self._lock:
+            history = self._remote.get(source)
+            return list(history)[-limit:] if history else []
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'peers': [state.to_dict() for state in self._peers.values()],
+                'received_from': {source: len(history) for source, history in self._remote.items()}
+            }
@@ -1,11 +1,13 @@
 import os
-import rarfile
 import tempfile
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
 
-from config import Config
+from config import Config, configure_rarfile
+from utils.lazy_import import lazy_import
+
+rarfile = lazy_import('rarfile', on_load=configure_rarfile)
 
 class RarService:
     def __init__(self):
@@ -0,0 +1,225 @@
+import time
+import logging
+import threading
+from functools import cached_property
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from utils.lazy_import import lazy_import
+from utils import peer_auth
+
+requests = lazy_import('requests')
+
+# Response headers of the target that are passed on to the client
+FORWARD_RESPONSE_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges',
+                            'ETag', 'Last-Modified', 'Content-Disposition', 'Accept-Encoding', 'Vary')
+# Request headers of the client that are passed on to the target
+FORWARD_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since', 'Accept',
+                           'Content-Type', 'Content-Encoding')
+# Seconds to wait for the TCP connection to the target
+CONNECT_TIMEOUT = 5.0
+# Seconds of history behind the throughput figures
+RATE_WINDOW = 10
+
+
+class _Transfer:
+    """One relayed request: holds a capacity slot until the response is closed."""
+
+    def __init__(self, relay: 'RelayService', method: str, target: str, path: str):
+        self.relay = relay
+        self.method = method
+        self.target = target
+        self.path = path
+        self.started = time.monotonic()
+        self.bytes_up = 0  # client -> target
+        self.bytes_down = 0  # target -> client
+        self.status_code: Optional[int] = None
+        self.headers: Dict[str, str] = {}
+        self.response = None
+        self.error: Optional[str] = None
+        self._closed = False
+
+    def upload(self, body: Iterable[bytes]) -> Iterator[bytes]:
+        for chunk in body:
+            self.bytes_up += len(chunk)
+            self.relay._count(len(chunk), 0)
+            yield chunk
+
+    def iter_body(self) -> Iterator[bytes]:
+        """
+        The target's response body, one chunk at a time.
+
+        The next chunk is read from the target only after the previous one
+        was written to the client, so a slow client slows the target down
+        instead of filling memory.
+        """
+        try:
+            for chunk in self.response.iter_content(self.relay.chunk_size):
+                self.bytes_down += len(chunk)
+                self.relay._count(0, len(chunk))
+                yield chunk
+        except requests.RequestException as e:
+            self.error = str(e)
+            self.relay.logger.warning(f"Relay from {self.target} interrupted: {e}")
+        except GeneratorExit:
+            self.error = 'client disconnected'
+            raise
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Release the slot; safe to call more than once."""
+        if self._closed:
+            return
+        self._closed = True
+        if self.response is not None:
+            self.response.close()
+        self.relay._finish(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        return {
+            'method': self.method,
+            'target': self.target,
+            'path': self.path,
+            'status_code': self.status_code,
+            'bytes_up': self.bytes_up,
+            'bytes_down': self.bytes_down,
+            'elapsed': round(elapsed, 3),
+            'rate': round((self.bytes_up + self.bytes_down) / elapsed) if elapsed else 0
+        }
+
+
+class RelayService:
+    """
+    Proxy peer requests between devices that cannot reach each other.
+
+    Both devices talk to the relay, which forwards each request to the
+    target peer and streams the answer back chunk by chunk; request bodies
+    (pushes) are streamed the same way in the other direction. Nothing is
+    buffered beyond one chunk per transfer and reading from one side waits
+    for the write to the other side, so backpressure carries through. At
+    most ``capacity`` transfers run at once; further requests are refused
+    immediately rather than queued.
+    """
+
+    def __init__(self, capacity: int = 100, chunk_size: int = 64 * 1024, timeout: float = 30.0):
+        """
+        Initialize the RelayService.
+
+        Args:
+            capacity: Maximum simultaneous relayed transfers
+            chunk_size: Bytes read from one side before they are written to the other
+            timeout: Seconds the target may stay silent before a transfer is aborted
+        """
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__)
+
+        self._slots = threading.BoundedSemaphore(capacity)
+        self._lock = threading.Lock()
+        self._active: List[_Transfer] = []
+        self._rate: 'deque[List[int]]' = deque()  # [second, bytes up, bytes down]
+        self.stats = {'transfers': 0, 'completed': 0, 'failed': 0, 'rejected': 0,
+                      'bytes_up': 0, 'bytes_down': 0, 'peak_active': 0}
+
+    @cached_property
+    def session(self):
+        """Pooled HTTP session, created with the first relayed transfer."""
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.headers.update(peer_auth.headers())
+        adapter = HTTPAdapter(pool_connections=10, pool_maxsize=self.capacity)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def open(self, method: str, target: str, path: str, params: Optional[Dict[str, Any]] = None,
+             headers: Optional[Dict[str, str]] = None,
+             body: Optional[Iterable[bytes]] = None) -> Optional[_Transfer]:
+        """
+        Forward one request to a peer and return the transfer once its response headers arrived.
+
+        The caller streams ``iter_body()`` to the client; the slot is released
+        when that iterator is exhausted or ``close()`` is called.
+
+        Args:
+            method: HTTP method
+            target: Base URL of the target peer
+            path: Path on the target, starting with '/'
+            params: Query string
+            headers: Client request headers; only FORWARD_REQUEST_HEADERS are passed on
+            body: Request body chunks (e.g. the client's request stream), or None
+
+        Returns:
+            The transfer, or None when all slots are in use
+
+        Raises:
+            requests.RequestException: The target could not be reached
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats['rejected'] += 1
+            return None
+        transfer = _Transfer(self, method, target, path)
+        with self._lock:
+            self._active.append(transfer)
+            self.stats['transfers'] += 1
+            self.stats['peak_active'] = max(self.stats['peak_active'], len(self._active))
+
+        forwarded = {name: value for name, value in (headers or {}).items()
+                     if name.title() in FORWARD_REQUEST_HEADERS}
+        try:
+            response = self.session.request(
+                method, f"{target.rstrip('/')}{path}", params=params, headers=forwarded,
+                data=transfer.upload(body) if body is not None else None,
+                stream=True, timeout=(CONNECT_TIMEOUT, self.timeout), allow_redirects=False
+            )
+        except requests.RequestException as e:
+            transfer.error = str(e)
+            transfer.close()
+            raise
+        transfer.response = response
+        transfer.status_code = response.status_code
+        transfer.headers = {name: response.headers[name] for name in FORWARD_RESPONSE_HEADERS
+                            if name in response.headers}
+        if 'Content-Encoding' in response.headers:
+            # iter_content decodes the body, so the target's length no longer applies
+            transfer.headers.pop('Content-Length', None)
+        return transfer
+
+    def _count(self, up: int, down: int) -> None:
+        second = int(time.monotonic())
+        with self._lock:
+            self.stats['bytes_up'] += up
+            self.stats['bytes_down'] += down
+            if self._rate and self._rate[-1][0] == second:
+                self._rate[-1][1] += up
+                self._rate[-1][2] += down
+            else:
+                self._rate.append([second, up, down])
+            while self._rate and self._rate[0][0] <= second - RATE_WINDOW:
+                self._rate.popleft()
+
+    def _finish(self, transfer: _Transfer) -> None:
+        with self._lock:
+            if transfer in self._active:
+                self._active.remove(transfer)
+            self.stats['failed' if transfer.error else 'completed'] += 1
+        self._slots.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        second = int(time.monotonic())
+        with self._lock:
+            recent = [bucket for bucket in self._rate if bucket[0] > second - RATE_WINDOW]
+            active = [transfer.to_dict() for transfer in self._active]
+            stats = dict(self.stats)
+        return {
+            **stats,
+            'capacity': self.capacity,
+            'active': len(active),
+            'rate_up': sum(bucket[1] for bucket in recent) / RATE_WINDOW,
+            'rate_down': sum(bucket[2] for bucket in recent) / RATE_WINDOW,
+            'active_transfers': active
+        }
@@ -0,0 +1,368 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+import tempfile
+import threading
+from functools import cached_property
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote
+
+from utils.lazy_import import lazy_import
+from utils import wire, peer_auth
+
+requests = lazy_import('requests')
+
+CHUNKS_PATH = '/api/peer/chunks/'
+FILE_PATH = '/api/peer/file/'
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+READ_SIZE = 64 * 1024
+# Manifests kept in memory by the serving side
+MANIFEST_CACHE_SIZE = 256
+# Peers working on the same chunk at once near the end of a download
+ENDGAME_COPIES = 2
+# Finished background jobs kept for /api/swarm/jobs; older ones are dropped
+MAX_FINISHED_JOBS = 100
+
+
+def _chunk_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class _Source:
+    """One peer serving the file, with its download statistics."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.chunks = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.failures = 0  # consecutive
+        self.dropped = False
+        self.last_error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'url': self.url,
+            'chunks': self.chunks,
+            'bytes': self.bytes,
+            'rate': self.bytes / self.seconds if self.seconds else 0,
+            'dropped': self.dropped,
+            'last_error': self.last_error
+        }
+
+
+class _Download:
+    """Shared state of one swarm download; every field is guarded by ``cond``."""
+
+    def __init__(self, size: int, chunk_size: int, hashes: List[str], sources: List[_Source], out):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.hashes = hashes
+        self.sources = sources
+        self.out = out
+        self.pending = deque(range(len(hashes)))
+        self.in_flight: Dict[int, Set[_Source]] = {}
+        self.done: Set[int] = set()
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return len(self.done) == len(self.hashes)
+
+    @property
+    def failed(self) -> bool:
+        return all(source.dropped for source in self.sources)
+
+    def next_chunk(self, source: _Source) -> Optional[int]:
+        if self.pending:
+            return self.pending.popleft()
+        # Endgame: help with a chunk another (slower) peer is still working on
+        candidates = [index for index, holders in self.in_flight.items()
+                      if source not in holders and len(holders) < ENDGAME_COPIES]
+        return min(candidates, key=lambda index: len(self.in_flight[index])) if candidates else None
+
+
+class SwarmDownloader:
+    """
+    Download one file from several peers at once.
+
+    Every holder is asked for the file's chunk manifest (size plus one
+    hash per chunk); peers that agree with the majority become sources.
+    Each source pulls the next missing chunk as soon as it finishes the
+    previous one, so faster peers naturally serve more of the file. Every
+    chunk is verified against the manifest before it is written, a chunk
+    that fails is handed to another peer, and a peer that keeps failing is
+    dropped. Near the end, idle peers duplicate chunks still in flight on
+    slow ones and the first verified copy wins.
+    """
+
+    def __init__(self, base_path: str, chunk_size: int = 4 * 1024 * 1024, connections_per_peer: int = 2,
+                 timeout: float = 30.0, max_failures: int = 3):
+        """
+        Initialize the SwarmDownloader.
+
+        Args:
+            base_path: Shared root; file paths are relative to it
+            chunk_size: Bytes per chunk, the unit of hashing and of work handed to peers
+            connections_per_peer: Simultaneous range requests per peer
+            timeout: Timeout for peer requests in seconds
+            max_failures: Consecutive failures after which a peer is dropped
+        """
+        self.base_path = os.path.abspath(base_path)
+        self.chunk_size = chunk_size
+        self.connections_per_peer = connections_per_peer
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.logger = logging.getLogger(__name__)
+
+        self._manifests: 'OrderedDict[Tuple, Dict[str, Any]]' = OrderedDict()
+        self._manifest_lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._jobs_lock = threading.Lock()
+
+    @cached_property
+    def session(self):
+        """Pooled HTTP session, created with the first download."""
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.headers.update(peer_auth.headers())
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max(16, self.connections_per_peer * 8))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def resolve(self, rel_path: str) -> str:
+        """Absolute path of a shared file; raises ValueError if it escapes the shared root."""
+        rel_path = rel_path.replace('\\', '/').strip('/')
+        path = os.path.abspath(os.path.join(self.base_path, rel_path))
+        if not rel_path or not path.startswith(self.base_path + os.sep):
+            raise ValueError(f'Invalid path: {rel_path}')
+        return path
+
+    # ------------------------------------------------------------------
+    # Serving side
+    # ------------------------------------------------------------------
+    def manifest(self, rel_path: str, chunk_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Size and per-chunk hashes of a shared file, cached until the file changes.
+
+        Raises:
+            FileNotFoundError: The file does not exist
+            ValueError: Invalid path or chunk size
+        """
+        chunk_size = chunk_size or self.chunk_size
+        if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+            raise ValueError(f'Chunk size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE}')
+        path = self.resolve(rel_path)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(rel_path)
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime_ns, chunk_size)
+        with self._manifest_lock:
+            if key in self._manifests:
+                self._manifests.move_to_end(key)
+                return self._manifests[key]
+
+        hashes = []
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                hashes.append(_chunk_digest(data))
+        manifest = {'size': st.st_size, 'mtime': st.st_mtime, 'chunk_size': chunk_size, 'hashes': hashes}
+        with self._manifest_lock:
+            self._manifests[key] = manifest
+            while len(self._manifests) > MANIFEST_CACHE_SIZE:
+                self._manifests.popitem(last=False)
+        return manifest
+
+    # ------------------------------------------------------------------
+    # Downloading side
+    # ------------------------------------------------------------------
+    def _fetch_manifest(self, peer_url: str, quoted: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = self.session.get(f"{peer_url}{CHUNKS_PATH}{quoted}",
+                                        params={'chunk_size': self.chunk_size}, headers=wire.client_headers(),
+                                        timeout=self.timeout)
+            response.raise_for_status()
+            return wire.decode_response(response)['manifest']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            self.logger.info(f"{peer_url} cannot serve {quoted}: {e}")
+            return None
+
+    def _fetch_chunk(self, download: _Download, source: _Source, quoted: str, index: int) -> Optional[bytes]:
+        """Fetch one chunk with a range request; None if another peer delivered it first."""
+        start = index * download.chunk_size
+        end = min(download.size, start + download.chunk_size) - 1
+        with self.session.get(f"{source.url}{FILE_PATH}{quoted}", headers={'Range': f'bytes={start}-{end}'},
+                              stream=True, timeout=self.timeout) as response:
+            if response.status_code != 206:
+                raise requests.RequestException(f'Range request answered with HTTP {response.status_code}')
+            data = bytearray()
+            for piece in response.iter_content(READ_SIZE):
+                data += piece
+                if index in download.done:
+                    return None
+        if len(data) != end - start + 1 or _chunk_digest(bytes(data)) != download.hashes[index]:
+            raise ValueError(f'Chunk {index} failed verification')
+        return bytes(data)
+
+    def _worker(self, download: _Download, source: _Source, quoted: str) -> None:
+        while True:
+            with download.cond:
+                while True:
+                    if download.finished or source.dropped:
+                        return
+                    index = download.next_chunk(source)
+                    if index is not None:
+                        break
+                    download.cond.wait(0.5)
+                download.in_flight.setdefault(index, set()).add(source)
+
+            started = time.monotonic()
+            try:
+                data = self._fetch_chunk(download, source, quoted, index)
+                if data is not None:
+                    with download.write_lock:
+                        download.out.seek(index * download.chunk_size)
+                        download.out.write(data)
+                error = None
+            except Exception as e:
+                # Whatever failed (network, verification, a local write), the chunk must
+                # leave in_flight and waiters must wake up, or download() waits forever
+                data, error = None, e
+
+            with download.cond:
+                holders = download.in_flight.get(index, set())
+                holders.discard(source)
+                if data is not None and index not in download.done:
+                    download.done.add(index)
+                    source.chunks += 1
+                    source.bytes += len(data)
+                    source.seconds += time.monotonic() - started
+                    source.failures = 0
+                if index in download.done or not holders:
+                    download.in_flight.pop(index, None)
+                if error is not None:
+                    source.failures += 1
+                    source.last_error = str(error)
+                    if index not in download.done and index not in download.in_flight:
+                        download.pending.appendleft(index)
+                    if source.failures >= self.max_failures:
+                        source.dropped = True
+                        self.logger.warning(f"Dropping {source.url} from the swarm: {error}")
+                download.cond.notify_all()
+            if error is not None and not source.dropped:
+                time.sleep(min(5.0, 0.5 * source.failures))
+
+    def download(self, rel_path: str, peers: List[str], dest: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Download a file from every peer that holds the same version.
+
+        Args:
+            rel_path: Path of the file on the peers, relative to their shared roots
+            peers: Base URLs of candidate peers
+            dest: Local destination; defaults to the same relative path here
+
+        Returns:
+            Size, elapsed seconds, combined rate and per-peer statistics
+
+        Raises:
+            ValueError: No peer has the file, or every source failed
+        """
+        started = time.time()
+        dest = dest or self.resolve(rel_path)
+        quoted = quote(rel_path.replace('\\', '/').strip('/'))
+        peers = [peer.rstrip('/') for peer in peers]
+        if not peers:
+            raise ValueError('No peers to download from')
+
+        with ThreadPoolExecutor(max_workers=len(peers)) as pool:
+            manifests = list(pool.map(lambda peer: self._fetch_manifest(peer, quoted), peers))
+        versions = Counter((m['size'], tuple(m['hashes'])) for m in manifests if m)
+        if not versions:
+            raise ValueError(f'No peer has {rel_path}')
+        # The version most peers agree on; peers holding another version are left out
+        (size, hashes), _ = versions.most_common(1)[0]
+        sources = [_Source(peer) for peer, m in zip(peers, manifests)
+                   if m and (m['size'], tuple(m['hashes'])) == (size, hashes)]
+
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.swarm-', dir=os.path.dirname(os.path.abspath(dest)))
+        try:
+            with os.fdopen(fd, 'r+b') as out:
+                out.truncate(size)
+                download = _Download(size, self.chunk_size, list(hashes), sources, out)
+                threads = [threading.Thread(target=self._worker, args=(download, source, quoted),
+                                            name="SwarmDownload", daemon=True)
+                           for source in sources for _ in range(self.connections_per_peer)]
+                for thread in threads:
+                    thread.start()
+                with download.cond:
+                    while not download.finished and not download.failed:
+                        download.cond.wait(1.0)
+                    failed = not download.finished
+                for thread in threads:
+                    thread.join()
+            if failed:
+                errors = '; '.join(f"{s.url}: {s.last_error}" for s in sources)
+                raise ValueError(f'All peers failed: {errors}')
+            os.replace(tmp_path, dest)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        elapsed = time.time() - started
+        return {
+            'path': dest,
+            'size': size,
+            'chunks': len(hashes),
+            'elapsed': round(elapsed, 3),
+            'rate': size / elapsed if elapsed else 0,
+            'peers': [source.to_dict() for source in sources],
+            'skipped_peers': [peer for peer, m in zip(peers, manifests) if not m or
+                              (m['size'], tuple(m['hashes'])) != (size, hashes)]
+        }
+
+    # ------------------------------------------------------------------
+    # Background jobs (started through the API)
+    # ------------------------------------------------------------------
+    def start_job(self, rel_path: str, peers: List[str]) -> str:
+        """Run a download in the background and return its job id."""
+        self.resolve(rel_path)
+        job_id = uuid.uuid4().hex[:12]
+        job = {'id': job_id, 'path': rel_path, 'peers': peers, 'state': 'running',
+               'started': time.time(), 'result': None, 'error': None}
+        with self._jobs_lock:
+            self._jobs[job_id] = job
+            finished = [j for j in self._jobs.values() if j['state'] != 'running']
+            finished.sort(key=lambda j: j['started'])
+            for old in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[old['id']]
+
+        def run():
+            try:
+                job['result'] = self.download(rel_path, peers)
+                job['state'] = 'done'
+            except Exception as e:
+                self.logger.error(f"Swarm download of {rel_path} failed: {e}")
+                job['error'] = str(e)
+                job['state'] = 'failed'
+
+        threading.Thread(target=run, name="SwarmJob", daemon=True).start()
+        return job_id
+
+    def get_jobs(self) -> List[Dict[str, Any]]:
+        with self._jobs_lock:
+            jobs = list(self._jobs.values())
+        return sorted(jobs, key=lambda job: job['started'], reverse=True)
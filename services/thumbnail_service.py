@@ -0,0 +1,454 @@
+import io
+import os
+import hashlib
+import logging
+import importlib.util
+import zipfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import configure_rarfile
+from utils.lazy_import import lazy_import
+
+# Pillow is imported by the first render, usually in a worker process
+HAS_PIL = importlib.util.find_spec('PIL') is not None
+Image = lazy_import('PIL.Image')
+ImageOps = lazy_import('PIL.ImageOps')
+
+rarfile = lazy_import('rarfile', on_load=configure_rarfile)
+
+# Raster formats Pillow can decode; SVG is served as-is by the viewers
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+ARCHIVE_EXTENSIONS = ('.zip', '.rar')
+
+# Bytes read from the head and tail of a file to build its content signature
+SIGNATURE_SAMPLE_SIZE = 64 * 1024
+
+# Archive members larger than this are not decoded for thumbnails
+MAX_MEMBER_SIZE = 64 * 1024 * 1024
+
+# Members rendered per worker task when pre-generating a whole archive
+ARCHIVE_BATCH_SIZE = 32
+
+MIME_TYPES = {
+    'WEBP': 'image/webp',
+    'JPEG': 'image/jpeg',
+}
+
+
+def _save_thumbnail(img, target_path: str, size: int, fmt: str, quality: int) -> None:
+    """Scale an opened image down to ``size`` and write it atomically to ``target_path``."""
+    # Let the JPEG decoder do most of the downscaling (DCT scaling is far
+    # cheaper than decoding the full camera resolution and resizing)
+    img.draft('RGB', (size, size))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((size, size), Image.LANCZOS)
+
+    if fmt == 'JPEG' and img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    elif img.mode == 'P':
+        img = img.convert('RGBA')
+
+    tmp_path = f"{target_path}.{os.getpid()}.tmp"
+    img.save(tmp_path, fmt, quality=quality)
+    os.replace(tmp_path, target_path)
+
+
+def _render_thumbnail(source_path: str, target_path: str, size: int, fmt: str, quality: int) -> bool:
+    """Render a single thumbnail. Runs inside a worker process."""
+    try:
+        with Image.open(source_path) as img:
+            _save_thumbnail(img, target_path, size, fmt, quality)
+        return True
+    except Exception as e:
+        # Half-written uploads and corrupt files end up here; the caller
+        # falls back to the regular file icon
+        print(f"Thumbnail generation failed for {source_path}: {e}")
+        return False
+
+
+def _open_archive(archive_path: str):
+    """Open a ZIP or RAR archive for reading individual members."""
+    if archive_path.lower().endswith('.rar'):
+        return rarfile.RarFile(archive_path)
+    return zipfile.ZipFile(archive_path)
+
+
+def _render_member(archive, member: str, target_path: str, size: int, fmt: str, quality: int) -> bool:
+    """Decode a single archive member and write its thumbnail."""
+    info = archive.getinfo(member)
+    if info.file_size > MAX_MEMBER_SIZE:
+        return False
+
+    # Only this member is decompressed; Pillow needs a seekable stream, so
+    # the (bounded) member is buffered in memory instead of extracted to disk
+    with archive.open(info) as stream:
+        data = io.BytesIO(stream.read())
+
+    with Image.open(data) as img:
+        _save_thumbnail(img, target_path, size, fmt, quality)
+    return True
+
+
+def _render_archive_member_thumbnail(archive_path: str, member: str, target_path: str,
+                                     size: int, fmt: str, quality: int) -> bool:
+    """Render the thumbnail of one image inside a ZIP/RAR archive. Runs inside a worker process."""
+    try:
+        with _open_archive(archive_path) as archive:
+            return _render_member(archive, member, target_path, size, fmt, quality)
+    except Exception as e:
+        print(f"Thumbnail generation failed for {archive_path}:{member}: {e}")
+        return False
+
+
+def _render_archive_batch(archive_path: str, jobs: List[Tuple[str, str]],
+                          size: int, fmt: str, quality: int) -> int:
+    """Render several members of one archive while opening it only once."""
+    rendered = 0
+    try:
+        with _open_archive(archive_path) as archive:
+            for member, target_path in jobs:
+                try:
+                    if _render_member(archive, member, target_path, size, fmt, quality):
+                        rendered += 1
+                except Exception as e:
+                    print(f"Thumbnail generation failed for {archive_path}:{member}: {e}")
+    except Exception as e:
+        print(f"Could not open archive {archive_path} for thumbnails: {e}")
+    return rendered
+
+
+class ThumbnailService:
+    """Generates fixed-size image thumbnails in a process pool and keeps them in a bounded disk cache."""
+
+    def __init__(self, cache_dir: str, size: int = 256, fmt: str = 'WEBP', quality: int = 80,
+                 max_cache_bytes: int = 512 * 1024 * 1024, workers: int = 2, enabled: bool = True,
+                 max_archive_members: int = 1000):
+        """
+        Initialize the ThumbnailService.
+
+        Args:
+            cache_dir: Directory the rendered thumbnails are stored in
+            size: Default bounding box (pixels) of a thumbnail
+            fmt: Output format, ``WEBP`` or ``JPEG``
+            quality: Encoder quality (1-100)
+            max_cache_bytes: Upper bound for the total size of the cache directory
+            workers: Number of worker processes used for rendering
+            enabled: Whether thumbnails are generated at all
+            max_archive_members: Maximum number of archive members pre-generated per archive
+        """
+        self.cache_dir = Path(cache_dir)
+        self.size = size
+        self.format = fmt if fmt in MIME_TYPES else 'JPEG'
+        self.quality = quality
+        self.max_cache_bytes = max_cache_bytes
+        self.workers = max(1, workers)
+        self.enabled = enabled and HAS_PIL
+        self.max_archive_members = max_archive_members
+        self.logger = logging.getLogger(__name__)
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._signatures: 'OrderedDict[str, Tuple[int, int, str]]' = OrderedDict()
+        self._signature_cache_limit = 100000
+        self._cache_bytes = 0
+        self._evicting = False
+
+        if not HAS_PIL:
+            self.logger.warning("Pillow is not installed, thumbnails are disabled (pip install Pillow)")
+            return
+
+        if self.enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Measuring an existing cache can take a while on slow disks
+            threading.Thread(target=self._measure_cache, name="ThumbnailCacheScan", daemon=True).start()
+
+    @property
+    def mimetype(self) -> str:
+        return MIME_TYPES[self.format]
+
+    def is_supported(self, file_path: str) -> bool:
+        """Check whether a thumbnail can be generated for the given file."""
+        return self.enabled and file_path.lower().endswith(IMAGE_EXTENSIONS)
+
+    @staticmethod
+    def version_tag(stat_info: os.stat_result) -> str:
+        """Cheap URL version derived from size and mtime, so thumbnail URLs can be cached forever."""
+        return f"{stat_info.st_size:x}-{stat_info.st_mtime_ns:x}"
+
+    def content_signature(self, file_path: str) -> Optional[str]:
+        """
+        Get the content signature of a file.
+
+        The signature hashes the size together with the first and last 64 KB of
+        the file, so copies and renames share one cached thumbnail. Results are
+        memoized per (size, mtime) to avoid re-reading unchanged files.
+
+        Args:
+            file_path: Absolute path to the file
+
+        Returns:
+            Hex digest or None if the file can't be read
+        """
+        try:
+            stat_info = os.stat(file_path)
+        except OSError:
+            return None
+
+        with self._lock:
+            cached = self._signatures.get(file_path)
+            if cached and cached[0] == stat_info.st_size and cached[1] == stat_info.st_mtime_ns:
+                self._signatures.move_to_end(file_path)
+                return cached[2]
+
+        digest = hashlib.sha1(str(stat_info.st_size).encode())
+        try:
+            with open(file_path, 'rb') as f:
+                digest.update(f.read(SIGNATURE_SAMPLE_SIZE))
+                if stat_info.st_size > SIGNATURE_SAMPLE_SIZE:
+                    f.seek(max(SIGNATURE_SAMPLE_SIZE, stat_info.st_size - SIGNATURE_SAMPLE_SIZE))
+                    digest.update(f.read(SIGNATURE_SAMPLE_SIZE))
+        except OSError as e:
+            self.logger.warning(f"Could not read {file_path} for signature: {e}")
+            return None
+
+        signature = digest.hexdigest()
+        with self._lock:
+            self._signatures[file_path] = (stat_info.st_size, stat_info.st_mtime_ns, signature)
+            if len(self._signatures) > self._signature_cache_limit:
+                self._signatures.popitem(last=False)
+        return signature
+
+    def get_thumbnail(self, file_path: str, size: Optional[int] = None, wait: bool = True) -> Optional[str]:
+        """
+        Get the cached thumbnail for an image, rendering it if necessary.
+
+        Args:
+            file_path: Absolute path to the source image
+            size: Bounding box in pixels (defaults to the service size)
+            wait: Block until the thumbnail is rendered
+
+        Returns:
+            Path to the thumbnail file, or None if it is not available (yet)
+        """
+        if not self.is_supported(file_path):
+            return None
+
+        signature = self.content_signature(file_path)
+        if not signature:
+            return None
+
+        return self._get_or_render(signature, size or self.size, wait,
+                                   _render_thumbnail, file_path)
+
+    def is_supported_archive(self, file_path: str) -> bool:
+        """Check whether image members of the given archive can get thumbnails."""
+        return self.enabled and file_path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+    def member_signature(self, archive_path: str, member: str) -> Optional[str]:
+        """Cache key of an archive member: the archive signature plus the member name."""
+        archive_signature = self.content_signature(archive_path)
+        if not archive_signature:
+            return None
+        return hashlib.sha1(f"{archive_signature}\0{member}".encode('utf-8')).hexdigest()
+
+    def get_archive_member_thumbnail(self, archive_path: str, member: str,
+                                     size: Optional[int] = None, wait: bool = True) -> Optional[str]:
+        """
+        Get the cached thumbnail for an image stored inside a ZIP or RAR archive.
+
+        Args:
+            archive_path: Absolute path to the archive
+            member: Name of the image member inside the archive
+            size: Bounding box in pixels (defaults to the service size)
+            wait: Block until the thumbnail is rendered
+
+        Returns:
+            Path to the thumbnail file, or None if it is not available (yet)
+        """
+        if not self.is_supported_archive(archive_path) or not self.is_supported(member):
+            return None
+
+        signature = self.member_signature(archive_path, member)
+        if not signature:
+            return None
+
+        return self._get_or_render(signature, size or self.size, wait,
+                                   _render_archive_member_thumbnail, archive_path, member)
+
+    def pregenerate(self, file_path: str) -> None:
+        """Queue thumbnail generation for a new or changed image (or archive) without waiting."""
+        try:
+            if self.is_supported_archive(file_path):
+                self.pregenerate_archive(file_path, self.max_archive_members)
+            else:
+                self.get_thumbnail(file_path, wait=False)
+        except Exception as e:
+            self.logger.error(f"Error queueing thumbnail for {file_path}: {e}")
+
+    def pregenerate_archive(self, archive_path: str, limit: int = 1000) -> int:
+        """
+        Queue thumbnails for the image members of an archive.
+
+        Members are rendered in batches so each worker opens the archive once
+        per batch instead of once per image.
+
+        Args:
+            archive_path: Absolute path to the archive
+            limit: Maximum number of members to queue
+
+        Returns:
+            Number of members queued
+        """
+        archive_signature = self.content_signature(archive_path)
+        if not archive_signature:
+            return 0
+
+        try:
+            with _open_archive(archive_path) as archive:
+                members = [info.filename for info in archive.infolist()
+                           if self.is_supported(info.filename) and info.file_size <= MAX_MEMBER_SIZE]
+        except Exception as e:
+            self.logger.warning(f"Could not list {archive_path} for thumbnails: {e}")
+            return 0
+
+        jobs = []
+        for member in members[:limit]:
+            signature = hashlib.sha1(f"{archive_signature}\0{member}".encode('utf-8')).hexdigest()
+            target = self._cache_path(signature, self.size)
+            if not target.exists():
+                jobs.append((member, str(target)))
+
+        for start in range(0, len(jobs), ARCHIVE_BATCH_SIZE):
+            batch = jobs[start:start + ARCHIVE_BATCH_SIZE]
+            with self._lock:
+                batch = [job for job in batch if job[1] not in self._pending]
+                if not batch:
+                    continue
+                for _, key in batch:
+                    os.makedirs(os.path.dirname(key), exist_ok=True)
+                future = self._get_executor().submit(
+                    _render_archive_batch, archive_path, batch, self.size, self.format, self.quality
+                )
+                for _, key in batch:
+                    self._pending[key] = future
+                    future.add_done_callback(lambda f, key=key: self._on_rendered(key, f))
+
+        return len(jobs)
+
+    def _get_or_render(self, signature: str, size: int, wait: bool, render_func, *source) -> Optional[str]:
+        """Return a cached thumbnail or render it with ``render_func(*source, target, size, fmt, quality)``."""
+        target = self._cache_path(signature, size)
+        if target.exists():
+            self._touch(target)
+            return str(target)
+
+        key = str(target)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                future = self._get_executor().submit(
+                    render_func, *source, key, size, self.format, self.quality
+                )
+                future.add_done_callback(lambda f, key=key: self._on_rendered(key, f))
+                self._pending[key] = future
+
+        if not wait:
+            return None
+
+        try:
+            future.result(timeout=30)
+            if target.exists():
+                return key
+        except Exception as e:
+            self.logger.error(f"Thumbnail rendering failed for {key}: {e}")
+        return None
+
+    def _on_rendered(self, key: str, future: Future) -> None:
+        with self._lock:
+            self._pending.pop(key, None)
+
+        # Batch tasks share one future, so check the output file itself
+        try:
+            added = os.path.getsize(key)
+        except OSError:
+            return
+
+        with self._lock:
+            self._cache_bytes += added
+            over_limit = self._cache_bytes > self.max_cache_bytes and not self._evicting
+            if over_limit:
+                self._evicting = True
+        if over_limit:
+            threading.Thread(target=self._evict, name="ThumbnailCacheEvict", daemon=True).start()
+
+    def _cache_path(self, signature: str, size: int) -> Path:
+        ext = 'webp' if self.format == 'WEBP' else 'jpg'
+        return self.cache_dir / signature[:2] / f"{signature}-{size}.{ext}"
+
+    @staticmethod
+    def _touch(path: Path) -> None:
+        # mtime doubles as the LRU clock for eviction (atime is often disabled)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _scan_cache(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _measure_cache(self) -> None:
+        total = sum(size for _, size, _ in self._scan_cache())
+        with self._lock:
+            self._cache_bytes = total
+            over_limit = total > self.max_cache_bytes and not self._evicting
+            if over_limit:
+                self._evicting = True
+        if over_limit:
+            self._evict()
+
+    def _evict(self) -> None:
+        """Delete least recently used thumbnails until the cache is back under 90% of its limit."""
+        entries = sorted(self._scan_cache())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_cache_bytes * 0.9)
+
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+
+        with self._lock:
+            self._cache_bytes = total
+            self._evicting = False
+        self.logger.info(f"Thumbnail cache trimmed to {total} bytes")
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,130 @@
+"""
+FastCDC-style content-defined chunking.
+
+Cut points depend only on the bytes just before them, so an insertion or
+deletion changes the chunks around the edit and the rest of the file
+splits exactly as before. The gear table comes from a fixed seed: every
+node cuts the same content at the same offsets, which is what lets nodes
+deduplicate against each other.
+
+The 32-bit gear hash of every position of a buffer is computed at once
+with numpy, in log2(32) shifted passes instead of one Python step per
+byte. Cut points are then picked among the candidates with FastCDC's
+normalized chunking: a stricter mask before the average size and a
+looser one after it, which keeps chunk sizes close to the average.
+"""
+import math
+import hashlib
+from functools import lru_cache
+from typing import BinaryIO, Iterator, List, Optional
+
+from utils.lazy_import import lazy_import
+
+np = lazy_import('numpy')
+
+# Bytes that contribute to the hash of a position, one per bit of the hash
+WINDOW = 32
+# Mask bits added before and removed after the average size
+NORMALIZATION = 2
+READ_SIZE = 4 * 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def _gear():
+    return np.array([int.from_bytes(hashlib.blake2b(b'fastcdc-gear-%d' % i, digest_size=4).digest(), 'big')
+                     for i in range(256)], dtype=np.uint32)
+
+
+def _mask(bits: int) -> int:
+    # Spread over the upper 24 bits: bit j of the hash depends on the last j + 1 bytes only
+    return sum(1 << (31 - (i * 24) // bits) for i in range(bits))
+
+
+def gear_hashes(data: bytes):
+    """Gear hash at every position of ``data``: sum of gear[data[i - k]] << k over the last 32 bytes."""
+    hashes = np.take(_gear(), np.frombuffer(data, dtype=np.uint8))
+    shifted = np.empty_like(hashes)
+    width = 1
+    while width < WINDOW:
+        # Hashes over 2 * width bytes from two hashes over width bytes
+        np.left_shift(hashes[:-width], np.uint32(width), out=shifted[width:])
+        np.add(hashes[width:], shifted[width:], out=hashes[width:])
+        width *= 2
+    return hashes
+
+
+def _first(candidates, low: int, high: int) -> Optional[int]:
+    """Smallest chunk end in [low, high) among candidate positions (a cut after byte p ends at p + 1)."""
+    i = int(np.searchsorted(candidates, low - 1))
+    if i < len(candidates) and candidates[i] + 1 < high:
+        return int(candidates[i]) + 1
+    return None
+
+
+class Chunker:
+    """Splits byte streams into content-defined chunks of ``min_size`` to ``max_size`` bytes."""
+
+    def __init__(self, avg_size: int = 32 * 1024, min_size: Optional[int] = None, max_size: Optional[int] = None):
+        """
+        Initialize the Chunker.
+
+        Args:
+            avg_size: Typical chunk size; rounded to a power of two
+            min_size: Smallest chunk except the last one (default avg_size / 4)
+            max_size: Largest chunk (default avg_size * 4)
+        """
+        bits = min(24 - NORMALIZATION, max(NORMALIZATION + 1, round(math.log2(avg_size))))
+        self.avg_size = 1 << bits
+        # A position at least WINDOW bytes into its chunk has a full hash window within the chunk
+        self.min_size = max(WINDOW, min_size or self.avg_size // 4)
+        self.max_size = max(self.avg_size, max_size or self.avg_size * 4)
+        self.strict_mask = np.uint32(_mask(bits + NORMALIZATION))
+        self.loose_mask = np.uint32(_mask(bits - NORMALIZATION))
+
+    def cuts(self, data: bytes, eof: bool = True) -> List[int]:
+        """
+        End offsets of the chunks ``data`` (which starts at a chunk boundary) splits into.
+
+        Without ``eof`` the bytes after the last offset need more data to be
+        cut and should be passed again with what follows.
+        """
+        size = len(data)
+        if not size:
+            return []
+        hashes = gear_hashes(data)
+        strict = np.flatnonzero((hashes & self.strict_mask) == 0)
+        loose = np.flatnonzero((hashes & self.loose_mask) == 0)
+        cuts = []
+        start = 0
+        while start < size:
+            middle = start + self.avg_size
+            end = _first(strict, start + self.min_size, min(middle, size + 1))
+            if end is None:
+                if middle > size and not eof:
+                    break
+                end = _first(loose, middle, min(start + self.max_size, size + 1))
+            if end is None:
+                if start + self.max_size > size:
+                    if not eof:
+                        break
+                    end = size
+                else:
+                    end = start + self.max_size
+            cuts.append(end)
+            start = end
+        return cuts
+
+    def chunks(self, stream: BinaryIO, read_size: int = READ_SIZE) -> Iterator[bytes]:
+        """Chunks of everything read from ``stream``."""
+        pending = b''
+        while True:
+            block = stream.read(read_size)
+            eof = not block
+            data = pending + block if pending else block
+            start = 0
+            for end in self.cuts(data, eof):
+                yield data[start:end]
+                start = end
+            pending = data[start:]
+            if eof:
+                return
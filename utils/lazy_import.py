@@ -0,0 +1,65 @@
+"""Deferred imports for heavy or optional modules."""
+import importlib
+import threading
+import types
+from typing import Any, Callable, Dict, Optional
+
+_modules: Dict[str, 'LazyModule'] = {}
+_registry_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is imported on first attribute access.
+
+    ``requests.get(...)`` or ``except rarfile.Error`` work as usual; the
+    import cost is paid by the first caller instead of at start-up. A
+    missing module raises ImportError at that point, not earlier.
+    """
+
+    def __init__(self, name: str, on_load: Optional[Callable[[types.ModuleType], None]] = None):
+        super().__init__(name)
+        object.__setattr__(self, '_lazy_module', None)
+        object.__setattr__(self, '_lazy_on_load', on_load)
+        object.__setattr__(self, '_lazy_lock', threading.Lock())
+
+    def _load(self) -> types.ModuleType:
+        module = self._lazy_module
+        if module is not None:
+            return module
+        with self._lazy_lock:
+            if self._lazy_module is None:
+                module = importlib.import_module(self.__name__)
+                if self._lazy_on_load:
+                    self._lazy_on_load(module)
+                object.__setattr__(self, '_lazy_module', module)
+        return self._lazy_module
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._load(), name, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    @property
+    def loaded(self) -> bool:
+        return self._lazy_module is not None
+
+
+def lazy_import(name: str, on_load: Optional[Callable[[types.ModuleType], None]] = None) -> LazyModule:
+    """
+    Return a lazily imported module; every caller of the same name shares one stand-in.
+
+    Args:
+        name: Absolute module name
+        on_load: Called once with the real module right after it is imported
+                 (only the first registration's hook is kept)
+    """
+    with _registry_lock:
+        module = _modules.get(name)
+        if module is None:
+            module = _modules[name] = LazyModule(name, on_load)
+        return module
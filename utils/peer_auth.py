@@ -0,0 +1,42 @@
+"""
+Authentication of node-to-node requests.
+
+Peer endpoints read and write shared files on behalf of other devices,
+so they only answer requests that carry the network's shared token in
+the ``X-Peer-Token`` header (or come from a logged-in browser session).
+Every client session of the peer services sends the token.
+
+The token is ``PEER_TOKEN`` when set; otherwise it is derived from the
+login password, so devices set up with the same password trust each
+other without further configuration.
+"""
+import hmac
+import hashlib
+from typing import Dict, Optional
+
+HEADER = 'X-Peer-Token'
+
+_token: Optional[str] = None
+
+
+def derive(password: str) -> str:
+    """Token of a network whose devices share ``password``."""
+    return hashlib.sha256(b'peer-token:' + password.encode('utf-8')).hexdigest()
+
+
+def configure(token: str):
+    """Set the token this node sends and accepts."""
+    global _token
+    _token = token
+
+
+def headers() -> Dict[str, str]:
+    """Request headers that authenticate this node to its peers."""
+    return {HEADER: _token} if _token else {}
+
+
+def verify(value: Optional[str]) -> bool:
+    """Whether ``value`` (the request's token header) is this network's token."""
+    if not _token or not value:
+        return False
+    return hmac.compare_digest(value.encode('utf-8'), _token.encode('utf-8'))
@@ -0,0 +1,55 @@
+"""Per-phase timing of server start-up (``server --profile-startup``)."""
+import time
+import threading
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+
+class StartupProfile:
+    """
+    Records when each start-up phase began and how long it took.
+
+    Times are relative to ``started`` (by default the moment the profile
+    was created, which main.py does before its heavy imports). Phases may
+    run concurrently on different threads; the report lists them by start
+    time, so overlapping phases are easy to spot.
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self._phases: List[Tuple[str, float, float, Optional[str]]] = []  # name, start, duration, error
+        self._lock = threading.Lock()
+        self.first_request: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block; exceptions are recorded and re-raised."""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            self.record(name, start, time.perf_counter(), error)
+
+    def record(self, name: str, start: float, end: float, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._phases.append((name, start - self.started, end - start, error))
+
+    def mark_first_request(self) -> None:
+        if self.first_request is None:
+            self.first_request = time.perf_counter() - self.started
+
+    def report(self) -> str:
+        with self._lock:
+            phases = sorted(self._phases, key=lambda phase: phase[1])
+        width = max([len(name) for name, _, _, _ in phases] + [13])
+        lines = [f"{'phase':<{width}}   start(ms)   took(ms)"]
+        for name, start, duration, error in phases:
+            line = f"{name:<{width}}  {start * 1000:>10.1f} {duration * 1000:>10.1f}"
+            lines.append(f"{line}   FAILED: {error}" if error else line)
+        if self.first_request is not None:
+            lines.append(f"{'first request':<{width}}  {self.first_request * 1000:>10.1f}")
+        return '\n'.join(lines)
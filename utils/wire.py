@@ -0,0 +1,224 @@
+"""
+Wire format of node-to-node APIs.
+
+Peer endpoints answer in the best body format the client accepts
+(msgpack, CBOR, JSON) and compress larger bodies with zstd or gzip.
+Browsers and old clients still get plain JSON. msgpack, cbor2 and
+zstandard are optional; without them JSON and gzip are used.
+
+A client cannot know in advance what a peer understands, so request
+bodies are sent as JSON until the peer has answered once. A binary
+response means the peer reads that format as well, and the peer's
+``Accept-Encoding`` response header (RFC 7694) lists the encodings it
+accepts for request bodies.
+"""
+import io
+import gzip
+import json
+import threading
+import importlib.util
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from werkzeug.http import http_date
+
+from utils.lazy_import import lazy_import
+
+msgpack = lazy_import('msgpack')
+cbor2 = lazy_import('cbor2')
+zstandard = lazy_import('zstandard')
+HAS_MSGPACK = importlib.util.find_spec('msgpack') is not None
+HAS_CBOR = importlib.util.find_spec('cbor2') is not None
+HAS_ZSTD = importlib.util.find_spec('zstandard') is not None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+CBOR = 'application/cbor'
+MIMETYPE_ALIASES = {'application/x-msgpack': MSGPACK, 'application/vnd.msgpack': MSGPACK}
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 5
+# Refuse compressed bodies that expand beyond this
+MAX_DECOMPRESSED_SIZE = 256 * 1024 * 1024
+
+# Peer (scheme://host:port) -> (body format, request encoding) learned from its responses
+_peers: Dict[str, Tuple[str, Optional[str]]] = {}
+_peers_lock = threading.Lock()
+
+
+def formats() -> Tuple[str, ...]:
+    """Body formats this node reads and writes, best first."""
+    return tuple(mimetype for mimetype, available in ((MSGPACK, HAS_MSGPACK), (CBOR, HAS_CBOR), (JSON, True))
+                 if available)
+
+
+def encodings() -> Tuple[str, ...]:
+    """Content encodings this node reads and writes, best first."""
+    return ('zstd', 'gzip') if HAS_ZSTD else ('gzip',)
+
+
+def _default(obj: Any) -> Any:
+    # Same representation as Flask's JSON provider, so every format carries the same values
+    if isinstance(obj, datetime):
+        return http_date(obj)
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} cannot be serialized")
+
+
+def encode(obj: Any, mimetype: str) -> bytes:
+    if mimetype == MSGPACK:
+        return msgpack.packb(obj, default=_default, use_bin_type=True)
+    if mimetype == CBOR:
+        return cbor2.dumps(obj, default=lambda encoder, value: encoder.encode(_default(value)))
+    return json.dumps(obj, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def decode(data: bytes, mimetype: str) -> Any:
+    """Raises ValueError if ``data`` is not valid ``mimetype``."""
+    mimetype = MIMETYPE_ALIASES.get(mimetype, mimetype)
+    try:
+        if mimetype == MSGPACK:
+            return msgpack.unpackb(data, raw=False, strict_map_key=False)
+        if mimetype == CBOR:
+            return cbor2.loads(data)
+        return json.loads(data)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Invalid {mimetype} body: {e}") from e
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def decompress(data: bytes, encoding: Optional[str]) -> bytes:
+    """Raises ValueError for an unknown encoding, a corrupt body or one above MAX_DECOMPRESSED_SIZE."""
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        return data
+    try:
+        if encoding == 'zstd' and HAS_ZSTD:
+            reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+        elif encoding in ('gzip', 'x-gzip'):
+            reader = gzip.GzipFile(fileobj=io.BytesIO(data))
+        else:
+            raise ValueError(f"Unsupported content encoding: {encoding}")
+        with reader:
+            out = reader.read(MAX_DECOMPRESSED_SIZE + 1)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Invalid {encoding} body: {e}") from e
+    if len(out) > MAX_DECOMPRESSED_SIZE:
+        raise ValueError('Decompressed body is too large')
+    return out
+
+
+# ----------------------------------------------------------------------
+# Server side
+# ----------------------------------------------------------------------
+def response(payload: Any, status: int = 200):
+    """
+    ``jsonify`` for peer endpoints: the body format and compression follow the request's Accept headers.
+
+    A client without preferences (browser, curl, older peers) gets the
+    same JSON as from ``jsonify``.
+    """
+    from flask import Response, current_app, request
+
+    mimetype = request.accept_mimetypes.best_match((JSON,) + formats()[:-1], default=JSON)
+    if mimetype == JSON:
+        body = current_app.json.dumps(payload).encode('utf-8')
+    else:
+        body = encode(payload, mimetype)
+    headers = {'Vary': 'Accept, Accept-Encoding', 'Accept-Encoding': ', '.join(encodings())}
+    if len(body) >= MIN_COMPRESS_SIZE:
+        for encoding in encodings():
+            if request.accept_encodings[encoding]:
+                body = compress(body, encoding)
+                headers['Content-Encoding'] = encoding
+                break
+    return Response(body, status=status, mimetype=mimetype, headers=headers)
+
+
+def request_data() -> Optional[Any]:
+    """Decoded request body (JSON, msgpack or CBOR, optionally compressed); None if missing or invalid."""
+    from flask import request
+
+    mimetype = MIMETYPE_ALIASES.get(request.mimetype, request.mimetype)
+    if mimetype not in formats():
+        return None
+    try:
+        return decode(decompress(request.get_data(cache=True), request.headers.get('Content-Encoding')), mimetype)
+    except ValueError:
+        return None
+
+
+# ----------------------------------------------------------------------
+# Client side
+# ----------------------------------------------------------------------
+def _peer_key(url: str) -> str:
+    # Devices behind one relay share its host, but not its /api/relay/<device> prefix
+    base, found, _ = url.partition('/api/peer/')
+    if found:
+        return base.rstrip('/')
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def client_headers() -> Dict[str, str]:
+    """Accept headers asking a peer for the most compact answer."""
+    available = formats()
+    accept = ', '.join(f"{mimetype};q={1 - i / 10:.1f}" if i else mimetype for i, mimetype in enumerate(available))
+    return {'Accept': accept, 'Accept-Encoding': ', '.join(encodings())}
+
+
+def encode_request(obj: Any, url: str) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Body and headers for a request to ``url``, in the best format the peer is known to read.
+
+    Returns:
+        (body, headers) for ``requests`` (``data=body, headers=headers``)
+    """
+    with _peers_lock:
+        mimetype, encoding = _peers.get(_peer_key(url), (JSON, None))
+    body = encode(obj, mimetype)
+    headers = {**client_headers(), 'Content-Type': mimetype}
+    if encoding and len(body) >= MIN_COMPRESS_SIZE:
+        body = compress(body, encoding)
+        headers['Content-Encoding'] = encoding
+    return body, headers
+
+
+def decode_response(response) -> Any:
+    """
+    Body of a ``requests`` response in any wire format; remembers what the peer understands.
+
+    Raises:
+        ValueError: The body cannot be decoded
+    """
+    from urllib3.response import HTTPResponse
+
+    mimetype = response.headers.get('Content-Type', JSON).split(';')[0].strip().lower()
+    mimetype = MIMETYPE_ALIASES.get(mimetype, mimetype)
+    body = response.content
+    encoding = response.headers.get('Content-Encoding')
+    if encoding and encoding.lower() not in HTTPResponse.CONTENT_DECODERS:
+        # urllib3 decodes gzip itself; zstd only with some versions
+        body = decompress(body, encoding)
+
+    accepted = [e.strip().lower() for e in response.headers.get('Accept-Encoding', '').split(',')]
+    request_encoding = next((e for e in encodings() if e in accepted), None)
+    learned = (mimetype if mimetype in formats() else JSON, request_encoding)
+    with _peers_lock:
+        _peers[_peer_key(response.url)] = learned
+    return decode(body, mimetype if mimetype in formats() else JSON)